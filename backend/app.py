@@ -2,11 +2,17 @@
 import os
 import csv
 import json
+import time
+import uuid
+import base64
+import threading
 from io import StringIO
 from datetime import datetime as DateTime, date as Date, time as Time
-from flask import Flask, jsonify, render_template, request, send_from_directory
+from flask import Flask, Response, jsonify, render_template, request, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError, OperationalError
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
@@ -19,14 +25,36 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
 from flask_caching import Cache
 from flask_mail import Mail, Message
-from celery import Celery
+from celery import Celery, chord, group
 from celery.schedules import crontab
+import click
 
 # Initialize mail
 
 # Import models from models.py (assumed to exist)
 # models.py should define: db, User, DoctorProfile, PatientProfile, Appointment, Treatment
-from models import db, User, DoctorProfile, PatientProfile, Appointment, Treatment,Department
+from models import db, User, DoctorProfile, PatientProfile, Appointment, Treatment,Department, EmailOutbox
+from models import AvailabilityTemplate, AvailabilityException, ReportFile
+from migrations import upgrade as upgrade_schema, current_version as schema_version
+from instrumentation import init_metrics
+from database import database_url, engine_options, sqlite_pragmas, init_sqlite_pragmas
+from revocation import revoked_users, bump_revocation_version
+from fulltext import KINDS as SEARCH_KINDS, search_available, search_documents, rebuild_search_index
+from conditional import conditional, install_version_tracking, compress_response, table_versions
+from importer import Importer, BATCH_SIZE as IMPORT_BATCH_SIZE
+from archive import TIERS, archive_old_appointments, through_tiers, treated_by
+from rollups import DAY, MONTH, MEASURE_NAMES, track_appointment, rebuild_rollups, rollup_series, rollup_leaders
+from reports import (
+    TREATMENTS as TREATMENTS_REPORT, APPOINTMENTS as APPOINTMENTS_REPORT, MONTHLY as MONTHLY_REPORT,
+    absolute_path as report_file_path, reports_dir, write_report, live_reports, expire_reports, purge_expired_reports,
+)
+from availability import (
+    expand_availability, day_flags, replace_weekly, replace_exceptions, apply_day_flags, check_slot, SlotTaken,
+)
+from stats import (
+    bump_stat, user_stat, track_new_appointment, track_status_change, track_date_change,
+    recompute_stats, read_stats, TOTAL_APPOINTMENTS, UPCOMING,
+)
 
 # ---------------------------
 # App & config
@@ -36,16 +64,15 @@ app = Flask(
     template_folder="templates",  # adjust if needed
     static_folder="../frontend",
     static_url_path="/static",
+    # keep instance/hospital.db next to this file even when loaded as backend.app by the flask CLI
+    instance_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance"),
 )
 mail = Mail(app)
 # --- Basic config (tweak for production) ---
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///hospital.db"
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "connect_args": {
-        "check_same_thread": False,
-        "timeout": 30
-    }
-}
+# DATABASE_URL selects SQLite or PostgreSQL; pool and pragma settings are in database.py
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+app.config["SQLITE_PRAGMAS"] = sqlite_pragmas()
 
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["JWT_SECRET_KEY"] = "change_this_to_a_real_secret"  # set a secure key
@@ -56,19 +83,33 @@ app.config["result_backend"] = "redis://localhost:6379/0"
 app.config["CACHE_TYPE"] = "SimpleCache"  # or RedisCache in prod
 app.config["CACHE_DEFAULT_TIMEOUT"] = 60
 # Mail (configure for your provider)
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
+# For local testing point these at a debugging SMTP server, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
+#   MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0 python app.py
+app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
+app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", 587))
+app.config["MAIL_USE_TLS"] = os.environ.get("MAIL_USE_TLS", "1") == "1"
+app.config["MAIL_SUPPRESS_SEND"] = os.environ.get("MAIL_SUPPRESS_SEND") == "1"
 app.config["MAIL_USERNAME"] = "ahms84250@gmail.com"
 app.config["MAIL_PASSWORD"] = "egyd qjxw hfzu ovfs"
 app.config["MAIL_DEFAULT_SENDER"] = "ahms84250@gmail.com"
 
+# Per-route query count / latency (Server-Timing headers + /metrics), off by default
+app.config["METRICS_ENABLED"] = os.environ.get("HMS_METRICS") == "1"
+
 # init extensions
 db.init_app(app)
+with app.app_context():
+    init_sqlite_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+# per-table version stamps behind the ETags of @conditional views
+install_version_tracking(db.session)
+app.after_request(compress_response)
 jwt = JWTManager(app)
 cache = Cache(app)
 mail = Mail(app)
 CORS(app)
+if app.config["METRICS_ENABLED"]:
+    init_metrics(app)
 def appointment_to_dict(a):
     """Return a JSON-serializable dict for an Appointment object."""
     return {
@@ -115,25 +156,44 @@ celery.conf.beat_max_loop_interval = 1
 
 # Celery beat schedule (if you run celery beat)
 celery.conf.beat_schedule = {
+    # safety net: requests kick the drain themselves, this picks up retries
+    "drain-email-outbox": {
+        "task": "tasks.drain_email_outbox",
+        "schedule": 60.0,
+    },
     "send-daily-reminder-12-30": {
         "task": "tasks.daily_reminder",
         #  "schedule": crontab()
         "schedule": crontab(hour=17, minute=53),
     },
+    "reconcile-hospital-stats": {
+        "task": "tasks.reconcile_hospital_stats",
+        "schedule": crontab(hour=0, minute=5),
+    },
     "monthly-doctor-activity": {
         "task": "tasks.monthly_doctor_activity",
         "schedule": crontab(hour=17, minute=53, day_of_month=30),
-    }
+    },
+    "purge-expired-reports": {
+        "task": "tasks.purge_expired_reports",
+        "schedule": crontab(minute=15),
+    },
+    "archive-old-appointments": {
+        "task": "tasks.archive_old_appointments",
+        "schedule": crontab(hour=1, minute=30),
+    },
 }
 
-# Ensure reports dir exists
-REPORTS_DIR = os.path.join(app.root_path, "reports")
+# Ensure reports dir exists; files go in shard subdirectories (see reports.py)
+app.config.setdefault("REPORTS_DIR", os.path.join(app.root_path, "reports"))
+REPORTS_DIR = app.config["REPORTS_DIR"]
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
 def initialize_database():
     """Create tables and default admin if not already created."""
     with app.app_context():
-        db.create_all()
+        # create_all + any pending index/column migrations
+        upgrade_schema()
 
         # Create default admin only if missing
         admin = User.query.filter_by(role="admin").first()
@@ -146,10 +206,93 @@ def initialize_database():
                 blocked=False,
             )
             db.session.add(admin)
+            bump_stat(user_stat("admin"))
             db.session.commit()
 
         # Ensure reports directory exists
-        os.makedirs(REPORTS_DIR, exist_ok=True)
+        os.makedirs(reports_dir(), exist_ok=True)
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Bring an existing database (e.g. instance/hospital.db) up to the current schema."""
+    try:
+        applied = upgrade_schema()
+    except Exception as e:
+        db.session.rollback()
+        # nonzero exit status, so deploy scripts stop instead of starting on a half-migrated database
+        raise click.ClickException(f"Upgrade failed: {e}") from e
+    if applied:
+        print("Applied migrations:", ", ".join(str(v) for v in applied))
+    print("Schema version:", schema_version())
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Refill the full-text search index from the patient, doctor and treatment tables."""
+    if not search_available():
+        print("Full-text search needs SQLite (FTS5)")
+        return
+    rebuild_search_index()
+    db.session.commit()
+    print("Search index rebuilt")
+
+
+@app.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """Recount the daily appointment rollups behind /admin/analytics from both appointment tiers."""
+    total = rebuild_rollups()
+    db.session.commit()
+    print(f"Rollups rebuilt from {total} appointments")
+
+
+@app.cli.command("import")
+@click.option("--departments", type=click.Path(exists=True, dir_okay=False), help="CSV or JSONL file")
+@click.option("--doctors", type=click.Path(exists=True, dir_okay=False), help="CSV or JSONL file")
+@click.option("--patients", type=click.Path(exists=True, dir_okay=False), help="CSV or JSONL file")
+@click.option("--appointments", type=click.Path(exists=True, dir_okay=False), help="CSV or JSONL file")
+@click.option("--treatments", type=click.Path(exists=True, dir_okay=False), help="CSV or JSONL file")
+@click.option("--id-map", type=click.Path(dir_okay=False), help="JSONL of legacy -> new ids, read and appended to")
+@click.option("--default-password", help="password for accounts that have neither password nor password_hash")
+@click.option("--workers", type=int, help="password hashing processes (default: one per CPU)")
+@click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+@click.option("--report", "report_path", type=click.Path(dir_okay=False), help="write the validation report here as JSON")
+@click.option("--dry-run", is_flag=True, help="validate and insert everything, then roll back")
+def import_command(report_path, id_map, default_password, workers, batch_size, dry_run, **files):
+    """Bulk-load departments, doctors, patients, appointments and treatments (see importer.py)."""
+    if not any(files.values()):
+        raise click.UsageError("Give at least one of --departments, --doctors, --patients, --appointments, --treatments")
+    importer = Importer(
+        id_map=id_map, batch_size=batch_size, workers=workers,
+        default_password=default_password, dry_run=dry_run,
+    )
+    start = time.perf_counter()
+    report = importer.run(files)
+
+    for kind, counts in report["counts"].items():
+        print(f"{kind:13} " + "  ".join(f"{name} {n}" for name, n in counts.items()))
+    for error in report["errors"][:20]:
+        print(f"  {error['file']}:{error['line']}: {error['message']}")
+    if len(report["errors"]) > 20 or report["errors_not_listed"]:
+        print(f"  ... {len(report['errors']) - 20 + report['errors_not_listed']} more errors" + (f", see {report_path}" if report_path else ""))
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(f"{'Checked' if dry_run else 'Imported'} in {time.perf_counter() - start:.1f}s" + (" (dry run, nothing saved)" if dry_run else ""))
+
+
+# ---------------------------
+# Token revocation: blocked users and unapproved doctors lose access on their
+# next request, not when their token expires (see revocation.py)
+# ---------------------------
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    return revoked_users.is_revoked(jwt_payload.get("user_id"))
+
+
+@jwt.revoked_token_loader
+def revoked_token_response(jwt_header, jwt_payload):
+    return jsonify({"category": "danger", "message": "Your account is blocked or not approved."}), 401
+
 
 # ---------------------------
 # Helpers
@@ -166,6 +309,179 @@ def is_patient_claims(claims):
     return claims.get("role") == "patient"
 
 
+def parse_date_arg(name):
+    """Read an optional YYYY-MM-DD query parameter; raises ValueError if malformed."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_bool_arg(name):
+    """Read an optional true/false (or 1/0) query parameter; raises ValueError if malformed."""
+    value = request.args.get(name, "").lower()
+    if not value:
+        return None
+    if value in ("1", "true"):
+        return True
+    if value in ("0", "false"):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+# Keyset pagination: a cursor encodes the sort key of the last row sent
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_ids_arg(name="ids"):
+    """Read an optional comma separated list of ids (at most MAX_PAGE_SIZE); raises ValueError if malformed."""
+    value = request.args.get(name, "")
+    if not value:
+        return None
+    try:
+        ids = [int(v) for v in value.split(",")]
+    except ValueError:
+        raise ValueError(f"{name} must be comma separated ids")
+    if len(ids) > MAX_PAGE_SIZE:
+        raise ValueError(f"{name} takes at most {MAX_PAGE_SIZE} ids")
+    return ids
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode("|".join(str(v) for v in values).encode()).decode()
+
+
+def decode_cursor(cursor, count):
+    """Split a cursor back into its string parts; raises ValueError if it was tampered with."""
+    parts = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    if len(parts) != count:
+        raise ValueError("bad cursor")
+    return parts
+
+
+def page_limit():
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+# "database is locked" retries for slot reservations
+BOOKING_RETRIES = 3
+BOOKING_RETRY_DELAY = 0.05  # seconds, doubled on each attempt
+
+
+def commit_slot_change(apply):
+    """
+    Stage a slot change with `apply()` and commit it in one transaction.
+
+    The partial unique index uq_appointments_booked_slot is what guarantees a
+    slot is booked only once: if a concurrent request got there first the
+    commit raises IntegrityError and we return False (caller answers 409).
+    Overlapping slots that start at different times are caught by `apply`
+    re-running check_slot() after its flush and raising SlotTaken.
+    Lock timeouts are rolled back and retried with backoff; `apply` is called
+    again on each attempt because the rollback discards staged changes.
+    """
+    for attempt in range(BOOKING_RETRIES):
+        try:
+            apply()
+            db.session.commit()
+            return True
+        except (IntegrityError, SlotTaken):
+            db.session.rollback()
+            return False
+        except OperationalError:
+            db.session.rollback()
+            if attempt == BOOKING_RETRIES - 1:
+                raise
+            time.sleep(BOOKING_RETRY_DELAY * 2 ** attempt)
+
+
+def recheck_slot(appt):
+    """
+    Call from a commit_slot_change `apply` after flushing `appt`: raises
+    SlotTaken if a booking committed meanwhile overlaps it. On SQLite the
+    flush holds the single writer lock, so nothing can commit in between;
+    elsewhere the doctor's user row is locked first.
+    """
+    if db.engine.dialect.name != "sqlite":
+        db.session.query(User.id).filter_by(id=appt.doctor_id).with_for_update().one()
+    if check_slot(appt.doctor_id, appt.date, appt.time, ignore_appointment_id=appt.id):
+        raise SlotTaken()
+
+
+# ---------------------------
+# Directory cache: departments and approved doctors change rarely but are
+# read on every patient page. Entries are keyed by the version stamps of the
+# tables they are built from (see conditional.py). Every committed write
+# bumps those stamps in the database, whichever process makes it (the web
+# workers, flask import, datagen, Celery), so no process can keep serving a
+# stale copy, even with a per-process SimpleCache.
+# ---------------------------
+DIRECTORY_CACHE_TIMEOUT = 300
+DIRECTORY_TABLES = ("users", "departments", "doctor_profiles")
+
+cache_stats = {}
+cache_stats_lock = threading.Lock()
+
+
+def count_cache_lookup(name, hit):
+    with cache_stats_lock:
+        stats = cache_stats.setdefault(name, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+
+def directory_version():
+    return ".".join(f"{v}" for _, v in sorted(table_versions(DIRECTORY_TABLES).items()))
+
+
+def cached_directory(name, loader, *args):
+    key = f"directory:{directory_version()}:{name}:" + ":".join(str(a) for a in args)
+    value = cache.get(key)
+    count_cache_lookup(name, value is not None)
+    if value is None:
+        value = loader(*args)
+        cache.set(key, value, timeout=DIRECTORY_CACHE_TIMEOUT)
+    return value
+
+
+def load_departments():
+    return [{"id": d.id, "name": d.name, "description": d.description} for d in Department.query.all()]
+
+
+def load_department_doctors(dept_id):
+    dept = db.session.get(Department, dept_id)
+    if not dept:
+        return {}  # cached too, so unknown ids don't hit the database either
+
+    # Get doctors who specialize in this department
+    doctors = (
+        db.session.query(User, DoctorProfile)
+        .join(DoctorProfile, DoctorProfile.user_id == User.id)
+        .filter(
+            User.role == "doctor",
+            User.approve == True,
+            DoctorProfile.specialization_id == dept_id
+        )
+        .all()
+    )
+
+    return {
+        "department": {
+            "id": dept.id,
+            "name": dept.name,
+            "description": dept.description
+        },
+        "doctors": [
+            {"id": user.id, "name": user.username, "experience": profile.experience}
+            for user, profile in doctors
+        ]
+    }
+
+
 # ---------------------------
 # Home
 # ---------------------------
@@ -203,7 +519,8 @@ def register():
         approve=True  # immediate approval
     )
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()  # assigns user.id; user, profile and counter commit together
+    bump_stat(user_stat(role))
 
     # Create Patient Profile
     profile = PatientProfile(
@@ -289,6 +606,7 @@ def admin_login():
 
 @app.route("/admin/departments", methods=["GET", "POST"])
 @jwt_required()
+@conditional("departments")
 def admin_departments():
     claims = get_jwt()
     if claims.get("role") != "admin":
@@ -298,15 +616,7 @@ def admin_departments():
     # GET → return all departments
     # -----------------------------------------
     if request.method == "GET":
-        departments = Department.query.all()
-        return jsonify([
-            {
-                "id": d.id,
-                "name": d.name,
-                "description": d.description
-            }
-            for d in departments
-        ]), 200
+        return jsonify(cached_directory("departments", load_departments)), 200
 
     # -----------------------------------------
     # POST → add new department
@@ -350,23 +660,79 @@ def delete_department(dept_id):
 
 @app.route("/admin/dashboard", methods=["GET"])
 @jwt_required()
+@conditional("users", "appointments")
 def admin_dashboard():
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
 
-    total_doctors = User.query.filter_by(role="doctor").count()
-    total_patients = User.query.filter_by(role="patient").count()
-    total_appointments = Appointment.query.count()
-    upcoming = Appointment.query.filter(Appointment.date >= DateTime.now().date()).count()
-    return jsonify(
-        {
-            "total_doctors": total_doctors,
-            "total_patients": total_patients,
-            "total_appointments": total_appointments,
-            "upcoming_appointments": upcoming,
-        }
-    ), 200
+    return jsonify(dashboard_stats()), 200
+
+
+def dashboard_stats():
+    # counters are kept current by the writes themselves (see stats.py)
+    stats = read_stats()
+    return {
+        "total_doctors": stats.get(user_stat("doctor"), 0),
+        "total_patients": stats.get(user_stat("patient"), 0),
+        "total_appointments": stats.get(TOTAL_APPOINTMENTS, 0),
+        "upcoming_appointments": stats.get(UPCOMING, 0),
+        "appointments_by_status": {
+            name.split(":", 1)[1]: value
+            for name, value in stats.items()
+            if name.startswith("appointments:") and name not in (TOTAL_APPOINTMENTS, UPCOMING)
+        },
+    }
+
+
+@app.route("/admin/bootstrap", methods=["GET"])
+@jwt_required()
+@conditional("users", "doctor_profiles", "patient_profiles", "departments", "appointments")
+def admin_bootstrap():
+    """
+    Everything AdminDashboardPage needs on mount, in one response.
+    Query params: limit (first page size of each list, default 50, max 200)
+    Response: {
+      "stats": {...as /admin/dashboard},
+      "doctors" / "patients" / "appointments": {"items": [...], "next_cursor": str | null},
+      "departments": {id: name}, "doctor_names": {id: username}
+    }
+    doctor_names covers the doctors on the first appointments page. A
+    repeat load with the ETag in If-None-Match gets 304 (see conditional.py).
+    """
+    claims = get_jwt()
+    if not is_admin_claims(claims):
+        return jsonify({"message": "Admin only"}), 401
+
+    limit = page_limit()
+    doctors, doctors_cursor = doctor_page(limit)
+    patients, patients_cursor = patient_page(limit)
+    appointments, appointments_cursor = appointment_page(limit)
+
+    doctor_ids = {a["doctor_id"] for a in appointments if a["doctor_id"]}
+    doctor_names = {
+        user_id: username
+        for user_id, username in db.session.query(User.id, User.username).filter(User.id.in_(doctor_ids))
+    } if doctor_ids else {}
+
+    return jsonify({
+        "stats": dashboard_stats(),
+        "doctors": {"items": doctors, "next_cursor": doctors_cursor},
+        "patients": {"items": patients, "next_cursor": patients_cursor},
+        "appointments": {"items": appointments, "next_cursor": appointments_cursor},
+        "departments": {d["id"]: d["name"] for d in cached_directory("departments", load_departments)},
+        "doctor_names": doctor_names,
+    }), 200
+
+
+@app.route("/admin/cache/stats", methods=["GET"])
+@jwt_required()
+def admin_cache_stats():
+    claims = get_jwt()
+    if not is_admin_claims(claims):
+        return jsonify({"message": "Admin only"}), 401
+    with cache_stats_lock:
+        return jsonify({name: dict(stats) for name, stats in cache_stats.items()}), 200
 
 
 # ----------------------------
@@ -374,27 +740,14 @@ def admin_dashboard():
 # ----------------------------
 @app.route("/admin/doctors", methods=["GET", "POST"])
 @jwt_required()
+@conditional("users", "doctor_profiles", "departments", "appointments")
 def admin_doctors():
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
 
     if request.method == "GET":
-        doctors = User.query.filter_by(role="doctor").all()
-        data = []
-        for d in doctors:
-            profile = DoctorProfile.query.filter_by(user_id=d.id).first()
-            data.append({
-                "id": d.id,
-                "username": d.username,
-                "approve": d.approve,
-                "blocked": d.blocked,
-                "specialization_id": profile.specialization_id if profile else None,
-                "specialization_name": Department.query.get(profile.specialization_id).name if profile and profile.specialization_id else None,
-                "experience": profile.experience if profile else None,
-                "availability": profile.availability if profile else None
-            })
-        return jsonify(data), 200
+        return list_admin_doctors()
 
     data = request.get_json() or {}
     username = data.get("username")
@@ -415,15 +768,117 @@ def admin_doctors():
 
     user = User(username=username, password=generate_password_hash(password), role="doctor", approve=data.get("approve", False), blocked=False)
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()  # assigns user.id; user, profile and counter commit together
+    bump_stat(user_stat("doctor"))
 
     profile = DoctorProfile(user_id=user.id, specialization_id=specialization_id, experience=experience, availability=availability)
     db.session.add(profile)
+    import_profile_availability(user.id, availability)
     db.session.commit()
 
     return jsonify({"message": "Doctor created successfully"}), 201
 
 
+def import_profile_availability(doctor_id, availability):
+    """
+    The profile forms' availability box is free text kept on the profile as-is;
+    when it holds a {date: true/false} map, apply it to the schedule as well.
+    """
+    if not availability:
+        return
+    try:
+        apply_day_flags(doctor_id, availability)
+    except (ValueError, TypeError, AttributeError):
+        pass
+
+
+def list_admin_doctors():
+    """
+    GET /admin/doctors, by id, one page at a time, in a single query.
+    Query params (all optional):
+      department_id, approve=true/false, blocked=true/false,
+      ids=1,2,3  only these doctors (e.g. the hits of /search?type=doctor),
+      with_counts=1  add each doctor's "appointment_count",
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"items": [...], "next_cursor": str | null}
+    """
+    try:
+        approve = parse_bool_arg("approve")
+        blocked = parse_bool_arg("blocked")
+        ids = parse_ids_arg()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        items, next_cursor = doctor_page(
+            page_limit(), request.args.get("cursor"),
+            department_id=request.args.get("department_id", type=int),
+            approve=approve, blocked=blocked, ids=ids,
+            with_counts=request.args.get("with_counts") == "1",
+        )
+    except ValueError:
+        return jsonify({"message": "Invalid cursor"}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor}), 200
+
+
+def doctor_page(limit, cursor=None, department_id=None, approve=None, blocked=None, ids=None, with_counts=False):
+    """One page of /admin/doctors as (items, next_cursor); raises ValueError for a bad cursor."""
+    columns = [
+        User.id, User.username, User.approve, User.blocked,
+        DoctorProfile.specialization_id, DoctorProfile.experience, DoctorProfile.availability,
+        Department.name.label("specialization_name"),
+    ]
+    if with_counts:
+        # correlated counts per row of the page, hot plus archived, each served by its doctor/date/time index
+        hot, archived = (
+            db.select(func.count(a.id)).where(a.doctor_id == User.id).scalar_subquery()
+            for a, _ in TIERS
+        )
+        columns.append((hot + archived).label("appointment_count"))
+
+    q = (
+        db.session.query(*columns)
+        .outerjoin(DoctorProfile, DoctorProfile.user_id == User.id)
+        .outerjoin(Department, Department.id == DoctorProfile.specialization_id)
+        .filter(User.role == "doctor")
+    )
+    if department_id:
+        q = q.filter(DoctorProfile.specialization_id == department_id)
+    if approve is not None:
+        q = q.filter(User.approve == approve)
+    if blocked is not None:
+        q = q.filter(User.blocked == blocked)
+    if ids is not None:
+        q = q.filter(User.id.in_(ids))
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        q = q.filter(User.id > int(last_id))
+
+    rows = q.order_by(User.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    items = []
+    for r in rows:
+        item = {
+            "id": r.id,
+            "username": r.username,
+            "approve": r.approve,
+            "blocked": r.blocked,
+            "specialization_id": r.specialization_id,
+            "specialization_name": r.specialization_name,
+            "experience": r.experience,
+            "availability": r.availability,
+        }
+        if with_counts:
+            item["appointment_count"] = r.appointment_count
+        items.append(item)
+    return items, next_cursor
+
+
 @app.route("/admin/doctors/<int:user_id>", methods=["GET", "PUT", "DELETE"])
 @jwt_required()
 def admin_doctor_detail(user_id):
@@ -443,14 +898,20 @@ def admin_doctor_detail(user_id):
         data = request.get_json() or {}
         user.approve = data.get("approve", user.approve)
         user.blocked = data.get("blocked", user.blocked)
+        bump_revocation_version()
         db.session.commit()
+        revoked_users.refresh(wait=True)
         return jsonify({"message": "updated"}), 200
 
     if request.method == "DELETE":
         prof = DoctorProfile.query.filter_by(user_id=user.id).first()
         if prof:
             db.session.delete(prof)
+        AvailabilityTemplate.query.filter_by(doctor_id=user.id).delete()
+        AvailabilityException.query.filter_by(doctor_id=user.id).delete()
+        expire_reports(user.id)
         db.session.delete(user)
+        bump_stat(user_stat("doctor"), -1)
         db.session.commit()
         return jsonify({"message": "deleted"}), 200
 
@@ -487,21 +948,67 @@ def admin_doctor_profile(user_id):
         )
         db.session.add(profile)
 
+    import_profile_availability(user_id, availability)
     db.session.commit()
     return jsonify({"message": "Doctor profile saved successfully"}), 200
 
 
 @app.route("/admin/patients", methods=["GET"])
 @jwt_required()
+@conditional("users", "patient_profiles")
 def admin_patients():
+    """
+    Patients by id with their profiles, one page at a time.
+    Query params (all optional):
+      blocked=true/false, ids=1,2,3 (only these patients, e.g. the hits of /search?type=patient),
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"items": [{"id", "username", "blocked", "profile": {...} | null}], "next_cursor": str | null}
+    """
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
-    patients = User.query.filter_by(role="patient").all()
-    return jsonify([{"id": p.id, "username": p.username,"blocked": p.blocked} for p in patients]), 200
+    try:
+        blocked = parse_bool_arg("blocked")
+        ids = parse_ids_arg()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        items, next_cursor = patient_page(page_limit(), request.args.get("cursor"), blocked=blocked, ids=ids)
+    except ValueError:
+        return jsonify({"message": "Invalid cursor"}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor}), 200
+
+
+def patient_page(limit, cursor=None, blocked=None, ids=None):
+    """One page of /admin/patients as (items, next_cursor); raises ValueError for a bad cursor."""
+    q = (
+        db.session.query(User.id, User.username, User.blocked, PatientProfile)
+        .outerjoin(PatientProfile, PatientProfile.user_id == User.id)
+        .filter(User.role == "patient")
+    )
+    if blocked is not None:
+        q = q.filter(User.blocked == blocked)
+    if ids is not None:
+        q = q.filter(User.id.in_(ids))
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        q = q.filter(User.id > int(last_id))
+
+    rows = q.order_by(User.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    items = [
+        {"id": r.id, "username": r.username, "blocked": r.blocked,
+         "profile": r.PatientProfile.as_dict() if r.PatientProfile else None}
+        for r in rows
+    ]
+    return items, next_cursor
 
 @app.route("/admin/patient/<int:patient_id>", methods=["GET"])
 @jwt_required()
+@conditional("users", "patient_profiles")
 def admin_get_patient_details(patient_id):
     claims = get_jwt()
     if not is_admin_claims(claims):
@@ -523,15 +1030,74 @@ def admin_get_patient_details(patient_id):
 
 @app.route("/admin/appointments", methods=["GET"])
 @jwt_required()
+@conditional("appointments")
 def admin_appointments():
+    """
+    Newest first, one page at a time.
+    Query params (all optional):
+      status, doctor_id, department_id, from=YYYY-MM-DD, to=YYYY-MM-DD,
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"items": [...], "next_cursor": str | null}
+    """
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
-    appts = Appointment.query.order_by(Appointment.date.desc(), Appointment.time.desc()).all()
+
+    try:
+        date_from = parse_date_arg("from")
+        date_to = parse_date_arg("to")
+    except ValueError:
+        return jsonify({"message": "Invalid date format"}), 400
+
+    try:
+        items, next_cursor = appointment_page(
+            page_limit(), request.args.get("cursor"),
+            status=request.args.get("status"),
+            doctor_id=request.args.get("doctor_id", type=int),
+            department_id=request.args.get("department_id", type=int),
+            date_from=date_from, date_to=date_to,
+        )
+    except ValueError:
+        return jsonify({"message": "Invalid cursor"}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor}), 200
+
+
+def appointment_page(limit, cursor=None, status=None, doctor_id=None, department_id=None, date_from=None, date_to=None):
+    """One page of /admin/appointments as (items, next_cursor); raises ValueError for a bad cursor."""
+    q = Appointment.query
+
+    if status:
+        q = q.filter(Appointment.status == status)
+    if doctor_id:
+        q = q.filter(Appointment.doctor_id == doctor_id)
+    if department_id:
+        q = q.filter(Appointment.department_id == department_id)
+    if date_from:
+        q = q.filter(Appointment.date >= date_from)
+    if date_to:
+        q = q.filter(Appointment.date <= date_to)
+
+    if cursor:
+        d, t, i = decode_cursor(cursor, 3)
+        after = (Date.fromisoformat(d), Time.fromisoformat(t), int(i))
+        q = q.filter(tuple_(Appointment.date, Appointment.time, Appointment.id) < after)
+
+    appts = (
+        q.order_by(Appointment.date.desc(), Appointment.time.desc(), Appointment.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(appts) > limit:
+        appts = appts[:limit]
+        last = appts[-1]
+        next_cursor = encode_cursor(last.date, last.time, last.id)
+
     result = []
     for a in appts:
-        result.append({"id": a.id, "patient_id": a.patient_id, "doctor_id": a.doctor_id, "date": str(a.date), "time": str(a.time), "status": a.status, "remarks": a.remarks})
-    return jsonify(result), 200
+        result.append({"id": a.id, "patient_id": a.patient_id, "doctor_id": a.doctor_id, "department_id": a.department_id, "date": str(a.date), "time": str(a.time), "status": a.status, "remarks": a.remarks})
+    return result, next_cursor
 
 
 @app.route("/admin/block_user/<int:user_id>", methods=["POST"])
@@ -553,7 +1119,9 @@ def admin_block_user(user_id):
         user.approve = False
     else:
         return jsonify({"message": "invalid action"}), 400
+    bump_revocation_version()
     db.session.commit()
+    revoked_users.refresh(wait=True)
     return jsonify({"message": "done"}), 200
 
 
@@ -564,28 +1132,139 @@ def export_service_requests(professional_id):
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
+    # ?stream=1 → download the CSV directly instead of queueing a report file
+    if request.args.get("stream") == "1":
+        return csv_download(f"doctor_{professional_id}_appointments.csv", DOCTOR_EXPORT_HEADER, doctor_export_rows(professional_id))
     task = export_professional_service_requests.delay(professional_id)
     return jsonify({"message": f"Export started for professional ID {professional_id}.", "task_id": task.id}), 202
 
 
-@app.route("/admin/reports/list", methods=["GET"])
+ANALYTICS_TOP_DEFAULT = 5
+ANALYTICS_TOP_MAX = 50
+# Largest span bucket=day returns; longer ranges are cut back to end at `to`
+MAX_ANALYTICS_DAYS = 366
+
+
+@app.route("/admin/analytics", methods=["GET"])
 @jwt_required()
-def list_reports():
+@conditional("appointment_rollups", "users", "departments")
+def admin_analytics():
+    """
+    Appointment trends from the daily rollups (see rollups.py), both archive tiers included.
+    Query params (all optional):
+      from=YYYY-MM-DD (default a year before `to`), to=YYYY-MM-DD (default today),
+      bucket=day|month (default month; day spans are clamped to MAX_ANALYTICS_DAYS ending at `to`),
+      doctor_id, department_id (narrow everything),
+      top (default 5, max 50), rank=bookings|booked|completed|cancelled (default bookings)
+    Response: {"from", "to", "bucket", "rank",
+               "series": [{"period", "bookings", "booked", "completed", "cancelled"}],
+               "totals": {"bookings", ...},
+               "top_doctors": [{"doctor_id", "doctor", "bookings", ...}],
+               "top_departments": [{"department_id", "department", "bookings", ...}]}
+    """
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
-    os.makedirs(REPORTS_DIR, exist_ok=True)
-    files = [f for f in os.listdir(REPORTS_DIR) if f.endswith(".csv")]
-    return jsonify({"downloads": files}), 200
+    try:
+        date_to = parse_date_arg("to") or DateTime.now().date()
+        date_from = parse_date_arg("from") or date_to - timedelta(days=364)
+    except ValueError:
+        return jsonify({"message": "Invalid date"}), 400
+    if date_from > date_to:
+        return jsonify({"message": "from must not be after to"}), 400
+    bucket = request.args.get("bucket", MONTH)
+    rank = request.args.get("rank", "bookings")
+    if bucket not in (DAY, MONTH) or rank not in MEASURE_NAMES:
+        return jsonify({"message": "Unknown bucket or rank"}), 400
+    if bucket == DAY:
+        date_from = max(date_from, date_to - timedelta(days=MAX_ANALYTICS_DAYS - 1))
+    top = min(max(request.args.get("top", ANALYTICS_TOP_DEFAULT, type=int), 1), ANALYTICS_TOP_MAX)
+    filters = {
+        "doctor_id": request.args.get("doctor_id", type=int),
+        "department_id": request.args.get("department_id", type=int),
+    }
 
+    series = rollup_series(date_from, date_to, bucket, **filters)
+    totals = {name: sum(p[name] for p in series) for name in MEASURE_NAMES}
+    top_doctors, top_departments = rollup_leaders(date_from, date_to, rank, top, **filters)
 
-@app.route("/admin/reports/download/<filename>", methods=["GET"])
+    doctor_names = dict(
+        db.session.query(User.id, User.username).filter(User.id.in_([d["doctor_id"] for d in top_doctors]))
+    )
+    department_names = dict(
+        db.session.query(Department.id, Department.name)
+        .filter(Department.id.in_([d["department_id"] for d in top_departments]))
+    )
+    for d in top_doctors:
+        d["doctor"] = doctor_names.get(d["doctor_id"])
+    for d in top_departments:
+        d["department"] = department_names.get(d["department_id"])
+
+    return jsonify({
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "bucket": bucket,
+        "rank": rank,
+        "series": series,
+        "totals": totals,
+        "top_doctors": top_doctors,
+        "top_departments": top_departments,
+    }), 200
+
+
+@app.route("/admin/reports/list", methods=["GET"])
+@jwt_required()
+def list_reports():
+    """
+    Report files from the catalog, newest first.
+    Query params (all optional):
+      type (treatments / appointments / monthly), owner_id,
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"downloads": [{"id", "filename", "type", "period", "size", ...}], "next_cursor": str | null}
+    """
+    claims = get_jwt()
+    if not is_admin_claims(claims):
+        return jsonify({"message": "Admin only"}), 401
+    q = live_reports()
+    if request.args.get("type"):
+        q = q.filter(ReportFile.report_type == request.args["type"])
+    if request.args.get("owner_id", type=int):
+        q = q.filter(ReportFile.owner_id == request.args.get("owner_id", type=int))
+    return report_page(q)
+
+
+def report_page(q):
+    """One keyset page of a live_reports() query as the {"downloads", "next_cursor"} response."""
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            (last_id,) = decode_cursor(cursor, 1)
+            q = q.filter(ReportFile.id < int(last_id))
+        except ValueError:
+            return jsonify({"message": "Invalid cursor"}), 400
+
+    limit = page_limit()
+    rows = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return jsonify({"downloads": [r.as_dict() for r in rows], "next_cursor": next_cursor}), 200
+
+
+def send_report(report):
+    if report is None or not os.path.isfile(report_file_path(report.path)):
+        return jsonify({"message": "Report not found"}), 404
+    return send_from_directory(reports_dir(), report.path, as_attachment=True, download_name=report.filename)
+
+
+@app.route("/admin/reports/download/<int:report_id>", methods=["GET"])
 @jwt_required()
-def download_report(filename):
+def download_report(report_id):
     claims = get_jwt()
     if not is_admin_claims(claims):
         return jsonify({"message": "Admin only"}), 401
-    return send_from_directory(REPORTS_DIR, filename, as_attachment=True)
+    return send_report(live_reports().filter(ReportFile.id == report_id).first())
 
 
 # ---------------------------
@@ -630,6 +1309,7 @@ def doctor_profile():
         profile.experience = experience
         profile.availability = availability
 
+    import_profile_availability(doctor_id, availability)
     db.session.commit()
     return jsonify({"message": "Profile updated successfully"}), 200
 
@@ -655,6 +1335,7 @@ def doctor_profile():
 
 @app.route("/doctor/appointments", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "users", "departments", "treatments")
 def doctor_appointments():
     claims = get_jwt()
     if not is_doctor_claims(claims):
@@ -662,30 +1343,40 @@ def doctor_appointments():
 
     doctor_id = claims["user_id"]
 
-    appts = Appointment.query.filter_by(doctor_id=doctor_id)\
-        .order_by(Appointment.date.asc(), Appointment.time.asc())\
+    # One round-trip: patient name, department and treatment presence are
+    # joined in instead of being looked up per appointment
+    has_treatment = (
+        db.exists().where(Treatment.appointment_id == Appointment.id).correlate(Appointment)
+    )
+    rows = (
+        db.session.query(Appointment, User.username, Department.name, has_treatment.label("has_treatment"))
+        .outerjoin(User, User.id == Appointment.patient_id)
+        .outerjoin(Department, Department.id == Appointment.department_id)
+        .filter(Appointment.doctor_id == doctor_id)
+        .order_by(Appointment.date.asc(), Appointment.time.asc())
         .all()
+    )
 
     result = []
 
-    for a in appts:
-        patient = User.query.filter_by(id=a.patient_id).first()
-        # print(patient.username)
-        patient_name = patient.username 
+    for a, patient_name, department_name, treated in rows:
         result.append({
             "id": a.id,
             "patient_name": patient_name,
             "patient_id": a.patient_id,
+            "department_name": department_name,
             "date": str(a.date),
             "time": str(a.time),
             "status": a.status,
-            "remarks": a.remarks
+            "remarks": a.remarks,
+            "has_treatment": bool(treated)
         })
 
     return jsonify(result), 200
 
 @app.route("/doctor/patients", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "users")
 def doctor_patients():
     claims = get_jwt()
     if not is_doctor_claims(claims):
@@ -693,11 +1384,12 @@ def doctor_patients():
 
     doctor_id = claims["user_id"]
 
-    # Get unique patient IDs from the doctor's appointments
-    appts = Appointment.query.filter_by(doctor_id=doctor_id).all()
-    patient_ids = set(a.patient_id for a in appts)
+    # everyone the doctor ever saw, archived appointments included
+    def tier(appointment, _):
+        return db.select(appointment.patient_id).where(appointment.doctor_id == doctor_id)
 
-    patients = User.query.filter(User.id.in_(patient_ids)).all()
+    seen = through_tiers(tier)
+    patients = User.query.filter(User.id.in_(db.select(seen.c.patient_id))).all()
 
     return jsonify([{"id": p.id, "username": p.username} for p in patients]), 200
 
@@ -718,21 +1410,25 @@ def doctor_complete_appointment(appointment_id):
     prescription = data.get("prescription", "")
     notes = data.get("notes", "")
 
+    track_status_change(appt.status, "Completed")
+    track_appointment(appt, -1)
     appt.status = "Completed"
-    db.session.commit()
-
+    track_appointment(appt)
     treatment = Treatment(appointment_id=appt.id, diagnosis=diagnosis, prescription=prescription, notes=notes)
     db.session.add(treatment)
-    db.session.commit()
 
-    # optional: notify patient by email if patient.username is an email
-    try:
-        patient_user = User.query.get(appt.patient_id)
-        if patient_user and "@" in patient_user.username:
-            msg = Message(subject="Your visit summary", recipients=[patient_user.username], body=f"Your appointment on {appt.date} with doctor id {appt.doctor_id} is completed.\nDiagnosis: {diagnosis}\nPrescription: {prescription}")
-            mail.send(msg)
-    except Exception:
-        pass
+    # notify patient by email if patient.username is an email
+    patient_user = db.session.get(User, appt.patient_id)
+    if patient_user and "@" in patient_user.username:
+        queue_email(
+            recipient=patient_user.username,
+            subject="Your visit summary",
+            body=f"Your appointment on {appt.date} with doctor id {appt.doctor_id} is completed.\nDiagnosis: {diagnosis}\nPrescription: {prescription}",
+            dedupe_key=appointment_email_key(appt, "completed"),
+        )
+
+    db.session.commit()
+    kick_email_outbox()
 
     return jsonify({"message": "Appointment completed and treatment saved"}), 200
 
@@ -769,61 +1465,39 @@ def doctor_complete_appointment(appointment_id):
 
 #     return jsonify({"availability": available_days}), 200
 
-@app.route("/doctor/<int:doctor_id>/availability", methods=["GET"])
-@jwt_required()
-def get_doctor_availability(doctor_id):
-    profile = DoctorProfile.query.filter_by(user_id=doctor_id).first()
-    
-    if not profile or not profile.availability:
-        return jsonify({"availability": []}), 200
-
-    availability_data = json.loads(profile.availability)
-    available_days = []
+# Default / largest window of days the availability endpoints expand
+AVAILABILITY_WINDOW_DAYS = 30
+MAX_AVAILABILITY_WINDOW_DAYS = 180
 
-    for date_str, available in availability_data.items():
-        if not available:
-            continue
 
-        slots = []
-        start_hour = 11
-        end_hour = 17
+def availability_window():
+    """(from, to) from the optional query params, clamped to MAX_AVAILABILITY_WINDOW_DAYS; raises ValueError."""
+    date_from = parse_date_arg("from") or DateTime.now().date()
+    date_to = parse_date_arg("to") or date_from + timedelta(days=AVAILABILITY_WINDOW_DAYS - 1)
+    return date_from, min(date_to, date_from + timedelta(days=MAX_AVAILABILITY_WINDOW_DAYS - 1))
 
-        # Convert date string → date object
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
 
-        current = datetime.strptime(f"{date_str} {start_hour}:00", "%Y-%m-%d %H:%M")
-
-        while current.hour < end_hour:
-            slot_time = current.time()                 # proper time object
-            slot_str = current.strftime("%I:%M %p")    # for display
-
-            # Check if slot is booked
-            existing = Appointment.query.filter_by(
-                doctor_id=doctor_id,
-                date=date_obj,
-                time=slot_time
-            ).first()
-
-            # skip booked slots
-            if existing and existing.status == "Booked":
-                current += timedelta(minutes=30)
-                continue
-
-            # Add slot only if NOT booked
-            slots.append(slot_str)
-            current += timedelta(minutes=30)
-
-        available_days.append({
-            "date": date_str,
-            "slots": slots
-        })
+@app.route("/doctor/<int:doctor_id>/availability", methods=["GET"])
+@jwt_required()
+@conditional("availability_templates", "availability_exceptions", "appointments")
+def get_doctor_availability(doctor_id):
+    """
+    Query params (optional):
+      from=YYYY-MM-DD  first day to include (default today)
+      to=YYYY-MM-DD    last day to include (default from + 29 days)
+    """
+    try:
+        date_from, date_to = availability_window()
+    except ValueError:
+        return jsonify({"message": "Invalid date format"}), 400
 
-    return jsonify({"availability": available_days}), 200
+    return jsonify({"availability": expand_availability(doctor_id, date_from, date_to)}), 200
 
 
 # ✅ Get already booked appointments
 @app.route("/doctor/<int:doctor_id>/appointments", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "users", "departments")
 def get_doctor_booked_appointments(doctor_id):
     # get appointments and include doctor / department via relationships if available
     appts = Appointment.query.filter_by(doctor_id=doctor_id).order_by(Appointment.date.asc(), Appointment.time.asc()).all()
@@ -856,39 +1530,43 @@ def book_appointment():
     except ValueError:
         return jsonify({"message": "Invalid time format"}), 400
 
-    # Check if slot already booked
-    existing = Appointment.query.filter_by(
-        doctor_id=doctor_id,
-        date=date_obj,
-        time=time_obj
-    ).first()
-
-    if existing and existing.status == "Booked":
-        return jsonify({"message": "Slot already booked"}), 400
+    profile = DoctorProfile.query.filter_by(user_id=doctor_id).first()
+    if not profile:
+        return jsonify({"message": "Doctor not found"}), 404
 
-    # Create the new appointment
-    new_appt = Appointment(
-        doctor_id=doctor_id,
-        patient_id=patient_id,
-        date=date_obj,
-        time=time_obj,
-        status="Booked"
-    )
-    db.session.add(new_appt)
-    db.session.commit()
+    # Early answer for the common case; the unique index and recheck_slot()
+    # below are what stop two concurrent requests from both getting the slot
+    problem = check_slot(doctor_id, date_obj, time_obj)
+    if problem == "unavailable":
+        return jsonify({"message": "Doctor is not available at that time"}), 400
+    if problem:
+        return jsonify({"message": "Slot already booked"}), 409
 
-    # -----------------------------
-    # 📧 SEND CONFIRMATION EMAIL
-    # -----------------------------
     patient = db.session.get(User, patient_id)
     doctor = db.session.get(User, doctor_id)
 
-    send_appointment_email(
-    patient=patient,
-    doctor=doctor,
-    date_obj=date_obj,
-    time_obj=time_obj,
-    action="booked")
+    def add_appointment():
+        appt = Appointment(
+            doctor_id=doctor_id,
+            patient_id=patient_id,
+            department_id=profile.specialization_id,
+            date=date_obj,
+            time=time_obj,
+            status="Booked"
+        )
+        db.session.add(appt)
+        db.session.flush()  # raises on a taken slot, and gives us the id for the email key
+        recheck_slot(appt)
+        track_new_appointment(appt)
+        track_appointment(appt)
+
+        # 📧 confirmation email goes out with the same commit
+        queue_appointment_email(appt, patient=patient, doctor=doctor, action="booked")
+
+    if not commit_slot_change(add_appointment):
+        return jsonify({"message": "Slot already booked"}), 409
+
+    kick_email_outbox()
 
     return jsonify({"message": "Appointment booked successfully!"}), 201
 
@@ -932,7 +1610,17 @@ def book_appointment():
 
 @app.route("/doctor/availability", methods=["GET", "POST"])
 @jwt_required()
+@conditional("availability_templates", "availability_exceptions", "appointments")
 def doctor_availability():
+    """
+    GET  → {"availability": {date: true/false} for the window,
+            "weekly": [...], "exceptions": [...]}
+    POST → any of
+      "availability": {"YYYY-MM-DD": true/false}   per-day switch, default hours
+      "weekly": [{"weekday": 0-6, "start": "HH:MM", "end": "HH:MM", "slot_minutes": 30}]
+                                                   replaces the weekly hours
+      "exceptions": [{"date": "YYYY-MM-DD", "available": bool, "start", "end", "slot_minutes"}]
+    """
     claims = get_jwt()
     # Use correct claim key for ID
     doctor_id = claims.get("user_id")  
@@ -943,16 +1631,39 @@ def doctor_availability():
 
     # ✅ GET: return current availability
     if request.method == "GET":
-        availability = json.loads(profile.availability) if profile.availability else {}
-        return jsonify({"availability": availability}), 200
+        try:
+            date_from, date_to = availability_window()
+        except ValueError:
+            return jsonify({"message": "Invalid date format"}), 400
+        weekly = AvailabilityTemplate.query.filter_by(doctor_id=doctor_id)\
+            .order_by(AvailabilityTemplate.weekday, AvailabilityTemplate.start_time).all()
+        exceptions = AvailabilityException.query.filter(
+            AvailabilityException.doctor_id == doctor_id,
+            AvailabilityException.date >= date_from,
+            AvailabilityException.date <= date_to,
+        ).order_by(AvailabilityException.date, AvailabilityException.start_time).all()
+        return jsonify({
+            "availability": day_flags(doctor_id, date_from, date_to),
+            "weekly": [t.as_dict() for t in weekly],
+            "exceptions": [e.as_dict() for e in exceptions],
+        }), 200
 
     # ✅ POST: update availability
     data = request.get_json() or {}
-    availability = data.get("availability")
-    if not availability:
+    if all(data.get(key) is None for key in ("availability", "weekly", "exceptions")):
         return jsonify({"message": "No availability data received"}), 400
 
-    profile.availability = json.dumps(availability)
+    try:
+        if data.get("weekly") is not None:
+            replace_weekly(doctor_id, data["weekly"])
+        if data.get("exceptions") is not None:
+            replace_exceptions(doctor_id, data["exceptions"])
+        if data.get("availability") is not None:
+            apply_day_flags(doctor_id, data["availability"])
+    except (ValueError, TypeError, AttributeError) as e:
+        db.session.rollback()
+        return jsonify({"message": f"Invalid availability: {e}"}), 400
+
     db.session.commit()
 
     return jsonify({"message": "Availability updated successfully"}), 200
@@ -994,85 +1705,47 @@ def patient_profile():
 
 @app.route("/patient/dashboard", methods=["GET"])
 @jwt_required()
+@conditional("departments")
 def patient_dashboard():
     claims = get_jwt()
     if claims.get("role") != "patient":
         return jsonify({"message": "Unauthorized", "category": "danger"}), 403
 
-    user_id = claims.get("user_id")
-    patient = db.session.get(User, user_id)
-    if not patient:
-        return jsonify({"message": "Patient not found", "category": "danger"}), 404
-
-    # Get all departments
-    departments = Department.query.all()
-    dept_list = [{"id": d.id, "name": d.name, "description": d.description} for d in departments]
-
+    # username is the token identity, so this page needs no database read
     return jsonify({
         "message": "Dashboard loaded successfully",
         "category": "success",
-        "patient": patient.username,
-        "departments": dept_list
+        "patient": get_jwt_identity(),
+        "departments": cached_directory("departments", load_departments)
     }), 200
 
 @app.route("/departments/<int:dept_id>", methods=["GET"])
 @jwt_required()
+@conditional("departments", "users", "doctor_profiles")
 def get_department_details(dept_id):
-    # Get department info
-    dept = db.session.get(Department, dept_id)
-    if not dept:
+    data = cached_directory("department_doctors", load_department_doctors, dept_id)
+    if not data:
         return jsonify({"message": "Department not found"}), 404
-
-    # Get doctors who specialize in this department
-    doctors = (
-        db.session.query(User, DoctorProfile)
-        .join(DoctorProfile, DoctorProfile.user_id == User.id)
-        .filter(
-            User.role == "doctor",
-            User.approve == True,
-            DoctorProfile.specialization_id == dept_id
-        )
-        .all()
-    )
-
-    doctor_list = []
-    for user, profile in doctors:
-        doctor_list.append({
-            "id": user.id,
-            "name": user.username,
-            "experience": profile.experience,
-        })
-
-    return jsonify({
-        "department": {
-            "id": dept.id,
-            "name": dept.name,
-            "description": dept.description
-        },
-        "doctors": doctor_list
-    }), 200
+    return jsonify(data), 200
 
 
 @app.route("/patient/reports/list", methods=["GET"])
 @jwt_required()
 def patient_reports_list():
-    user_id = get_jwt_identity()
+    """
+    The caller's own report files, newest first; same params and response as /admin/reports/list.
+    """
     claims = get_jwt()
     user_id = claims.get("user_id")   # THIS is the actual integer ID
-    reports_folder = os.path.join(os.getcwd(), "reports")
-
-    files = os.listdir(reports_folder)
-
-    patient_files = [
-        f for f in files
-        if f.startswith(f"patient_{user_id}_")
-    ]
-
-    return jsonify({"downloads": patient_files})
+    q = live_reports().filter(ReportFile.owner_id == user_id)
+    if request.args.get("type"):
+        q = q.filter(ReportFile.report_type == request.args["type"])
+    return report_page(q)
 
 
 @app.route("/patient/appointments", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "users", "departments")
 def patient_appointments():
     claims = get_jwt()
     if claims.get("role") != "patient":
@@ -1117,32 +1790,88 @@ def patient_cancel_appointment(appointment_id):
         return jsonify({"message": "Only booked appointments can be cancelled"}), 400
     patient = db.session.get(User, patient_id)
     doctor = db.session.get(User, doctor_id)
+    track_status_change(appt.status, "Cancelled")
+    track_appointment(appt, -1)
     appt.status = "Cancelled"
+    track_appointment(appt)
+    queue_appointment_email(appt, patient=patient, doctor=doctor, action="cancelled")
     db.session.commit()
-    send_appointment_email(
-    patient=patient,
-    doctor=doctor,
-    date_obj=appt.date,
-    time_obj=appt.time,
-    action="cancelled"
-)
+    kick_email_outbox()
 
     return jsonify({"message": "cancelled"}), 200
 
 
+def treatment_history_page(patient_id):
+    """
+    One page of a patient's treatments, newest first, joined with the
+    appointment date/time and the doctor's name in a single query over the
+    hot and archive tiers.
+    Query params (all optional): from, to, limit, cursor.
+    Returns (rows, next_cursor); raises ValueError for a bad date or cursor.
+    """
+    date_from = parse_date_arg("from")
+    date_to = parse_date_arg("to")
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        d, t, i = decode_cursor(cursor, 3)
+        after = (Date.fromisoformat(d), Time.fromisoformat(t), int(i))
+
+    def tier(appointment, treatment):
+        q = (
+            db.select(
+                treatment.id, treatment.appointment_id, treatment.diagnosis, treatment.prescription, treatment.notes,
+                appointment.date, appointment.time, appointment.doctor_id,
+            )
+            .join(appointment, treatment.appointment_id == appointment.id)
+            .where(appointment.patient_id == patient_id)
+        )
+        if date_from:
+            q = q.where(appointment.date >= date_from)
+        if date_to:
+            q = q.where(appointment.date <= date_to)
+        if after:
+            q = q.where(tuple_(appointment.date, appointment.time, treatment.id) < after)
+        return q
+
+    history = through_tiers(tier)
+    Doctor = aliased(User)
+    limit = page_limit()
+    rows = (
+        db.session.query(
+            history.c.id, history.c.appointment_id, history.c.diagnosis, history.c.prescription, history.c.notes,
+            history.c.date, history.c.time, Doctor.username.label("doctor"),
+        )
+        .outerjoin(Doctor, Doctor.id == history.c.doctor_id)
+        .order_by(history.c.date.desc(), history.c.time.desc(), history.c.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.date, last.time, last.id)
+    return rows, next_cursor
+
+
 @app.route("/patient/treatments", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "treatments", "users")
 def patient_treatments():
     claims = get_jwt()
     if not is_patient_claims(claims):
         return jsonify({"message": "Patient only"}), 401
     user_id = claims["user_id"]
-    treatments = Treatment.query.join(Appointment, Treatment.appointment_id == Appointment.id).filter(Appointment.patient_id == user_id).all()
+    try:
+        rows, next_cursor = treatment_history_page(user_id)
+    except ValueError:
+        return jsonify({"message": "Invalid date or cursor"}), 400
     out = []
-    for t in treatments:
-        appt = Appointment.query.get(t.appointment_id)
-        out.append({"treatment_id": t.id, "appointment_id": t.appointment_id, "appointment_date": str(appt.date) if appt else None, "diagnosis": t.diagnosis, "prescription": t.prescription, "notes": t.notes})
-    return jsonify(out), 200
+    for t in rows:
+        out.append({"treatment_id": t.id, "appointment_id": t.appointment_id, "appointment_date": str(t.date) if t.date else None, "diagnosis": t.diagnosis, "prescription": t.prescription, "notes": t.notes})
+    return jsonify({"items": out, "next_cursor": next_cursor}), 200
 
 
 @app.route("/patient/export_treatments", methods=["GET"])
@@ -1152,28 +1881,39 @@ def patient_export_treatments():
     if not is_patient_claims(claims):
         return jsonify({"message": "Patient only"}), 401
     patient_id = claims["user_id"]
+    # ?stream=1 → download the CSV directly instead of queueing a report file
+    if request.args.get("stream") == "1":
+        return csv_download(f"patient_{patient_id}_treatments.csv", TREATMENT_EXPORT_HEADER, treatment_export_rows(patient_id))
     task = export_treatments_csv.delay(patient_id)
     return jsonify({"task_id": task.id}), 202
 
 
-@app.route("/patient/reports/download/<path:filename>", methods=["GET"])
+@app.route("/patient/reports/download/<int:report_id>", methods=["GET"])
 @jwt_required()
-def reports_download(filename):
-    # allow admins or owner check in prod; for now keep minimal checks
-    return send_from_directory(REPORTS_DIR, filename, as_attachment=True)
+def reports_download(report_id):
+    claims = get_jwt()
+    q = live_reports().filter(ReportFile.id == report_id)
+    if not is_admin_claims(claims):
+        q = q.filter(ReportFile.owner_id == claims.get("user_id"))
+    return send_report(q.first())
 
 @app.route('/departments', methods=['GET'])
 @jwt_required(optional=True)
+@conditional("departments")
 def get_departments():
-    departments = Department.query.all()
-    return jsonify([{
-        "id": d.id,
-        "name": d.name, "description": d.description
-    } for d in departments]), 200
+    return jsonify(cached_directory("departments", load_departments)), 200
 
 @app.route("/patient/<int:patient_id>/history", methods=["GET"])
 @jwt_required()
+@conditional("appointments", "treatments", "users")
 def get_patient_history(patient_id):
+    """
+    Newest first, one page at a time.
+    Query params (all optional):
+      from=YYYY-MM-DD, to=YYYY-MM-DD,
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"history": [...], "next_cursor": str | null}
+    """
     claims = get_jwt()
     role = claims.get("role")
     user_id = claims.get("user_id")
@@ -1186,9 +1926,8 @@ def get_patient_history(patient_id):
             return jsonify({"message": "Patients may only view their own history"}), 403
 
     elif role == "doctor":
-        # doctor can only see history of their own patients
-        appt = Appointment.query.filter_by(doctor_id=user_id, patient_id=patient_id).first()
-        if not appt:
+        # doctor can only see history of their own patients, archived visits included
+        if not treated_by(user_id, patient_id):
             return jsonify({"message": "Doctor not assigned to this patient"}), 403
 
     elif role == "admin":
@@ -1197,28 +1936,68 @@ def get_patient_history(patient_id):
         return jsonify({"message": "Invalid role"}), 403
 
     # ---------------------------
-    # Fetch complete history
+    # Fetch one page of history
     # ---------------------------
-    treatments = (
-        Treatment.query.join(Appointment, Treatment.appointment_id == Appointment.id)
-        .filter(Appointment.patient_id == patient_id)
-        .all()
-    )
+    try:
+        rows, next_cursor = treatment_history_page(patient_id)
+    except ValueError:
+        return jsonify({"message": "Invalid date or cursor"}), 400
 
     history = []
-    for t in treatments:
-        appt = Appointment.query.get(t.appointment_id)
-        doctor = User.query.get(appt.doctor_id) if appt else None
+    for t in rows:
         history.append({
-            "date": str(appt.date) if appt else None,
-            "time": str(appt.time) if appt else None,
-            "doctor": doctor.username if doctor else "Unknown",
+            "date": str(t.date) if t.date else None,
+            "time": str(t.time) if t.time else None,
+            "doctor": t.doctor or "Unknown",
             "diagnosis": t.diagnosis,
             "prescription": t.prescription,
             "notes": t.notes,
         })
 
-    return jsonify({"history": history}), 200
+    return jsonify({"history": history, "next_cursor": next_cursor}), 200
+
+
+@app.route("/search", methods=["GET"])
+@jwt_required()
+def search():
+    """
+    Ranked full-text search over patients, doctors and treatment notes,
+    limited to what the caller's role may see (see fulltext.scope_sql).
+    Query params:
+      q (required), type=patient,doctor,treatment (optional, comma separated),
+      limit (default 50, max 200), cursor (next_cursor from the previous page)
+    Response: {"items": [{"type", "id", "title", "body", "patient_id", "doctor_id"}], "next_cursor": str | null}
+    """
+    claims = get_jwt()
+    if not search_available():
+        return jsonify({"message": "Search is not available on this database"}), 501
+
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"message": "q is required"}), 400
+    kinds = [k for k in request.args.get("type", "").split(",") if k]
+    if any(k not in SEARCH_KINDS for k in kinds):
+        return jsonify({"message": "type must be patient, doctor or treatment"}), 400
+
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            score, doc_id = decode_cursor(cursor, 2)
+            after = (float(score), int(doc_id))
+        except ValueError:
+            return jsonify({"message": "Invalid cursor"}), 400
+
+    limit = page_limit()
+    rows = search_documents(q, claims.get("role"), claims.get("user_id"), kinds=kinds, limit=limit + 1, after=after)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["doc_id"])
+
+    items = [{k: r[k] for k in ("type", "id", "title", "body", "patient_id", "doctor_id")} for r in rows]
+    return jsonify({"items": items, "next_cursor": next_cursor}), 200
 
 from sqlalchemy import and_
 @app.route("/appointments/<int:appointment_id>/reschedule", methods=["POST"])
@@ -1270,33 +2049,35 @@ def reschedule_appointment(appointment_id):
     if appt.date == new_date_obj and appt.time == new_time_obj:
         return jsonify({"message": "Already scheduled at that time"}), 200
 
-    # --- Conflict Check ---
-    conflict = Appointment.query.filter(
-        Appointment.doctor_id == appt.doctor_id,
-        Appointment.date == new_date_obj,
-        Appointment.time == new_time_obj,
-        Appointment.status == "Booked",
-        Appointment.id != appt.id
-    ).first()
+    # --- Slot check: offered by the doctor and not overlapping another booking ---
+    problem = check_slot(appt.doctor_id, new_date_obj, new_time_obj, ignore_appointment_id=appt.id)
+    if problem == "unavailable":
+        return jsonify({"message": "Doctor is not available at that time"}), 400
+    if problem:
+        return jsonify({"message": "Requested slot is already booked"}), 409
 
-    if conflict:
+    # --- Update slot (unique index settles races with concurrent bookings) ---
+    patient = db.session.get(User, appt.patient_id)
+    doctor = db.session.get(User, appt.doctor_id)
+
+    def move_appointment():
+        track_status_change(appt.status, "Booked")
+        track_date_change(appt.date, new_date_obj)
+        track_appointment(appt, -1)
+        appt.date = new_date_obj
+        appt.time = new_time_obj
+        appt.status = "Booked"  # Keep same canonical status
+        db.session.flush()
+        recheck_slot(appt)
+        track_appointment(appt)
+        appt.reminder_sent_at = None  # the new day gets its own reminder
+        queue_appointment_email(appt, patient=patient, doctor=doctor, action="rescheduled")
+
+    if not commit_slot_change(move_appointment):
         return jsonify({"message": "Requested slot is already booked"}), 409
 
-    # --- Update slot ---
-    patient = User.query.get(appt.patient_id)
-    doctor = User.query.get(appt.doctor_id)
-    appt.date = new_date_obj
-    appt.time = new_time_obj
-    appt.status = "Booked"  # Keep same canonical status
-    send_appointment_email(
-    patient=patient,
-    doctor=doctor,
-    date_obj=new_date_obj,
-    time_obj=new_time_obj,
-    action="rescheduled"
-)
+    kick_email_outbox()
 
-    db.session.commit()
     return jsonify({
         "message": "Appointment rescheduled successfully",
         "appointment": {
@@ -1314,129 +2095,399 @@ def reschedule_appointment(appointment_id):
 
 
 
+# Outbox delivery: rows are claimed, sent over one SMTP connection per batch,
+# and retried with exponential backoff until EMAIL_MAX_ATTEMPTS
+EMAIL_BATCH_SIZE = 100
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE = 60  # seconds; attempt n waits EMAIL_RETRY_BASE * 2**(n-1)
+EMAIL_CLAIM_TIMEOUT = 600  # seconds before a crashed worker's claim is retried
+
+
+def queue_email(recipient, subject, body, dedupe_key):
+    """
+    Add an email to the outbox on the current session; the caller commits it
+    together with the change it is about. A key that was already queued is
+    ignored, so retried requests and tasks don't mail twice.
+    """
+    if EmailOutbox.query.filter_by(dedupe_key=dedupe_key).first():
+        return False
+    db.session.add(EmailOutbox(dedupe_key=dedupe_key, recipient=recipient, subject=subject, body=body))
+    return True
+
+
+def kick_email_outbox():
+    """Ask a worker to drain the outbox now; the beat schedule covers us if the broker is down."""
+    try:
+        # retry=False: never hold the request waiting for an unreachable broker
+        drain_email_outbox.apply_async(retry=False)
+    except Exception as e:
+        print("Outbox kick failed:", e)
+
+
+def schedule_email_retry(row, error):
+    row.attempts += 1
+    row.last_error = str(error)[:200]
+    row.claimed_by = None
+    if row.attempts >= EMAIL_MAX_ATTEMPTS:
+        row.status = "Failed"
+    else:
+        row.status = "Pending"
+        row.next_attempt_at = DateTime.now() + timedelta(seconds=EMAIL_RETRY_BASE * 2 ** (row.attempts - 1))
+
+
+@celery.task(name="tasks.drain_email_outbox", ignore_result=True)
+def drain_email_outbox(batch_size=EMAIL_BATCH_SIZE):
+    now = DateTime.now()
+    due = (
+        db.session.query(EmailOutbox.id)
+        .filter(EmailOutbox.status.in_(["Pending", "Sending"]), EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not due:
+        return {"sent": 0, "failed": 0}
+
+    # Claim the batch; rows another worker claimed in the meantime no longer match
+    token = uuid.uuid4().hex
+    EmailOutbox.query.filter(
+        EmailOutbox.id.in_([i for (i,) in due]),
+        EmailOutbox.status.in_(["Pending", "Sending"]),
+        EmailOutbox.next_attempt_at <= now,
+    ).update(
+        {"status": "Sending", "claimed_by": token, "next_attempt_at": now + timedelta(seconds=EMAIL_CLAIM_TIMEOUT)},
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    rows = EmailOutbox.query.filter_by(claimed_by=token).order_by(EmailOutbox.id).all()
+    sent = failed = 0
+    try:
+        with mail.connect() as conn:
+            for row in rows:
+                try:
+                    conn.send(Message(subject=row.subject, recipients=[row.recipient], body=row.body))
+                    row.status = "Sent"
+                    row.sent_at = DateTime.now()
+                    row.claimed_by = None
+                    sent += 1
+                except Exception as e:
+                    schedule_email_retry(row, e)
+                    failed += 1
+                # commit per message so a crash never re-sends what already went out
+                db.session.commit()
+    except Exception as e:
+        # could not connect (or the connection dropped): retry whatever is left
+        for row in rows:
+            if row.status == "Sending":
+                schedule_email_retry(row, e)
+                failed += 1
+        db.session.commit()
+
+    if len(due) == batch_size:
+        kick_email_outbox()
+    return {"sent": sent, "failed": failed}
+
+
+@celery.task(name="tasks.reconcile_hospital_stats")
+def reconcile_hospital_stats():
+    """Recount the dashboard counters; also moves "upcoming" past midnight."""
+    values = recompute_stats()
+    db.session.commit()
+    return values
+
+
+# appointments per send_reminder_chunk subtask (and per SMTP connection)
+REMINDER_CHUNK_SIZE = 200
+
+
 @celery.task(name="tasks.daily_reminder")
-def daily_reminder():
-    today = DateTime.now().date()
-    appts = Appointment.query.filter_by(date=today, status="Booked").all()
-    for a in appts:
-        patient = User.query.get(a.patient_id)
-        doctor = User.query.get(a.doctor_id)
-        if patient and "@" in patient.username:
-            try:
-                msg = Message(subject="Appointment Reminder", recipients=[patient.username], body=f"Reminder: Appointment with Dr {doctor.username if doctor else 'N/A'} at {a.time} on {a.date}")
-                mail.send(msg)
-            except Exception:
-                pass
-    return "done"
+def daily_reminder(day=None):
+    """
+    Split the day's booked, not yet reminded appointments into chunks and
+    send them in parallel; summarize_reminders returns the totals, and its
+    task id comes back as summary_task_id. Reruns (or a retry after a
+    crash) skip everything already sent.
+    """
+    day = Date.fromisoformat(day) if day else DateTime.now().date()
+    ids = [
+        i for (i,) in db.session.query(Appointment.id)
+        .filter(Appointment.date == day, Appointment.status == "Booked", Appointment.reminder_sent_at.is_(None))
+        .order_by(Appointment.id)
+    ]
+    chunks = [ids[i:i + REMINDER_CHUNK_SIZE] for i in range(0, len(ids), REMINDER_CHUNK_SIZE)]
+    summary = None
+    if chunks:
+        summary = chord(send_reminder_chunk.s(chunk) for chunk in chunks)(summarize_reminders.s(str(day)))
+    return {
+        "date": str(day), "appointments": len(ids), "chunks": len(chunks),
+        "summary_task_id": summary.id if summary else None,
+    }
+
+
+@celery.task(name="tasks.send_reminder_chunk")
+def send_reminder_chunk(appointment_ids):
+    """Email one chunk of reminders over a single SMTP connection, marking each as it goes out."""
+    Patient = aliased(User)
+    Doctor = aliased(User)
+    rows = (
+        db.session.query(
+            Appointment.id, Appointment.date, Appointment.time, Appointment.status, Appointment.reminder_sent_at,
+            Patient.username.label("patient"), Doctor.username.label("doctor"),
+        )
+        .outerjoin(Patient, Patient.id == Appointment.patient_id)
+        .outerjoin(Doctor, Doctor.id == Appointment.doctor_id)
+        .filter(Appointment.id.in_(appointment_ids))
+        .order_by(Appointment.id)
+        .all()
+    )
+    # cancelled, rescheduled, already reminded or deleted since the chunk was queued
+    due = [r for r in rows if r.status == "Booked" and not r.reminder_sent_at and r.patient and "@" in r.patient]
+    counts = {"sent": 0, "failed": 0, "skipped": len(appointment_ids) - len(due)}
+    if not due:
+        return counts
+
+    try:
+        with mail.connect() as conn:
+            for r in due:
+                try:
+                    conn.send(Message(
+                        subject="Appointment Reminder",
+                        recipients=[r.patient],
+                        body=f"Reminder: Appointment with Dr {r.doctor or 'N/A'} at {r.time} on {r.date}",
+                    ))
+                except Exception as e:
+                    print("Reminder email error:", r.id, e)
+                    counts["failed"] += 1
+                    continue
+                # commit per message so a crash re-sends at most the one in flight
+                Appointment.query.filter_by(id=r.id).update({"reminder_sent_at": DateTime.now()})
+                db.session.commit()
+                counts["sent"] += 1
+    except Exception as e:
+        # could not connect, or the connection dropped; the next run picks up the rest
+        print("Reminder SMTP error:", e)
+        counts["failed"] = len(due) - counts["sent"]
+    return counts
+
+
+@celery.task(name="tasks.summarize_reminders")
+def summarize_reminders(chunk_counts, day):
+    """Add up the send_reminder_chunk counts: {"date", "sent", "failed", "skipped"}."""
+    totals = {"date": day, "sent": 0, "failed": 0, "skipped": 0}
+    for counts in chunk_counts:
+        for key in ("sent", "failed", "skipped"):
+            totals[key] += counts[key]
+    print("Daily reminders:", totals)
+    return totals
 
 @celery.task(name="tasks.monthly_doctor_activity")
-def monthly_doctor_activity():
+def monthly_doctor_activity(year=None, month=None):
+    """
+    Build every approved doctor's report for the month from one joined query,
+    then render and email them in parallel, one subtask per doctor.
+    """
     now = DateTime.now()
-    month = now.month
-    year = now.year
+    year = year or now.year
+    month = month or now.month
 
-    doctors = User.query.filter_by(role="doctor", approve=True).all()
+    # [first day of month, first day of next month) — a plain range the date indexes can use
+    start = Date(year, month, 1)
+    end = Date(year + month // 12, month % 12 + 1, 1)
 
-    for d in doctors:
-        appts = (
-            Appointment.query
-            .filter(
-                Appointment.doctor_id == d.id,
-                func.strftime("%m", Appointment.date) == f"{month:02d}"
+    doctors = db.session.query(User.id, User.username).filter_by(role="doctor", approve=True).all()
+
+    # the month may already be in the archive tier (see archive.py)
+    def tier(appointment, treatment):
+        return (
+            db.select(
+                appointment.id, appointment.doctor_id, appointment.patient_id, appointment.date, appointment.time,
+                appointment.status, treatment.id.label("treatment_id"), treatment.diagnosis, treatment.prescription,
             )
-            .all()
+            .outerjoin(treatment, treatment.appointment_id == appointment.id)
+            .where(appointment.date >= start, appointment.date < end)
         )
 
-        rows = []
-        completed = 0
-        cancelled = 0
-
-        for a in appts:
-            patient = User.query.get(a.patient_id)
-            treatment = Treatment.query.filter_by(appointment_id=a.id).first()
-
-            if a.status.lower() == "completed":
-                completed += 1
-            if a.status.lower() == "cancelled":
-                cancelled += 1
+    month_appts = through_tiers(tier)
+    Patient = aliased(User)
+    appts = (
+        db.session.query(
+            month_appts.c.id, month_appts.c.doctor_id, month_appts.c.date, month_appts.c.time, month_appts.c.status,
+            Patient.username, month_appts.c.diagnosis, month_appts.c.prescription,
+        )
+        .join(User, User.id == month_appts.c.doctor_id)
+        .outerjoin(Patient, Patient.id == month_appts.c.patient_id)
+        .filter(User.role == "doctor", User.approve == True)
+        .order_by(month_appts.c.doctor_id, month_appts.c.date, month_appts.c.time, month_appts.c.treatment_id)
+        .all()
+    )
 
-            rows.append({
-                "date": str(a.date),
-                "time": str(a.time),
-                "patient": patient.username if patient else "-",
-                "status": a.status,
-                "diagnosis": treatment.diagnosis if treatment else "",
-                "prescription": treatment.prescription if treatment else ""
-            })
+    rows_by_doctor = {}
+    seen = set()
+    for appt_id, doctor_id, day, at, status, patient, diagnosis, prescription in appts:
+        if appt_id in seen:
+            continue  # only the first treatment of an appointment is reported
+        seen.add(appt_id)
+        rows_by_doctor.setdefault(doctor_id, []).append({
+            "date": str(day),
+            "time": str(at),
+            "patient": patient or "-",
+            "status": status,
+            "diagnosis": diagnosis or "",
+            "prescription": prescription or ""
+        })
 
+    month_name = start.strftime("%B")
+    jobs = []
+    for doctor_id, username in doctors:
+        rows = rows_by_doctor.get(doctor_id, [])
         summary = {
             "month": month,
             "year": year,
-            "month_name": now.strftime("%B"),
-            "total": len(appts),
-            "completed": completed,
-            "cancelled": cancelled,
+            "month_name": month_name,
+            "total": len(rows),
+            "completed": sum(1 for r in rows if (r["status"] or "").lower() == "completed"),
+            "cancelled": sum(1 for r in rows if (r["status"] or "").lower() == "cancelled"),
         }
+        jobs.append(send_monthly_doctor_report.s(doctor_id, username, rows, summary))
+
+    group(jobs).apply_async()
+    return f"monthly_reports_queued:{len(jobs)}"
+
+
+@celery.task(name="tasks.send_monthly_doctor_report")
+def send_monthly_doctor_report(doctor_id, doctor_name, rows, summary):
+    # Generate PDF
+    pdf_file = generate_monthly_report_pdf(doctor_id, doctor_name, rows, summary)
+
+    # Email PDF to doctor
+    if "@" in doctor_name:
+        try:
+            msg = Message(
+                subject=f"Monthly Activity Report — {summary['month_name']} {summary['year']}",
+                recipients=[doctor_name],
+                body="Please find attached your monthly activity report.",
+            )
+            with app.open_resource(pdf_file) as pdf:
+                msg.attach(os.path.basename(pdf_file), "application/pdf", pdf.read())
+            mail.send(msg)
+        except Exception as e:
+            print("Email error:", e)
+
+    return pdf_file
+
+
+# ---------------------------
+# CSV exports: one joined query over both tiers (see archive.py) streamed with
+# yield_per, so memory stays flat however long the history is
+# ---------------------------
+EXPORT_CHUNK_ROWS = 1000
+
+TREATMENT_EXPORT_HEADER = ["appointment_date", "doctor_username", "diagnosis", "prescription", "notes"]
+DOCTOR_EXPORT_HEADER = ["appointment_id", "patient_id", "date", "time", "status", "remarks"]
+
+
+def treatment_export_rows(patient_id):
+    def tier(appointment, treatment):
+        return (
+            db.select(appointment.date, appointment.time, appointment.doctor_id, treatment.diagnosis, treatment.prescription, treatment.notes)
+            .join(appointment, treatment.appointment_id == appointment.id)
+            .where(appointment.patient_id == patient_id)
+        )
+
+    history = through_tiers(tier)
+    return (
+        db.session.query(history.c.date, User.username, history.c.diagnosis, history.c.prescription, history.c.notes)
+        .outerjoin(User, User.id == history.c.doctor_id)
+        .order_by(history.c.date, history.c.time)
+        .yield_per(EXPORT_CHUNK_ROWS)
+    )
+
+
+def doctor_export_rows(doctor_id):
+    def tier(appointment, _):
+        return (
+            db.select(appointment.id, appointment.patient_id, appointment.date, appointment.time, appointment.status, appointment.remarks)
+            .where(appointment.doctor_id == doctor_id)
+        )
+
+    appointments = through_tiers(tier)
+    return (
+        db.session.query(*appointments.c)
+        .order_by(appointments.c.date, appointments.c.time)
+        .yield_per(EXPORT_CHUNK_ROWS)
+    )
 
-        # Generate PDF
-        pdf_file = generate_monthly_report_pdf(d, rows, summary)
 
-        # Email PDF to doctor
-        if "@" in d.username:
-            try:
-                msg = Message(
-                    subject=f"Monthly Activity Report — {now.strftime('%B %Y')}",
-                    recipients=[d.username],
-                    body="Please find attached your monthly activity report.",
-                )
-                with app.open_resource(pdf_file) as pdf:
-                    msg.attach(os.path.basename(pdf_file), "application/pdf", pdf.read())
-                mail.send(msg)
-            except Exception as e:
-                print("Email error:", e)
+def csv_chunks(header, rows):
+    """Encode rows as CSV text, EXPORT_CHUNK_ROWS rows per yielded chunk."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(["" if v is None else str(v) for v in row])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
 
-    return "monthly_reports_done"
+
+def write_csv_report(owner_id, report_type, filename, header, rows):
+    """Stream rows into a cataloged report file (see reports.write_report); returns its path."""
+    def write(f):
+        for chunk in csv_chunks(header, rows):
+            f.write(chunk)
+
+    report = write_report(owner_id, report_type, filename, write)
+    db.session.commit()
+    return report_file_path(report.path)
+
+
+def csv_download(filename, header, rows):
+    """Chunked HTTP download of the same CSV, for exports small enough to skip Celery."""
+    return Response(
+        stream_with_context(csv_chunks(header, rows)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 @celery.task(name="tasks.export_treatments_csv")
 def export_treatments_csv(patient_id):
-    treatments = Treatment.query.join(Appointment).filter(Appointment.patient_id == patient_id).all()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["appointment_date", "doctor_username", "diagnosis", "prescription", "notes"])
-    for t in treatments:
-        appt = Appointment.query.get(t.appointment_id)
-        doctor = User.query.get(appt.doctor_id) if appt else None
-        writer.writerow([str(appt.date) if appt else "", doctor.username if doctor else "", t.diagnosis, t.prescription, t.notes])
-    os.makedirs(REPORTS_DIR, exist_ok=True)
-    path = os.path.join(REPORTS_DIR, f"patient_{patient_id}_treatments.csv")
-    with open(path, "w", newline="") as f:
-        f.write(output.getvalue())
-    return path
+    return write_csv_report(
+        patient_id, TREATMENTS_REPORT, f"patient_{patient_id}_treatments.csv",
+        TREATMENT_EXPORT_HEADER, treatment_export_rows(patient_id),
+    )
 
 
 @celery.task(name="tasks.export_professional_service_requests")
 def export_professional_service_requests(professional_id):
-    appts = Appointment.query.filter_by(doctor_id=professional_id).all()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["appointment_id", "patient_id", "date", "time", "status", "remarks"])
-    for a in appts:
-        writer.writerow([a.id, a.patient_id, str(a.date), str(a.time), a.status, a.remarks])
-    os.makedirs(REPORTS_DIR, exist_ok=True)
-    path = os.path.join(REPORTS_DIR, f"doctor_{professional_id}_appointments.csv")
-    with open(path, "w", newline="") as f:
-        f.write(output.getvalue())
-    return path
-
-def generate_monthly_report_pdf(doctor, rows, summary):
+    return write_csv_report(
+        professional_id, APPOINTMENTS_REPORT, f"doctor_{professional_id}_appointments.csv",
+        DOCTOR_EXPORT_HEADER, doctor_export_rows(professional_id),
+    )
+
+
+@celery.task(name="tasks.purge_expired_reports")
+def purge_expired_reports_task():
+    """Delete report files past their retention (hourly, see beat_schedule)."""
+    return f"reports_purged:{purge_expired_reports()}"
+
+
+@celery.task(name="tasks.archive_old_appointments")
+def archive_old_appointments_task():
+    """Move finished appointments past ARCHIVE_AFTER_DAYS to the archive tier (nightly, see beat_schedule)."""
+    return f"appointments_archived:{archive_old_appointments()}"
+
+def generate_monthly_report_pdf(doctor_id, doctor_name, rows, summary):
     month_name = summary["month_name"]
     year = summary["year"]
 
     # Render HTML template
     html = render_template(
         "monthly_report.html",
-        doctor_name=doctor.username,
+        doctor_name=doctor_name,
         rows=rows,
         month_name=month_name,
         year=year,
@@ -1447,15 +2498,12 @@ def generate_monthly_report_pdf(doctor, rows, summary):
     )
 
     # Save HTML report instead of PDF
-    filename = f"doctor_{doctor.id}_report_{year}_{summary['month']:02d}.html"
-    report_path = os.path.join(REPORTS_DIR, filename)
-
-    with open(report_path, "w", encoding="utf-8") as f:
-        f.write(html)
-
-    return report_path
+    filename = f"doctor_{doctor_id}_report_{year}_{summary['month']:02d}.html"
+    report = write_report(doctor_id, MONTHLY_REPORT, filename, lambda f: f.write(html), period=f"{year}-{summary['month']:02d}")
+    db.session.commit()
+    return report_file_path(report.path)
 
-def send_appointment_email(patient, doctor, date_obj, time_obj, action):
+def queue_appointment_email(appt, patient, doctor, action):
     """
     action = 'booked' | 'cancelled' | 'rescheduled'
     """
@@ -1463,7 +2511,8 @@ def send_appointment_email(patient, doctor, date_obj, time_obj, action):
     if not patient or "@" not in patient.username:
         return False  # invalid email
 
-    time_str = time_obj.strftime("%I:%M %p")
+    date_obj = appt.date
+    time_str = appt.time.strftime("%I:%M %p")
 
     # ---------- Define messages ----------
     subjects = {
@@ -1478,23 +2527,27 @@ def send_appointment_email(patient, doctor, date_obj, time_obj, action):
         "rescheduled": f"Your appointment with Dr {doctor.username} has been rescheduled to {date_obj} at {time_str}."
     }
 
-    subject = subjects.get(action, "Appointment Update")
-    body = bodies.get(action, "Your appointment has been updated.")
+    return queue_email(
+        recipient=patient.username,
+        subject=subjects.get(action, "Appointment Update"),
+        body=bodies.get(action, "Your appointment has been updated."),
+        dedupe_key=appointment_email_key(appt, action),
+    )
 
-    # ---------- Send Email ----------
-    try:
-        msg = Message(
-            subject=subject,
-            recipients=[patient.username],
-            body=body,
-        )
-        mail.send(msg)
-        print("EMAIL SENT:", subject)
-        return True
 
-    except Exception as e:
-        print("EMAIL FAILED:", e)
-        return False
+def appointment_email_key(appt, action):
+    """
+    Outbox key of an appointment email: appointment:<id>:<n>:<action>:<slot>,
+    where n counts the emails already queued for the appointment. A retry
+    of the same transaction gets the same key; a later event does not, even
+    if it repeats an earlier action on the same slot (cancel, rebook, cancel).
+    """
+    prefix = f"appointment:{appt.id}:"
+    # a range rather than LIKE, so the unique index is used (";" sorts right after ":")
+    queued = EmailOutbox.query.filter(
+        EmailOutbox.dedupe_key > prefix, EmailOutbox.dedupe_key < prefix[:-1] + ";",
+    ).count()
+    return f"{prefix}{queued + 1}:{action}:{appt.date}T{appt.time.strftime('%H%M')}"
 
 
 @app.route("/test-email")
@@ -0,0 +1,102 @@
+"""
+Hot/cold split of the appointment history.
+
+Reminders, availability, booking conflicts and the doctor/admin listings only
+care about upcoming and recent appointments, yet their indexes grew with
+every appointment ever made. archive_old_appointments() (the
+tasks.archive_old_appointments beat job) moves completed and cancelled
+appointments older than ARCHIVE_AFTER_DAYS, with their treatments, into
+appointments_archive / treatments_archive, ARCHIVE_BATCH appointments per
+transaction. Rows keep their ids, so links and search documents stay valid.
+
+Booked appointments are never archived, however old. Patient history, the
+CSV exports, the monthly doctor report, a doctor's patient list, the admin
+doctor counts and the dashboard counters read both tiers (through_tiers());
+everything else reads the hot tables only. Ids are never reused (AUTOINCREMENT,
+migration 12), so an archived id always means the same appointment.
+"""
+import os
+from datetime import date, timedelta
+
+from sqlalchemy import delete, insert, select, union_all
+
+from models import db, Appointment, Treatment, AppointmentArchive, TreatmentArchive
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+ARCHIVE_BATCH = 500
+ARCHIVED_STATUSES = ("Completed", "Cancelled")
+
+# (appointment model, treatment model) of each tier, hot first
+TIERS = ((Appointment, Treatment), (AppointmentArchive, TreatmentArchive))
+
+
+def archive_cutoff(today=None):
+    """Appointments dated before this day are old enough to archive."""
+    return (today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def table_rows(model, condition):
+    """Whole rows of model's table as column-name dicts (works before later columns are mapped)."""
+    return [dict(r) for r in db.session.execute(select(*model.__table__.c).where(condition)).mappings()]
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH):
+    """
+    Move up to batch_size archivable appointments and their treatments in
+    the current transaction; the caller commits. Returns the number moved.
+    """
+    ids = db.session.execute(
+        select(Appointment.id)
+        .where(Appointment.status.in_(ARCHIVED_STATUSES), Appointment.date < cutoff)
+        .order_by(Appointment.id)
+        .limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return 0
+
+    appointments = table_rows(Appointment, Appointment.id.in_(ids))
+    treatments = table_rows(Treatment, Treatment.appointment_id.in_(ids))
+    # Order matters for the search triggers: a treatment's document keeps its
+    # rowid, so the hot one has to go before the archived one comes in, and
+    # the archived one reads its patient/doctor from appointments_archive.
+    db.session.execute(insert(AppointmentArchive), appointments)
+    db.session.execute(delete(Treatment).where(Treatment.appointment_id.in_(ids)))
+    if treatments:
+        db.session.execute(insert(TreatmentArchive), treatments)
+    db.session.execute(delete(Appointment).where(Appointment.id.in_(ids)))
+    return len(ids)
+
+
+def archive_old_appointments(cutoff=None, batch_size=ARCHIVE_BATCH):
+    """
+    Archive everything past the horizon, one committed batch at a time, so
+    a crash or restart just resumes where it stopped. Returns the number of
+    appointments moved.
+    """
+    cutoff = cutoff or archive_cutoff()
+    moved = 0
+    while True:
+        n = archive_batch(cutoff, batch_size)
+        if not n:
+            return moved
+        db.session.commit()
+        moved += n
+
+
+def through_tiers(build):
+    """
+    UNION ALL of build(appointment_model, treatment_model) over both tiers,
+    as a subquery. build() returns a select with the same columns for each;
+    put the filters there so each branch uses its own indexes.
+    """
+    return union_all(*(build(a, t) for a, t in TIERS)).subquery()
+
+
+def treated_by(doctor_id, patient_id):
+    """Whether the doctor has any appointment with the patient, hot or archived."""
+    return any(
+        db.session.query(
+            db.exists().where(a.patient_id == patient_id, a.doctor_id == doctor_id)
+        ).scalar()
+        for a, _ in TIERS
+    )
@@ -0,0 +1,255 @@
+"""
+Doctor availability stored as rows instead of a JSON blob.
+
+A doctor's usual hours are weekly AvailabilityTemplate intervals. An
+AvailabilityException replaces the template for one date: either a day off
+(available=False) or that day's own intervals. expand_availability() turns
+this into bookable slots for just the requested window, with a constant
+number of queries whatever the window size; check_slot() applies the same
+rules to a single booking.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, time as Time
+
+from models import db, Appointment, AvailabilityTemplate, AvailabilityException, DoctorProfile
+
+# Interval used for days switched on through the old date -> true/false API
+DEFAULT_START = Time(11, 0)
+DEFAULT_END = Time(17, 0)
+DEFAULT_SLOT_MINUTES = 30
+
+MIN_SLOT_MINUTES = 5
+MAX_SLOT_MINUTES = 240
+
+
+def parse_time(value):
+    return datetime.strptime(value, "%H:%M").time()
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_interval(data):
+    """(start, end, slot_minutes) from {"start": "HH:MM", "end": "HH:MM", "slot_minutes": n}; raises ValueError."""
+    start = parse_time(data.get("start") or DEFAULT_START.strftime("%H:%M"))
+    end = parse_time(data.get("end") or DEFAULT_END.strftime("%H:%M"))
+    slot_minutes = int(data.get("slot_minutes") or DEFAULT_SLOT_MINUTES)
+    if start >= end:
+        raise ValueError("start must be before end")
+    if not MIN_SLOT_MINUTES <= slot_minutes <= MAX_SLOT_MINUTES:
+        raise ValueError(f"slot_minutes must be between {MIN_SLOT_MINUTES} and {MAX_SLOT_MINUTES}")
+    return start, end, slot_minutes
+
+
+def interval_slots(day, start, end, slot_minutes):
+    current = datetime.combine(day, start)
+    stop = datetime.combine(day, end)
+    step = timedelta(minutes=slot_minutes)
+    while current + step <= stop:
+        yield current.time()
+        current += step
+
+
+def load_intervals(doctor_id, date_from, date_to):
+    """(templates by weekday, exceptions by date) of the doctor for the window; two queries."""
+    templates = defaultdict(list)
+    for t in AvailabilityTemplate.query.filter_by(doctor_id=doctor_id):
+        templates[t.weekday].append((t.start_time, t.end_time, t.slot_minutes))
+
+    exceptions = defaultdict(list)
+    for e in AvailabilityException.query.filter(
+        AvailabilityException.doctor_id == doctor_id,
+        AvailabilityException.date >= date_from,
+        AvailabilityException.date <= date_to,
+    ):
+        exceptions[e.date].append((e.start_time, e.end_time, e.slot_minutes) if e.available else None)
+    return templates, exceptions
+
+
+def day_intervals(templates, exceptions, day):
+    intervals = exceptions[day] if day in exceptions else templates.get(day.weekday(), [])
+    return sorted(i for i in intervals if i is not None)
+
+
+def load_booked(doctor_id, date_from, date_to, ignore_appointment_id=None):
+    """Start times of the booked appointments per day in the window; one query."""
+    q = db.session.query(Appointment.date, Appointment.time).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.status == "Booked",
+        Appointment.date >= date_from,
+        Appointment.date <= date_to,
+    )
+    if ignore_appointment_id is not None:
+        q = q.filter(Appointment.id != ignore_appointment_id)
+    booked = defaultdict(list)
+    for d, t in q:
+        booked[d].append(t)
+    return booked
+
+
+def minutes_of(t):
+    return t.hour * 60 + t.minute
+
+
+def slot_minutes_at(intervals, at):
+    """Length of the slot starting at `at`, or None if no interval has one there (longest if several do)."""
+    return max((
+        slot_minutes for start, end, slot_minutes in intervals
+        if start <= at and (minutes_of(at) - minutes_of(start)) % slot_minutes == 0
+        and minutes_of(at) + slot_minutes <= minutes_of(end)
+    ), default=None)
+
+
+def busy_spans(intervals, day, times):
+    """
+    (start, end) of each booked appointment. Appointments have no length of
+    their own: it is that of the slot they start, else of the interval they
+    fall in (hours changed since), else DEFAULT_SLOT_MINUTES.
+    """
+    spans = []
+    for at in times:
+        minutes = slot_minutes_at(intervals, at) or max((
+            slot_minutes for start, end, slot_minutes in intervals if start <= at < end
+        ), default=DEFAULT_SLOT_MINUTES)
+        spans.append(span(day, at, minutes))
+    return spans
+
+
+def span(day, at, minutes):
+    start = datetime.combine(day, at)
+    return start, start + timedelta(minutes=minutes)
+
+
+def overlaps(start, end, spans):
+    return any(s < end and start < e for s, e in spans)
+
+
+def expand_availability(doctor_id, date_from, date_to):
+    """
+    Free slots per available day in [date_from, date_to], as
+    [{"date": "YYYY-MM-DD", "slots": ["11:00 AM", ...]}, ...]. A slot is
+    free when no booked appointment overlaps it, whatever their lengths.
+
+    Three queries: the doctor's templates, the exceptions in range and the
+    booked appointments in range.
+    """
+    templates, exceptions = load_intervals(doctor_id, date_from, date_to)
+    booked = load_booked(doctor_id, date_from, date_to)
+
+    days = []
+    day = date_from
+    while day <= date_to:
+        intervals = day_intervals(templates, exceptions, day)
+        if intervals:
+            busy = busy_spans(intervals, day, booked.get(day, ()))
+            slots = [
+                slot.strftime("%I:%M %p")
+                for start, end, slot_minutes in intervals
+                for slot in interval_slots(day, start, end, slot_minutes)
+                if not overlaps(*span(day, slot, slot_minutes), busy)
+            ]
+            days.append({"date": day.strftime("%Y-%m-%d"), "slots": slots})
+        day += timedelta(days=1)
+    return days
+
+
+class SlotTaken(Exception):
+    """Raised inside a booking transaction when check_slot() finds the slot gone; see commit_slot_change."""
+
+
+def check_slot(doctor_id, day, at, ignore_appointment_id=None):
+    """
+    None if an appointment at (day, at) is bookable: `at` starts one of the
+    doctor's slots that day and no other booked appointment overlaps it.
+    Otherwise "unavailable" or "booked". Three queries.
+    """
+    templates, exceptions = load_intervals(doctor_id, day, day)
+    intervals = day_intervals(templates, exceptions, day)
+    slot_minutes = slot_minutes_at(intervals, at)
+    if slot_minutes is None:
+        return "unavailable"
+    booked = load_booked(doctor_id, day, day, ignore_appointment_id)
+    if overlaps(*span(day, at, slot_minutes), busy_spans(intervals, day, booked.get(day, ()))):
+        return "booked"
+    return None
+
+
+def day_flags(doctor_id, date_from, date_to):
+    """
+    The old {date: true/false} view of the window for the availability page:
+    true for days with hours, false for explicit days off; days with no
+    setting at all are left out.
+    """
+    flags = {d["date"]: True for d in expand_availability(doctor_id, date_from, date_to)}
+    for e in AvailabilityException.query.filter(
+        AvailabilityException.doctor_id == doctor_id,
+        AvailabilityException.available == False,
+        AvailabilityException.date >= date_from,
+        AvailabilityException.date <= date_to,
+    ):
+        flags.setdefault(e.date.strftime("%Y-%m-%d"), False)
+    return flags
+
+
+def replace_weekly(doctor_id, weekly):
+    """Replace all weekly templates with [{"weekday", "start", "end", "slot_minutes"}]; caller commits."""
+    rows = []
+    for item in weekly:
+        weekday = int(item.get("weekday"))
+        if not 0 <= weekday <= 6:
+            raise ValueError("weekday must be 0 (Monday) to 6 (Sunday)")
+        start, end, slot_minutes = parse_interval(item)
+        rows.append(AvailabilityTemplate(
+            doctor_id=doctor_id, weekday=weekday, start_time=start, end_time=end, slot_minutes=slot_minutes,
+        ))
+    AvailabilityTemplate.query.filter_by(doctor_id=doctor_id).delete()
+    db.session.add_all(rows)
+
+
+def replace_exceptions(doctor_id, exceptions):
+    """
+    Set per-date overrides from [{"date", "available", "start", "end", "slot_minutes"}].
+    Every date mentioned loses its previous overrides; several entries for
+    the same date give that day several intervals. Caller commits.
+    """
+    rows = []
+    for item in exceptions:
+        day = parse_date(item.get("date") or "")
+        if item.get("available", True):
+            start, end, slot_minutes = parse_interval(item)
+            rows.append(AvailabilityException(
+                doctor_id=doctor_id, date=day, available=True,
+                start_time=start, end_time=end, slot_minutes=slot_minutes,
+            ))
+        else:
+            rows.append(AvailabilityException(doctor_id=doctor_id, date=day, available=False))
+    dates = {r.date for r in rows}
+    if dates:
+        AvailabilityException.query.filter(
+            AvailabilityException.doctor_id == doctor_id,
+            AvailabilityException.date.in_(dates),
+        ).delete(synchronize_session=False)
+    db.session.add_all(rows)
+
+
+def apply_day_flags(doctor_id, flags):
+    """Store the old {"YYYY-MM-DD": true/false} format as per-date exceptions; caller commits."""
+    if isinstance(flags, str):
+        flags = json.loads(flags)
+    if not isinstance(flags, dict):
+        raise ValueError("availability must map dates to true/false")
+    replace_exceptions(doctor_id, [{"date": day, "available": bool(on)} for day, on in flags.items()])
+
+
+def migrate_profile_blobs():
+    """Convert every DoctorProfile.availability JSON blob into exceptions (used by migrations.py)."""
+    converted = 0
+    for profile in DoctorProfile.query.filter(DoctorProfile.availability.isnot(None), DoctorProfile.user_id.isnot(None)):
+        try:
+            apply_day_flags(profile.user_id, profile.availability)
+        except (ValueError, TypeError):
+            continue  # free text typed into the admin form; nothing to convert
+        converted += 1
+    return converted
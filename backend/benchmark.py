@@ -0,0 +1,338 @@
+"""
+Endpoint benchmarks against a datagen.py database.
+
+Drives the hot endpoints through the Flask test client and records latency
+percentiles plus SQL statements per request. Results can be saved as a
+baseline and later runs compared against it.
+
+    cd backend
+    export DATABASE_URL=sqlite:////tmp/hms_bench.db
+    python datagen.py --scale small
+    python benchmark.py --save benchmarks/baseline.json
+    # ...change something...
+    python benchmark.py --compare benchmarks/baseline.json
+
+--compare exits with status 1 when a scenario got slower than --tolerance
+or issues more statements than the baseline.
+
+--revalidate sends each GET scenario's ETag back as If-None-Match, which
+measures the 304 path of an unchanged view (see conditional.py).
+
+--contention SECONDS instead runs reader and writer threads against the
+database together and reports throughput and "database is locked"
+failures. Run it with HMS_SQLITE_TUNING=0 for the untuned rollback-journal
+numbers, each time on a fresh copy of the same datagen database:
+
+    HMS_SQLITE_TUNING=0 python benchmark.py --contention 30 --save benchmarks/contention-before.json
+    python benchmark.py --contention 30 --save benchmarks/contention-after.json
+
+All threads share one process, so readers and writers also compete for the
+CPU: when writers stop waiting on locks they take a larger share of it.
+--writers 0 measures the readers alone.
+"""
+import os
+import sys
+import argparse
+import json
+import platform
+import statistics
+import threading
+import time
+from datetime import date, time as Time, timedelta
+
+# mail is never sent and Celery tasks run inline, so exports and the outbox
+# are measured in-process without a broker or SMTP server
+os.environ.setdefault("MAIL_SUPPRESS_SEND", "1")
+
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from flask_jwt_extended import create_access_token
+
+import revocation
+from app import app, celery
+from datagen import WORKING_WEEKDAYS
+from models import db, User, Appointment, Treatment
+
+celery.conf.task_always_eager = True
+# the revocation set re-checks its version every POLL_SECONDS; that query
+# would be counted against whichever request happens to run at that moment
+revocation.POLL_SECONDS = float("inf")
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def token_for(user):
+    with app.app_context():
+        return create_access_token(identity=user.username, additional_claims={"user_id": user.id, "role": user.role})
+
+
+def working_day(after, n):
+    """
+    The n-th day (from 0) after `after` on which the datagen doctors work;
+    bookings on their days off are refused.
+    """
+    monday = after + timedelta(days=7 - after.weekday())
+    weeks, i = divmod(n, len(WORKING_WEEKDAYS))
+    return monday + timedelta(weeks=weeks, days=WORKING_WEEKDAYS[i])
+
+
+def pick_subjects():
+    """The busiest doctor and patient make the worst-case (and most stable) requests."""
+    with app.app_context():
+        admin = User.query.filter_by(role="admin").first()
+        doctor_id = (
+            db.session.query(Appointment.doctor_id)
+            .group_by(Appointment.doctor_id)
+            .order_by(func.count(Appointment.id).desc())
+            .limit(1).scalar()
+        )
+        patient_id = (
+            db.session.query(Appointment.patient_id)
+            .join(Treatment, Treatment.appointment_id == Appointment.id)
+            .group_by(Appointment.patient_id)
+            .order_by(func.count(Treatment.id).desc())
+            .limit(1).scalar()
+        )
+        if not (admin and doctor_id and patient_id):
+            raise SystemExit("No data; run datagen.py against DATABASE_URL first.")
+        subjects = {
+            "admin": db.session.get(User, admin.id),
+            "doctor": db.session.get(User, doctor_id),
+            "patient": db.session.get(User, patient_id),
+        }
+        return {role: (u.id, token_for(u)) for role, u in subjects.items()}
+
+
+def scenarios(subjects):
+    """(name, role, method, path, json body or callable(i) -> body)"""
+    doctor_id = subjects["doctor"][0]
+    patient_id = subjects["patient"][0]
+    # one fresh slot per iteration, on days after the doctor's last appointment
+    with app.app_context():
+        last_day = db.session.query(func.max(Appointment.date)).filter(Appointment.doctor_id == doctor_id).scalar()
+    after = max(last_day, date.today())
+
+    def booking_body(i):
+        return {"doctor_id": doctor_id, "date": str(working_day(after, i)), "time": "11:00 AM"}
+
+    return [
+        ("book_appointment", "patient", "POST", "/appointments/book", booking_body),
+        ("doctor_availability", "patient", "GET", f"/doctor/{doctor_id}/availability", None),
+        ("doctor_appointments", "doctor", "GET", "/doctor/appointments", None),
+        ("patient_history", "admin", "GET", f"/patient/{patient_id}/history", None),
+        ("patient_treatments", "patient", "GET", "/patient/treatments", None),
+        ("admin_dashboard", "admin", "GET", "/admin/dashboard", None),
+        ("admin_appointments", "admin", "GET", "/admin/appointments", None),
+        ("admin_doctors", "admin", "GET", "/admin/doctors?with_counts=1", None),
+        ("admin_bootstrap", "admin", "GET", "/admin/bootstrap", None),
+        ("export_treatments", "patient", "GET", "/patient/export_treatments", None),
+        ("export_doctor_appointments", "admin", "GET", f"/admin/export/{doctor_id}", None),
+    ]
+
+
+def run_scenario(client, headers, method, path, body, iterations, warmup, revalidate=False):
+    counter = StatementCounter()
+    timings, statements = [], []
+    headers = dict(headers)
+    for i in range(warmup + iterations):
+        json_body = body(i) if callable(body) else body
+        counter.count = 0
+        event.listen(Engine, "after_cursor_execute", counter)
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=json_body, headers=headers)
+        elapsed = time.perf_counter() - start
+        event.remove(Engine, "after_cursor_execute", counter)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if revalidate and method == "GET" and response.headers.get("ETag"):
+            headers["If-None-Match"] = response.headers["ETag"]
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            statements.append(counter.count)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "statements": max(statements),
+    }
+
+
+def contention(subjects, seconds, readers, writers):
+    """
+    Readers loop over availability, appointment listing and CSV export while
+    writers book fresh slots, all at once for `seconds`.
+    """
+    doctor_id = subjects["doctor"][0]
+    with app.app_context():
+        last_day = db.session.query(func.max(Appointment.date)).filter(Appointment.doctor_id == doctor_id).scalar()
+    after = max(last_day, date.today()) + timedelta(days=400)
+    read_paths = [
+        ("patient", f"/doctor/{doctor_id}/availability"),
+        ("admin", "/admin/appointments"),
+        ("doctor", "/doctor/appointments"),
+        ("admin", f"/admin/export/{doctor_id}"),
+    ]
+    slot_times = [Time(h, m).strftime("%I:%M %p") for h in range(11, 17) for m in (0, 30)]
+
+    lock = threading.Lock()
+    totals = {"reads": 0, "writes": 0, "locked": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+
+    def record(key):
+        with lock:
+            totals[key] += 1
+
+    def outcome(response, ok_key):
+        if response.status_code < 400 or response.status_code == 409:
+            record(ok_key)
+        elif "locked" in response.get_data(as_text=True):
+            record("locked")
+        else:
+            record("errors")
+
+    def reader(n):
+        client = app.test_client()
+        i = n
+        while time.perf_counter() < deadline:
+            role, path = read_paths[i % len(read_paths)]
+            try:
+                outcome(client.get(path, headers={"Authorization": "Bearer " + subjects[role][1]}), "reads")
+            except Exception as e:
+                record("locked" if "locked" in str(e) else "errors")
+            i += 1
+
+    def writer(n):
+        client = app.test_client()
+        headers = {"Authorization": "Bearer " + subjects["patient"][1]}
+        i = 0
+        while time.perf_counter() < deadline:
+            # writer n owns every writers-th day, so bookings never collide
+            day = working_day(after, (i // len(slot_times)) * writers + n)
+            body = {"doctor_id": doctor_id, "date": str(day), "time": slot_times[i % len(slot_times)]}
+            try:
+                outcome(client.post("/appointments/book", json=body, headers=headers), "writes")
+            except Exception as e:
+                record("locked" if "locked" in str(e) else "errors")
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 2),
+        "readers": readers,
+        "writers": writers,
+        "sqlite_pragmas": app.config["SQLITE_PRAGMAS"],
+        "reads_per_s": round(totals["reads"] / elapsed, 1),
+        "writes_per_s": round(totals["writes"] / elapsed, 1),
+        "locked": totals["locked"],
+        "errors": totals["errors"],
+    }
+
+
+def table_counts():
+    with app.app_context():
+        return {
+            "users": User.query.count(),
+            "appointments": Appointment.query.count(),
+            "treatments": Treatment.query.count(),
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Print a diff against the baseline; return True if nothing regressed."""
+    ok = True
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before:
+            print(f"{name:28} new")
+            continue
+        ratio = current["p50_ms"] / before["p50_ms"] if before["p50_ms"] else 1.0
+        slower = ratio > 1 + tolerance
+        more_sql = current["statements"] > before["statements"]
+        flag = "REGRESSION" if slower or more_sql else ""
+        ok = ok and not flag
+        print(f"{name:28} p50 {before['p50_ms']:>9.2f} -> {current['p50_ms']:>9.2f} ms ({ratio:5.2f}x)  "
+              f"sql {before['statements']:>5} -> {current['statements']:>5}  {flag}")
+
+    current, before = results.get("contention"), baseline.get("contention")
+    if current and before:
+        for key in ("reads_per_s", "writes_per_s"):
+            ratio = current[key] / before[key] if before[key] else 1.0
+            flag = "REGRESSION" if ratio < 1 - tolerance else ""
+            ok = ok and not flag
+            print(f"{key:28} {before[key]:>9.1f} -> {current[key]:>9.1f} /s ({ratio:5.2f}x)  {flag}")
+        more_locked = current["locked"] > before["locked"]
+        ok = ok and not more_locked
+        print(f"{'locked':28} {before['locked']:>9} -> {current['locked']:>9}  {'REGRESSION' if more_locked else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", action="append", help="run just these scenarios (repeatable)")
+    parser.add_argument("--save", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown (0.2 = 20%%)")
+    parser.add_argument("--revalidate", action="store_true", help="send If-None-Match with the ETag of the previous response")
+    parser.add_argument("--contention", type=float, metavar="SECONDS", help="run the concurrent read/write test instead")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    args = parser.parse_args()
+
+    subjects = pick_subjects()
+    client = app.test_client()
+    results = {
+        "meta": {
+            "database": app.config["SQLALCHEMY_DATABASE_URI"],
+            "rows": table_counts(),
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "scenarios": {},
+    }
+
+    if args.contention:
+        results["contention"] = stats = contention(subjects, args.contention, args.readers, args.writers)
+        print(f"reads {stats['reads_per_s']:>8.1f}/s  writes {stats['writes_per_s']:>8.1f}/s  "
+              f"locked {stats['locked']:>5}  errors {stats['errors']:>5}")
+
+    for name, role, method, path, body in scenarios(subjects):
+        if args.contention or (args.only and name not in args.only):
+            continue
+        headers = {"Authorization": "Bearer " + subjects[role][1]}
+        results["scenarios"][name] = stats = run_scenario(
+            client, headers, method, path, body, args.iterations, args.warmup, args.revalidate,
+        )
+        print(f"{name:28} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  sql {stats['statements']:>5}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Conditional GETs and compression for the JSON endpoints.
+
+Every write bumps a per-table version stamp, the "version:<table>" row of
+hospital_stats. Session events note the tables a transaction writes
+(after_flush for ORM objects, do_orm_execute for bulk update()/delete()/
+insert() statements) and after_commit bumps them in one short transaction
+of its own. Bumping inside the writer's transaction would hold the stamp
+rows locked until it commits, serializing every writer of a table on
+PostgreSQL. The stamp therefore moves just after the data does; a view
+read in between is revalidated on the next request. Raw text() SQL is not
+seen; call mark_tables_changed() next to it.
+
+@conditional(*tables) builds a view's ETag from the stamps of the tables it
+reads, plus the path, query string, caller and today's date, which moves
+every "from today" window along. If-None-Match is checked against it before
+the view runs, so an unchanged view costs one small query and no
+serialisation. compress_response() gzips large JSON bodies.
+"""
+import gzip
+import hashlib
+import json
+from datetime import date
+from functools import wraps
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt
+from sqlalchemy import event, insert, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, HospitalStat
+
+VERSION_PREFIX = "version:"
+# tables whose writes invalidate cached views
+VERSIONED_TABLES = (
+    "users", "departments", "doctor_profiles", "patient_profiles", "appointments", "treatments",
+    "availability_templates", "availability_exceptions", "appointment_rollups",
+)
+
+# smaller bodies fit in a packet or two anyway
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+def version_stat(table):
+    return VERSION_PREFIX + table
+
+
+def bump_table_versions(connection, tables):
+    """Add one to the stamps of the given tables on this connection, in its current transaction."""
+    names = sorted(version_stat(t) for t in tables if t in VERSIONED_TABLES)
+    if not names:
+        return
+    result = connection.execute(
+        update(HospitalStat).where(HospitalStat.name.in_(names)).values(value=HospitalStat.value + 1)
+    )
+    if result.rowcount < len(names):
+        # migration 8 seeds the rows; this only covers databases built by create_all() since
+        existing = set(connection.execute(
+            db.select(HospitalStat.name).where(HospitalStat.name.in_(names))
+        ).scalars())
+        for name in names:
+            if name not in existing:
+                connection.execute(insert(HospitalStat).values(name=name, value=1))
+
+
+def seed_table_versions():
+    """Create the version rows that are missing (used by migrations.py); the caller commits."""
+    existing = {name for (name,) in db.session.query(HospitalStat.name).filter(HospitalStat.name.startswith(VERSION_PREFIX))}
+    for table in VERSIONED_TABLES:
+        if version_stat(table) not in existing:
+            db.session.add(HospitalStat(name=version_stat(table), value=1))
+
+
+def mark_tables_changed(session, tables):
+    """Have the stamps of these tables bumped once the session's transaction commits."""
+    session.info.setdefault("changed_tables", set()).update(t for t in tables if t in VERSIONED_TABLES)
+
+
+def _flushed_tables(session, flush_context):
+    tables = set()
+    for obj in list(session.new) + list(session.deleted):
+        tables.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tables.add(obj.__table__.name)
+    # new/dirty/deleted still hold the pre-flush state here
+    mark_tables_changed(session, tables)
+
+
+def _bulk_statement_tables(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            mark_tables_changed(orm_execute_state.session, {table.name})
+
+
+def _bump_committed_tables(session):
+    if session.in_nested_transaction():
+        # a SAVEPOINT was released; the outer transaction still holds the
+        # write lock, so the stamps wait for its commit
+        return
+    tables = session.info.pop("changed_tables", None)
+    if not tables:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            bump_table_versions(connection, tables)
+    except OperationalError as e:
+        # the data is committed either way; the next write to these tables moves the stamps
+        print("Version stamp error:", e)
+
+
+def _forget_uncommitted_tables(session, transaction):
+    # rolled back or closed; a commit has already taken them (after_commit runs first)
+    if transaction.parent is None:
+        session.info.pop("changed_tables", None)
+
+
+def install_version_tracking(session):
+    event.listen(session, "after_flush", _flushed_tables)
+    event.listen(session, "do_orm_execute", _bulk_statement_tables)
+    event.listen(session, "after_commit", _bump_committed_tables)
+    event.listen(session, "after_transaction_end", _forget_uncommitted_tables)
+
+
+def table_versions(tables):
+    return dict(
+        db.session.query(HospitalStat.name, HospitalStat.value)
+        .filter(HospitalStat.name.in_([version_stat(t) for t in tables]))
+        .all()
+    )
+
+
+def view_etag(tables):
+    claims = get_jwt()
+    key = json.dumps([
+        request.path,
+        sorted(request.args.items(multi=True)),
+        claims.get("user_id"),
+        claims.get("role"),
+        date.today().isoformat(),
+        sorted(table_versions(tables).items()),
+    ])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional(*tables):
+    """
+    GETs of the wrapped view get a weak ETag and a 304 when If-None-Match
+    still matches. Goes below @jwt_required, since the caller is part of the
+    tag; other methods pass straight through.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+            etag = view_etag(tables)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # revalidate on every use; the browser resends the tag as If-None-Match
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def compress_response(response):
+    """after_request hook: gzip JSON bodies of GZIP_MIN_BYTES and more for clients that accept it."""
+    if (
+        response.status_code != 200
+        or response.mimetype != "application/json"
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,94 @@
+"""
+Engine settings for SQLite (default) and PostgreSQL.
+
+DATABASE_URL picks the database without code changes:
+
+    DATABASE_URL=sqlite:////var/lib/hms/hospital.db
+    DATABASE_URL=postgresql://hms:secret@db/hms      (pip install psycopg2-binary)
+
+Pool sizing comes from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and
+DB_POOL_RECYCLE.
+
+Every new SQLite connection gets SQLITE_PRAGMAS. WAL lets readers keep
+going while one writer commits, so exports and dashboards no longer block
+bookings with "database is locked". synchronous=NORMAL is durable enough
+under WAL and skips an fsync per commit, and mmap/cache_size keep hot pages
+in memory. HMS_SQLITE_TUNING=0 keeps SQLite's stock rollback journal, which
+benchmark.py --contention uses as the "before" case.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+
+DEFAULT_DATABASE_URL = "sqlite:///hospital.db"
+
+# seconds a connection waits for a lock before "database is locked"
+BUSY_TIMEOUT = 30
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": BUSY_TIMEOUT * 1000,
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_MB", 64)) * 1024,  # negative = KiB
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_MB", 256)) * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# stock SQLite behaviour; switching back matters because journal_mode is stored in the file
+UNTUNED_SQLITE_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+}
+
+
+def database_url():
+    url = os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL)
+    # Heroku-style URLs; SQLAlchemy only knows the postgresql:// scheme
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database URL."""
+    options = {}
+    if make_url(url).get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False, "timeout": BUSY_TIMEOUT}
+        if is_memory_sqlite(url):
+            return options  # Flask-SQLAlchemy gives these a single shared connection
+    else:
+        # drop connections the server closed while they sat in the pool
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+    options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", 10))
+    options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    options["pool_timeout"] = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    return options
+
+
+def sqlite_pragmas():
+    if os.environ.get("HMS_SQLITE_TUNING", "1") == "0":
+        return dict(UNTUNED_SQLITE_PRAGMAS)
+    return dict(SQLITE_PRAGMAS)
+
+
+def init_sqlite_pragmas(engine, pragmas):
+    """Run the PRAGMAs on every new connection of a SQLite engine; no-op for other databases."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
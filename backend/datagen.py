@@ -0,0 +1,189 @@
+"""
+Synthetic hospital data for benchmarks.
+
+Fills an EMPTY database (DATABASE_URL) with departments, doctors, patients,
+appointments and treatments through the tables in models.py, in batched
+multi-row inserts. Output is deterministic for a given --seed.
+
+    cd backend
+    DATABASE_URL=sqlite:////tmp/hms_bench.db python datagen.py --scale small
+    DATABASE_URL=sqlite:////tmp/hms_bench.db python datagen.py --doctors 500 --patients 200000 --appointments 5000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, time as Time
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from app import app, initialize_database
+from availability import DEFAULT_START, DEFAULT_END, DEFAULT_SLOT_MINUTES
+from models import (
+    db, User, Department, DoctorProfile, PatientProfile, Appointment, Treatment, AvailabilityTemplate,
+)
+from stats import recompute_stats
+from rollups import rebuild_rollups
+
+SCALES = {
+    "small": {"doctors": 20, "patients": 1000, "appointments": 20000},
+    "medium": {"doctors": 100, "patients": 20000, "appointments": 500000},
+    "large": {"doctors": 500, "patients": 200000, "appointments": 5000000},
+}
+
+BATCH_SIZE = 5000
+# every generated account logs in with this password
+PASSWORD = "bench123"
+# every doctor works the default hours Monday to Saturday
+WORKING_WEEKDAYS = range(6)
+
+DEPARTMENTS = [
+    "Cardiology", "Neurology", "Orthopedics", "Dermatology", "Pediatrics", "Oncology",
+    "Gastroenterology", "Ophthalmology", "ENT", "Psychiatry", "Urology", "General Medicine",
+]
+FIRST_NAMES = ["Aarav", "Priya", "Rohan", "Ananya", "Vikram", "Sneha", "Arjun", "Kavya", "Rahul", "Meera",
+               "John", "Maria", "Ahmed", "Lena", "Wei", "Sofia", "Omar", "Emma", "Yuki", "Carlos"]
+LAST_NAMES = ["Sharma", "Reddy", "Iyer", "Patel", "Banda", "Khan", "Singh", "Das", "Nair", "Gupta",
+              "Smith", "Garcia", "Chen", "Müller", "Rossi", "Silva", "Kim", "Ali", "Novak", "Brown"]
+DIAGNOSES = ["Hypertension", "Type 2 diabetes", "Migraine", "Lower back pain", "Eczema", "Seasonal allergy",
+             "Viral fever", "Gastritis", "Anxiety disorder", "Osteoarthritis", "Asthma", "Sinusitis"]
+PRESCRIPTIONS = ["Paracetamol 500mg twice daily", "Amlodipine 5mg once daily", "Metformin 500mg with meals",
+                 "Cetirizine 10mg at night", "Ibuprofen 400mg as needed", "Omeprazole 20mg before breakfast",
+                 "Topical hydrocortisone", "Physiotherapy twice a week"]
+
+SLOTS_PER_DAY = (DEFAULT_END.hour - DEFAULT_START.hour) * 60 // DEFAULT_SLOT_MINUTES
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_rows(model, rows):
+    count = 0
+    for batch in batched(rows):
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+def generate(doctors, patients, appointments, seed=42):
+    rng = random.Random(seed)
+    initialize_database()
+    if Appointment.query.first() or User.query.filter(User.role != "admin").first():
+        raise SystemExit("Database is not empty; point DATABASE_URL at a fresh file.")
+
+    password = generate_password_hash(PASSWORD)  # hashing per user would dominate the run
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    doctor_ids = list(range(first_user_id, first_user_id + doctors))
+    patient_ids = list(range(doctor_ids[-1] + 1, doctor_ids[-1] + 1 + patients))
+
+    insert_rows(Department, (
+        {"id": i, "name": name, "description": f"{name} Department"}
+        for i, name in enumerate(DEPARTMENTS, start=1)
+    ))
+    doctor_dept = {d: rng.randint(1, len(DEPARTMENTS)) for d in doctor_ids}
+
+    insert_rows(User, (
+        {"id": d, "username": f"doctor{i}@hms.test", "password": password, "role": "doctor",
+         "approve": True, "blocked": False}
+        for i, d in enumerate(doctor_ids)
+    ))
+    insert_rows(User, (
+        {"id": p, "username": f"patient{i}@hms.test", "password": password, "role": "patient",
+         "approve": True, "blocked": False}
+        for i, p in enumerate(patient_ids)
+    ))
+
+    today = datetime.now().date()
+    insert_rows(DoctorProfile, (
+        {"user_id": d, "specialization_id": doctor_dept[d], "experience": f"{rng.randint(1, 30)} years"}
+        for d in doctor_ids
+    ))
+    insert_rows(AvailabilityTemplate, (
+        {"doctor_id": d, "weekday": w, "start_time": DEFAULT_START, "end_time": DEFAULT_END,
+         "slot_minutes": DEFAULT_SLOT_MINUTES}
+        for d in doctor_ids for w in WORKING_WEEKDAYS
+    ))
+    insert_rows(PatientProfile, (
+        {"user_id": p, "full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+         "age": rng.randint(1, 95), "contact": str(rng.randint(6000000000, 9999999999)),
+         "address": f"{rng.randint(1, 999)} {rng.choice(LAST_NAMES)} Street"}
+        for p in patient_ids
+    ))
+
+    # Doctor d's n-th appointment gets the n-th slot of its calendar, working
+    # days only, so booked slots never collide and every one is a slot the
+    # doctor offers. About 80% of the history is in the past.
+    slots_per_doctor = -(-appointments // doctors)
+    past_weeks = int(slots_per_doctor / SLOTS_PER_DAY / len(WORKING_WEEKDAYS) * 0.8)
+    first_monday = today - timedelta(days=today.weekday(), weeks=past_weeks)
+    treated = []
+
+    def appointment_rows():
+        for i in range(appointments):
+            doctor_id = doctor_ids[i % doctors]
+            slot = i // doctors
+            week, weekday = divmod(slot // SLOTS_PER_DAY, len(WORKING_WEEKDAYS))
+            day = first_monday + timedelta(weeks=week, days=WORKING_WEEKDAYS[weekday])
+            minutes = DEFAULT_START.hour * 60 + (slot % SLOTS_PER_DAY) * DEFAULT_SLOT_MINUTES
+            roll = rng.random()
+            if day < today:
+                status = "Completed" if roll < 0.8 else "Cancelled"
+            else:
+                status = "Booked" if roll < 0.9 else "Cancelled"
+            if status == "Completed":
+                treated.append(i + 1)
+            yield {
+                "id": i + 1,
+                "patient_id": rng.choice(patient_ids),
+                "doctor_id": doctor_id,
+                "department_id": doctor_dept[doctor_id],
+                "date": day,
+                "time": Time(minutes // 60, minutes % 60),
+                "status": status,
+            }
+
+    insert_rows(Appointment, appointment_rows())
+    insert_rows(Treatment, (
+        {"appointment_id": a, "diagnosis": rng.choice(DIAGNOSES), "prescription": rng.choice(PRESCRIPTIONS),
+         "notes": "Follow up in two weeks" if rng.random() < 0.3 else ""}
+        for a in treated
+    ))
+
+    # bulk inserts bypass the per-write counter and rollup updates
+    recompute_stats()
+    rebuild_rollups()
+    db.session.commit()
+    return {"doctors": doctors, "patients": patients, "appointments": appointments, "treatments": len(treated)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--doctors", type=int)
+    parser.add_argument("--patients", type=int)
+    parser.add_argument("--appointments", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key):
+            sizes[key] = getattr(args, key)
+
+    start = time.perf_counter()
+    with app.app_context():
+        counts = generate(seed=args.seed, **sizes)
+    print(f"Generated {counts} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Full-text search over patients, doctors and treatment notes (SQLite FTS5).
+
+One FTS5 table, search_index, holds a document per patient profile, doctor
+profile and treatment. The rowid encodes the source row (id * 4 + kind) so
+triggers can replace a document by primary key; triggers on the source
+tables keep it in sync with every write, bulk inserts included.
+
+Archived treatments (archive.py) are a source table of their own and keep
+the rowid their live document had.
+
+install_search_index() creates the table and triggers and fills it
+(migration 5); rebuild_search_index() refills it, e.g. after renaming a
+department, which is not tracked. On other databases search is unavailable.
+"""
+import re
+
+from sqlalchemy import text
+
+from models import db
+
+PATIENT, DOCTOR, TREATMENT = 1, 2, 3
+KINDS = {"patient": PATIENT, "doctor": DOCTOR, "treatment": TREATMENT}
+KIND_NAMES = {v: k for k, v in KINDS.items()}
+
+# longer queries are cut to this many terms
+MAX_TERMS = 8
+# bm25 weights for (title, body): a name or diagnosis match outranks a notes match
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+# Scoring every hit of a very common word ("street") costs hundreds of ms on
+# 200k patients and says little; past this many hits the caller may see,
+# results come unranked, in index order, which FTS5 streams cheaply.
+RANKED_MATCH_LIMIT = 20000
+
+# SELECTs producing (rowid, title, body, owner_id, doctor_id); {where} narrows them for triggers
+DOCUMENT_SQL = {
+    "patient_profiles": """
+        SELECT p.id * 4 + 1, COALESCE(p.full_name, ''),
+               COALESCE(u.username, '') || ' ' || COALESCE(p.contact, '') || ' ' || COALESCE(p.address, ''),
+               p.user_id, NULL
+        FROM patient_profiles p LEFT JOIN users u ON u.id = p.user_id
+        WHERE p.user_id IS NOT NULL {where}
+    """,
+    "doctor_profiles": """
+        SELECT d.id * 4 + 2, COALESCE(u.username, ''),
+               COALESCE(dep.name, '') || ' ' || COALESCE(d.experience, ''),
+               NULL, d.user_id
+        FROM doctor_profiles d
+        LEFT JOIN users u ON u.id = d.user_id
+        LEFT JOIN departments dep ON dep.id = d.specialization_id
+        WHERE d.user_id IS NOT NULL {where}
+    """,
+    "treatments": """
+        SELECT t.id * 4 + 3, COALESCE(t.diagnosis, ''),
+               COALESCE(t.prescription, '') || ' ' || COALESCE(t.notes, ''),
+               a.patient_id, a.doctor_id
+        FROM treatments t LEFT JOIN appointments a ON a.id = t.appointment_id
+        WHERE 1 = 1 {where}
+    """,
+    # archived treatments keep their id, so their documents keep their rowid
+    "treatments_archive": """
+        SELECT t.id * 4 + 3, COALESCE(t.diagnosis, ''),
+               COALESCE(t.prescription, '') || ' ' || COALESCE(t.notes, ''),
+               a.patient_id, a.doctor_id
+        FROM treatments_archive t LEFT JOIN appointments_archive a ON a.id = t.appointment_id
+        WHERE 1 = 1 {where}
+    """,
+}
+# (table alias, kind) for the rowid of each source table
+SOURCE_KEYS = {
+    "patient_profiles": ("p", PATIENT), "doctor_profiles": ("d", DOCTOR),
+    "treatments": ("t", TREATMENT), "treatments_archive": ("t", TREATMENT),
+}
+
+CREATE_INDEX_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, owner_id UNINDEXED, doctor_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+"""
+
+
+def trigger_sql():
+    statements = []
+    for table, (alias, kind) in SOURCE_KEYS.items():
+        insert = "INSERT INTO search_index (rowid, title, body, owner_id, doctor_id) " + \
+            DOCUMENT_SQL[table].format(where=f"AND {alias}.id = NEW.id") + ";"
+        delete = f"DELETE FROM search_index WHERE rowid = OLD.id * 4 + {kind};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        ]
+    # usernames appear in patient and doctor documents
+    refresh = []
+    for table, alias, kind in (("patient_profiles", "p", PATIENT), ("doctor_profiles", "d", DOCTOR)):
+        refresh.append(
+            f"DELETE FROM search_index WHERE rowid IN (SELECT id * 4 + {kind} FROM {table} WHERE user_id = NEW.id);"
+        )
+        refresh.append(
+            "INSERT INTO search_index (rowid, title, body, owner_id, doctor_id) "
+            + DOCUMENT_SQL[table].format(where=f"AND {alias}.user_id = NEW.id") + ";"
+        )
+    statements.append(
+        "CREATE TRIGGER IF NOT EXISTS search_users_au AFTER UPDATE OF username ON users BEGIN "
+        + " ".join(refresh) + " END"
+    )
+    return statements
+
+
+def search_available():
+    return db.engine.dialect.name == "sqlite"
+
+
+def rebuild_search_index():
+    """Refill search_index from the source tables; the caller commits."""
+    db.session.execute(text("DELETE FROM search_index"))
+    for sql in DOCUMENT_SQL.values():
+        db.session.execute(text(
+            "INSERT INTO search_index (rowid, title, body, owner_id, doctor_id) " + sql.format(where="")
+        ))
+
+
+def install_search_triggers():
+    """Create the sync triggers that are missing, e.g. for a new source table; the caller commits."""
+    if not search_available():
+        return
+    for statement in trigger_sql():
+        db.session.execute(text(statement))
+
+
+def install_search_index():
+    """Create the FTS table and sync triggers, then fill it (used by migrations.py); the caller commits."""
+    if not search_available():
+        return
+    db.session.execute(text(CREATE_INDEX_SQL))
+    install_search_triggers()
+    rebuild_search_index()
+
+
+def match_query(q):
+    """Turn free text into an FTS5 query: every word must match as a prefix ("anna mul" finds Anna Müller)."""
+    terms = re.findall(r"\w+", q or "")[:MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def scope_sql(role, user_id):
+    """
+    SQL condition for the documents a role may see: admins everything;
+    doctors the doctor directory, their own patients and the treatments
+    they recorded; patients the directory and their own records.
+    """
+    if role == "admin":
+        return "1 = 1", {}
+    if role == "doctor":
+        return (
+            "(kind = 2 OR (kind = 3 AND doctor_id = :me) OR (kind = 1 AND EXISTS ("
+            "SELECT 1 FROM appointments a WHERE a.patient_id = owner_id AND a.doctor_id = :me) OR EXISTS ("
+            "SELECT 1 FROM appointments_archive a WHERE a.patient_id = owner_id AND a.doctor_id = :me)))"
+        ), {"me": user_id}
+    if role == "patient":
+        return "(kind = 2 OR (kind IN (1, 3) AND owner_id = :me))", {"me": user_id}
+    return "1 = 0", {}
+
+
+def search_documents(q, role, user_id, kinds=None, limit=50, after=None):
+    """
+    Best matches first (see RANKED_MATCH_LIMIT) as a list of dicts;
+    after=(score, doc_id) of the last row of the previous page, and every
+    row carries both for the next cursor. Returns [] when q has no
+    searchable words.
+    """
+    match = match_query(q)
+    if not match:
+        return []
+    scope, params = scope_sql(role, user_id)
+    params.update(match=match)
+    conditions = [scope]
+    if kinds:
+        conditions.append("kind IN (" + ", ".join(str(KINDS[k]) for k in kinds) + ")")
+
+    # only the caller's own hits count towards the limit, and never the
+    # cursor, so every page of one search ranks the same way
+    hits = db.session.execute(text(f"""
+        SELECT count(*) FROM (
+            SELECT 1 FROM (
+                SELECT rowid % 4 AS kind, owner_id, doctor_id
+                FROM search_index WHERE search_index MATCH :match
+            )
+            WHERE {" AND ".join(conditions)}
+            LIMIT :cap
+        )
+    """), {**params, "cap": RANKED_MATCH_LIMIT + 1}).scalar()
+    score = f"bm25(search_index, {TITLE_WEIGHT}, {BODY_WEIGHT})" if hits <= RANKED_MATCH_LIMIT else "0.0"
+
+    params.update(limit=limit)
+    if after:
+        conditions.append("(score, doc_id) > (:after_score, :after_id)")
+        params.update(after_score=after[0], after_id=after[1])
+
+    rows = db.session.execute(text(f"""
+        SELECT * FROM (
+            SELECT rowid AS doc_id, rowid % 4 AS kind, title, body, owner_id, doctor_id,
+                   {score} AS score
+            FROM search_index WHERE search_index MATCH :match
+        )
+        WHERE {" AND ".join(conditions)}
+        ORDER BY score, doc_id
+        LIMIT :limit
+    """), params).mappings().all()
+
+    results = []
+    for r in rows:
+        kind = r["kind"]
+        results.append({
+            "type": KIND_NAMES[kind],
+            # patients and doctors are identified by user id, treatments by treatment id
+            "id": {PATIENT: r["owner_id"], DOCTOR: r["doctor_id"], TREATMENT: r["doc_id"] // 4}[kind],
+            "title": r["title"],
+            "body": r["body"].strip(),
+            "patient_id": r["owner_id"],
+            "doctor_id": r["doctor_id"],
+            "score": r["score"],
+            "doc_id": r["doc_id"],
+        })
+    return results
@@ -0,0 +1,482 @@
+"""
+Bulk import of departments, doctors, patients, appointments and treatments
+from a legacy system (flask import, see app.py).
+
+Each input is a .csv file with a header row or a .jsonl file with one
+object per line; both are streamed. Columns:
+
+    departments   id, name, description
+    doctors       id, username, password | password_hash, department_id | department,
+                  experience, approve, blocked
+    patients      id, username, password | password_hash, full_name, age, contact,
+                  address, blocked
+    appointments  id, patient_id, doctor_id, date (YYYY-MM-DD), time (HH:MM or 04:30 PM),
+                  status, remarks
+    treatments    id, appointment_id, diagnosis, prescription, notes
+
+Ids in the files are the legacy system's own: department_id, patient_id,
+doctor_id and appointment_id refer to records of the other files (or of an
+earlier run, through --id-map), and the importer maps them to the new
+primary keys. --id-map is a JSONL file the mapping is read from and
+appended to after every committed batch, so a migration can run file by
+file, and running a file again skips what it already imported. Doctors and
+patients whose username exists already are mapped to that account.
+
+Valid records are inserted batch_size at a time, one executemany
+INSERT ... RETURNING per table and batch, in a savepoint. A batch that hits
+a constraint (e.g. a slot booked twice) is retried row by row, so a bad row
+only rejects itself. Invalid and rejected rows are skipped and listed in
+the report. Plain-text passwords are hashed in a process pool, one batch
+ahead of the inserts.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import false, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Department, DoctorProfile, PatientProfile, Appointment, Treatment, HospitalStat
+from revocation import bump_revocation_version
+from stats import recompute_stats
+from rollups import rebuild_rollups
+
+KINDS = ("departments", "doctors", "patients", "appointments", "treatments")
+BATCH_SIZE = 1000
+# the report keeps the first errors only; the counts cover all of them
+MAX_REPORTED_ERRORS = 1000
+
+STATUSES = {"booked": "Booked", "completed": "Completed", "cancelled": "Cancelled"}
+TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p")
+TRUE_WORDS = {"1", "true", "yes", "y"}
+FALSE_WORDS = {"0", "false", "no", "n"}
+
+
+def hash_password(password):
+    # module level so the process pool can pickle it
+    return generate_password_hash(password)
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def value(record, key):
+    """The field as a stripped string, None when missing or blank."""
+    v = record.get(key)
+    if v is None:
+        return None
+    v = str(v).strip()
+    return v or None
+
+
+def text_field(record, key, max_length, required=False):
+    v = value(record, key)
+    if v is None and required:
+        raise ValueError(f"{key} is required")
+    if v is not None and len(v) > max_length:
+        raise ValueError(f"{key} is longer than {max_length} characters")
+    return v
+
+
+def bool_field(record, key, default):
+    v = value(record, key)
+    if v is None:
+        return default
+    if v.lower() in TRUE_WORDS:
+        return True
+    if v.lower() in FALSE_WORDS:
+        return False
+    raise ValueError(f"{key} must be true or false")
+
+
+def int_field(record, key, low, high):
+    v = value(record, key)
+    if v is None:
+        return None
+    try:
+        n = int(v)
+    except ValueError:
+        raise ValueError(f"{key} must be a whole number")
+    if not low <= n <= high:
+        raise ValueError(f"{key} must be between {low} and {high}")
+    return n
+
+
+def date_field(record, key):
+    v = value(record, key)
+    if v is None:
+        raise ValueError(f"{key} is required")
+    try:
+        return datetime.strptime(v, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{key} must be YYYY-MM-DD")
+
+
+def time_field(record, key):
+    v = value(record, key)
+    if v is None:
+        raise ValueError(f"{key} is required")
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(v.upper(), fmt).time()
+        except ValueError:
+            continue
+    raise ValueError(f"{key} must be HH:MM or hh:MM AM/PM")
+
+
+class Importer:
+    def __init__(self, id_map=None, batch_size=BATCH_SIZE, workers=None, default_password=None, dry_run=False):
+        self.id_map = id_map
+        self.batch_size = batch_size
+        self.workers = workers
+        self.dry_run = dry_run
+        self.default_hash = generate_password_hash(default_password) if default_password else None
+        self.pool = None
+        self.ids = {kind: {} for kind in KINDS}
+        self.counts = {kind: {"inserted": 0, "existing": 0, "skipped": 0, "invalid": 0} for kind in KINDS}
+        self.errors = []
+        if id_map and os.path.exists(id_map):
+            with open(id_map, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.ids[entry["kind"]].update(entry["ids"])
+
+    # ---------- plumbing ----------
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+    def invalid(self, kind, path, line, message):
+        self.counts[kind]["invalid"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"kind": kind, "file": os.path.basename(path), "line": line, "message": message})
+
+    def read(self, kind, path):
+        """(line number, record) for each record of a .csv or .jsonl file; unreadable lines go to the report."""
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            if path.lower().endswith((".jsonl", ".ndjson")):
+                for line_no, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        self.invalid(kind, path, line_no, f"not valid JSON: {e}")
+                        continue
+                    if not isinstance(record, dict):
+                        self.invalid(kind, path, line_no, "not a JSON object")
+                        continue
+                    yield line_no, record
+            else:
+                # header is line 1
+                for line_no, record in enumerate(csv.DictReader(f), start=2):
+                    yield line_no, record
+
+    def commit(self, kind, mapped):
+        """Commit a batch and append its new external -> local ids to the id map file."""
+        if self.dry_run:
+            return
+        db.session.commit()
+        if self.id_map and mapped:
+            with open(self.id_map, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"kind": kind, "ids": mapped}) + "\n")
+
+    def insert_batch(self, kind, path, model, items, dependents=None):
+        """
+        Insert items [(external id, line, row, extra)] into model and map
+        their ids; dependents([(new id, extra)]) adds rows that hang off them
+        (profiles) in the same savepoint. Returns {external id: new id}.
+        """
+        def run(batch):
+            with db.session.begin_nested():
+                new_ids = db.session.scalars(
+                    insert(model).returning(model.id, sort_by_parameter_order=True),
+                    [row for _, _, row, _ in batch],
+                ).all()
+                if dependents:
+                    dependents([(new_id, extra) for new_id, (_, _, _, extra) in zip(new_ids, batch)])
+            return new_ids
+
+        try:
+            new_ids = run(items)
+        except IntegrityError:
+            # find the offending rows; the rest still go in
+            new_ids, kept = [], []
+            for item in items:
+                try:
+                    new_ids += run([item])
+                    kept.append(item)
+                except IntegrityError as e:
+                    self.invalid(kind, path, item[1], f"rejected by the database: {e.orig}")
+            items = kept
+
+        mapped = {ext: new_id for new_id, (ext, _, _, _) in zip(new_ids, items)}
+        self.ids[kind].update(mapped)
+        self.counts[kind]["inserted"] += len(items)
+        return mapped
+
+    def valid_records(self, kind, path, parse):
+        """
+        Items for insert_batch from parse(record) -> (external id, row, extra),
+        which raises ValueError for invalid records and returns None for ones
+        imported before.
+        """
+        for line, record in self.read(kind, path):
+            try:
+                parsed = parse(record)
+            except ValueError as e:
+                self.invalid(kind, path, line, str(e))
+                continue
+            if parsed is None:
+                self.counts[kind]["skipped"] += 1
+                continue
+            ext, row, extra = parsed
+            yield ext, line, row, extra
+
+    def external_id(self, kind, record, fallback=None):
+        ext = value(record, "id") or (value(record, fallback) if fallback else None)
+        if ext is None:
+            raise ValueError("id is required")
+        return None if ext in self.ids[kind] else ext
+
+    def mapped(self, kind, record, key):
+        ext = value(record, key)
+        if ext is None:
+            raise ValueError(f"{key} is required")
+        if ext not in self.ids[kind]:
+            raise ValueError(f"{key} {ext} is not among the imported {kind}")
+        return self.ids[kind][ext]
+
+    # ---------- departments ----------
+
+    def import_departments(self, path):
+        seen = set()
+
+        def parse(record):
+            ext = self.external_id("departments", record, fallback="name")
+            if ext is None:
+                return None
+            name = text_field(record, "name", 100, required=True)
+            if name.lower() in seen:
+                raise ValueError(f"department {name} appears twice")
+            seen.add(name.lower())
+            return ext, {"name": name, "description": text_field(record, "description", 200)}, None
+
+        for batch in batched(self.valid_records("departments", path, parse), self.batch_size):
+            existing = dict(
+                db.session.query(func.lower(Department.name), Department.id)
+                .filter(func.lower(Department.name).in_([row["name"].lower() for _, _, row, _ in batch]))
+            )
+            fresh = []
+            mapped = {}
+            for item in batch:
+                ext, _, row, _ = item
+                if row["name"].lower() in existing:
+                    mapped[ext] = existing[row["name"].lower()]
+                    self.counts["departments"]["existing"] += 1
+                else:
+                    fresh.append(item)
+            self.ids["departments"].update(mapped)
+            if fresh:
+                mapped.update(self.insert_batch("departments", path, Department, fresh))
+            self.commit("departments", mapped)
+
+    # ---------- doctors and patients ----------
+
+    def hash_passwords(self, passwords):
+        """Start hashing in the pool; returns an iterator of hashes in order."""
+        if not passwords:
+            return iter(())
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        workers = self.workers or os.cpu_count() or 1
+        return self.pool.map(hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4)))
+
+    def password_of(self, record):
+        """(stored hash or None, plain password or None) for a user record."""
+        stored = value(record, "password_hash")
+        if stored:
+            return stored, None
+        plain = value(record, "password")
+        if plain:
+            return None, plain
+        if self.default_hash:
+            return self.default_hash, None
+        raise ValueError("password or password_hash is required (or pass --default-password)")
+
+    def import_users(self, kind, role, path, parse_profile, profile_model):
+        def parse(record):
+            ext = self.external_id(kind, record, fallback="username")
+            if ext is None:
+                return None
+            username = text_field(record, "username", 120, required=True)
+            stored, plain = self.password_of(record)
+            row = {
+                "username": username,
+                "password": stored,
+                "role": role,
+                "approve": bool_field(record, "approve", True),
+                "blocked": bool_field(record, "blocked", False),
+            }
+            return ext, row, {"plain": plain, "profile": parse_profile(record)}
+
+        def add_profiles(pairs):
+            db.session.execute(insert(profile_model), [{"user_id": user_id, **extra["profile"]} for user_id, extra in pairs])
+
+        pending = None
+        for batch in batched(self.valid_records(kind, path, parse), self.batch_size):
+            hashes = self.hash_passwords([extra["plain"] for _, _, _, extra in batch if extra["plain"]])
+            # the pool works on this batch while the previous one is inserted
+            if pending:
+                self.insert_users(kind, role, path, *pending, add_profiles)
+            pending = (batch, hashes)
+        if pending:
+            self.insert_users(kind, role, path, *pending, add_profiles)
+
+    def insert_users(self, kind, role, path, batch, hashes, add_profiles):
+        for _, _, row, extra in batch:
+            if extra["plain"]:
+                row["password"] = next(hashes)
+
+        existing = {
+            username: (user_id, user_role)
+            for username, user_id, user_role in db.session.query(User.username, User.id, User.role)
+            .filter(User.username.in_([row["username"] for _, _, row, _ in batch]))
+        }
+        fresh = []
+        mapped = {}
+        for item in batch:
+            ext, line, row, _ = item
+            if row["username"] not in existing:
+                fresh.append(item)
+                continue
+            user_id, user_role = existing[row["username"]]
+            if user_role == role:
+                mapped[ext] = user_id
+                self.counts[kind]["existing"] += 1
+            else:
+                self.invalid(kind, path, line, f"username {row['username']} belongs to a {user_role}")
+        self.ids[kind].update(mapped)
+        if fresh:
+            mapped.update(self.insert_batch(kind, path, User, fresh, add_profiles))
+        self.commit(kind, mapped)
+
+    def import_doctors(self, path):
+        departments_by_name = {name.lower(): dept_id for name, dept_id in db.session.query(Department.name, Department.id)}
+
+        def parse_profile(record):
+            if value(record, "department_id"):
+                specialization_id = self.mapped("departments", record, "department_id")
+            else:
+                name = value(record, "department")
+                if not name:
+                    raise ValueError("department_id or department is required")
+                if name.lower() not in departments_by_name:
+                    raise ValueError(f"unknown department {name}")
+                specialization_id = departments_by_name[name.lower()]
+            return {"specialization_id": specialization_id, "experience": text_field(record, "experience", 100)}
+
+        self.import_users("doctors", "doctor", path, parse_profile, DoctorProfile)
+
+    def import_patients(self, path):
+        def parse_profile(record):
+            return {
+                "full_name": text_field(record, "full_name", 100),
+                "age": int_field(record, "age", 0, 150),
+                "contact": text_field(record, "contact", 15),
+                "address": text_field(record, "address", 200),
+            }
+
+        self.import_users("patients", "patient", path, parse_profile, PatientProfile)
+
+    # ---------- appointments and treatments ----------
+
+    def import_appointments(self, path):
+        doctor_departments = dict(db.session.query(DoctorProfile.user_id, DoctorProfile.specialization_id))
+
+        def parse(record):
+            ext = self.external_id("appointments", record)
+            if ext is None:
+                return None
+            status = value(record, "status") or "Booked"
+            if status.lower() not in STATUSES:
+                raise ValueError(f"status must be one of {', '.join(STATUSES.values())}")
+            doctor_id = self.mapped("doctors", record, "doctor_id")
+            return ext, {
+                "patient_id": self.mapped("patients", record, "patient_id"),
+                "doctor_id": doctor_id,
+                "department_id": doctor_departments.get(doctor_id),
+                "date": date_field(record, "date"),
+                "time": time_field(record, "time"),
+                "status": STATUSES[status.lower()],
+                "remarks": text_field(record, "remarks", 200),
+            }, None
+
+        for batch in batched(self.valid_records("appointments", path, parse), self.batch_size):
+            self.commit("appointments", self.insert_batch("appointments", path, Appointment, batch))
+
+    def import_treatments(self, path):
+        def parse(record):
+            ext = self.external_id("treatments", record, fallback="appointment_id")
+            if ext is None:
+                return None
+            return ext, {
+                "appointment_id": self.mapped("appointments", record, "appointment_id"),
+                "diagnosis": value(record, "diagnosis"),
+                "prescription": value(record, "prescription"),
+                "notes": value(record, "notes"),
+            }, None
+
+        for batch in batched(self.valid_records("treatments", path, parse), self.batch_size):
+            self.commit("treatments", self.insert_batch("treatments", path, Treatment, batch))
+
+    # ---------- driver ----------
+
+    def run(self, files):
+        """Import {kind: path} in dependency order; returns the report. Dry runs roll everything back."""
+        try:
+            if self.dry_run:
+                # pysqlite only sends BEGIN before a write, so a leading SAVEPOINT
+                # would open the transaction itself and its RELEASE would commit;
+                # a no-op UPDATE opens it first, and the rollback below undoes all
+                db.session.execute(update(HospitalStat).where(false()).values(value=HospitalStat.value))
+            for kind in KINDS:
+                if files.get(kind):
+                    getattr(self, f"import_{kind}")(files[kind])
+            if self.dry_run:
+                db.session.rollback()
+            else:
+                # bulk inserts skip the per-write counters and rollups; blocked/unapproved imports must reach the token check
+                recompute_stats()
+                rebuild_rollups()
+                bump_revocation_version()
+                db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            self.close()
+        return self.report()
+
+    def report(self):
+        invalid = sum(c["invalid"] for c in self.counts.values())
+        return {
+            "dry_run": self.dry_run,
+            "counts": {kind: c for kind, c in self.counts.items() if any(c.values())},
+            "errors": self.errors,
+            "errors_not_listed": invalid - len(self.errors),
+        }
@@ -0,0 +1,141 @@
+"""
+Opt-in per-route metrics: SQL statement count, DB time, JSON serialisation
+time and total latency.
+
+Every response gets a Server-Timing header, and totals per route are
+exposed at /metrics in the Prometheus text format. Enabled from app.py when
+METRICS_ENABLED is set (HMS_METRICS=1).
+"""
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RouteStats:
+    """Running totals for one (method, route, status)."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.total_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = defaultdict(RouteStats)
+
+    def record(self, key, statements, db_seconds, serialize_seconds, total_seconds):
+        with self.lock:
+            stats = self.routes[key]
+            stats.requests += 1
+            stats.statements += statements
+            stats.db_seconds += db_seconds
+            stats.serialize_seconds += serialize_seconds
+            stats.total_seconds += total_seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total_seconds <= bound:
+                    stats.buckets[i] += 1
+
+    def render(self):
+        """
+        Prometheus text exposition of everything recorded so far: one block
+        per metric family, its # TYPE line followed by all of its samples.
+        """
+        with self.lock:
+            routes = [
+                (f'method="{method}",route="{route}",status="{status}"', stats)
+                for (method, route, status), stats in sorted(self.routes.items())
+            ]
+            lines = ["# TYPE hms_requests_total counter"]
+            lines += [f"hms_requests_total{{{labels}}} {stats.requests}" for labels, stats in routes]
+            lines.append("# TYPE hms_db_statements_total counter")
+            lines += [f"hms_db_statements_total{{{labels}}} {stats.statements}" for labels, stats in routes]
+            lines.append("# TYPE hms_db_seconds_total counter")
+            lines += [f"hms_db_seconds_total{{{labels}}} {stats.db_seconds:.6f}" for labels, stats in routes]
+            lines.append("# TYPE hms_serialize_seconds_total counter")
+            lines += [f"hms_serialize_seconds_total{{{labels}}} {stats.serialize_seconds:.6f}" for labels, stats in routes]
+            lines.append("# TYPE hms_request_duration_seconds histogram")
+            for labels, stats in routes:
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    lines.append(f'hms_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'hms_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.requests}')
+                lines.append(f"hms_request_duration_seconds_sum{{{labels}}} {stats.total_seconds:.6f}")
+                lines.append(f"hms_request_duration_seconds_count{{{labels}}} {stats.requests}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() that adds the time it spends to the current request's tally."""
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            if has_request_context() and "metrics_start" in g:
+                g.metrics_serialize += time.perf_counter() - start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "metrics_start" in g:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is not None and has_request_context() and "metrics_start" in g:
+        g.metrics_statements += 1
+        g.metrics_db += time.perf_counter() - start
+
+
+def init_metrics(app):
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_db = 0.0
+        g.metrics_serialize = 0.0
+
+    @app.after_request
+    def finish_request_metrics(response):
+        if "metrics_start" not in g or request.endpoint == "prometheus_metrics":
+            return response
+        total = time.perf_counter() - g.metrics_start
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.record(
+            (request.method, route, response.status_code),
+            g.metrics_statements, g.metrics_db, g.metrics_serialize, total,
+        )
+        response.headers["Server-Timing"] = ", ".join([
+            f'db;dur={g.metrics_db * 1000:.1f};desc="{g.metrics_statements} queries"',
+            f"serialize;dur={g.metrics_serialize * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+        # the Vue dev server is a different origin; let its devtools show the timings
+        response.headers["Timing-Allow-Origin"] = "*"
+        return response
+
+    @app.route("/metrics", endpoint="prometheus_metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
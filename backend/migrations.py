@@ -0,0 +1,179 @@
+"""
+Versioned schema upgrades for databases created before a models.py change.
+
+db.create_all() only creates missing tables; it never adds indexes or
+columns to a table that already exists. Each entry in MIGRATIONS brings an
+existing database up by one version and must be safe to run against a
+database that already has the change (e.g. one just built by create_all).
+"""
+from sqlalchemy import func, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from models import db, Appointment, Treatment, AppointmentArchive, TreatmentArchive, PatientProfile, SchemaVersion
+from stats import recompute_stats
+from availability import migrate_profile_blobs
+from fulltext import install_search_index, install_search_triggers
+from reports import import_legacy_reports
+from conditional import seed_table_versions
+from rollups import rebuild_rollups
+
+
+def create_indexes(*tables):
+    """Create every index declared on the given tables that is not there yet."""
+    for table in tables:
+        for index in table.indexes:
+            index.create(db.session.connection(), checkfirst=True)
+
+
+def add_columns(table, *names):
+    """ALTER TABLE ... ADD COLUMN for declared (nullable) columns the table does not have yet."""
+    existing = {c["name"] for c in inspect(db.engine).get_columns(table.name)}
+    for name in names:
+        if name not in existing:
+            column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+
+
+def rebuild_with_autoincrement(model, archive_model):
+    """
+    SQLite hands the highest rowid out again once that row is deleted, and
+    archiving deletes rows all the time; a reused appointment id collides
+    with the archived one in search documents, outbox keys and history.
+    AUTOINCREMENT never reuses an id, but SQLite cannot add it to a table,
+    so copy the rows into a table created from the model, swap it in and
+    start its sequence past every id in both tiers. The caller recreates
+    indexes and triggers.
+    """
+    table = model.__table__
+    sql = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+    ).scalar()
+    if "AUTOINCREMENT" in sql.upper():
+        return
+    new_name = f"{table.name}__rebuild"
+    create = str(CreateTable(table).compile(db.engine)).replace(
+        f"CREATE TABLE {table.name} (", f"CREATE TABLE {new_name} (", 1
+    )
+    existing = {c["name"] for c in inspect(db.engine).get_columns(table.name)}
+    columns = ", ".join(c.name for c in table.columns if c.name in existing)
+
+    db.session.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+    db.session.execute(text(create))
+    db.session.execute(text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}"))
+    db.session.execute(text(f"DROP TABLE {table.name}"))
+    # the legacy rename leaves other tables' triggers alone; they name the table, not the copy
+    db.session.execute(text("PRAGMA legacy_alter_table = ON"))
+    db.session.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    db.session.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+    high = max(
+        db.session.query(func.max(model.id)).scalar() or 0,
+        db.session.query(func.max(archive_model.id)).scalar() or 0,
+    )
+    db.session.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+    db.session.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": high})
+
+
+def upgrade_1_appointment_indexes():
+    # The partial unique index can't be built while a slot is double-booked
+    duplicates = (
+        db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time, func.count(Appointment.id))
+        .filter(Appointment.status == "Booked", Appointment.doctor_id.isnot(None))
+        .group_by(Appointment.doctor_id, Appointment.date, Appointment.time)
+        .having(func.count(Appointment.id) > 1)
+        .all()
+    )
+    if duplicates:
+        slots = ", ".join(f"doctor {d} on {day} at {t}" for d, day, t, _ in duplicates)
+        raise RuntimeError(f"Cancel the duplicate bookings first: {slots}")
+
+    create_indexes(Appointment.__table__, Treatment.__table__)
+
+
+def upgrade_2_appointment_listing_index():
+    create_indexes(Appointment.__table__)
+
+
+def upgrade_3_seed_hospital_stats():
+    recompute_stats()
+
+
+def upgrade_4_availability_rows():
+    # the tables come from create_all(); move the old JSON blobs into them
+    migrate_profile_blobs()
+
+
+def upgrade_5_search_index():
+    install_search_index()
+
+
+def upgrade_6_reminder_marker():
+    add_columns(Appointment.__table__, "reminder_sent_at")
+
+
+def upgrade_7_report_catalog():
+    # report_files comes from create_all(); catalog the files already on disk
+    import_legacy_reports()
+
+
+def upgrade_8_table_versions():
+    seed_table_versions()
+
+
+def upgrade_9_archive_search_triggers():
+    # the archive tables come from create_all(); index archived treatments like live ones
+    install_search_triggers()
+
+
+def upgrade_10_appointment_rollups():
+    # appointment_rollups comes from create_all(); fill it and give it a version stamp
+    seed_table_versions()
+    rebuild_rollups()
+
+
+def upgrade_11_patient_profile_index():
+    create_indexes(PatientProfile.__table__)
+
+
+def upgrade_12_autoincrement_ids():
+    if db.engine.dialect.name != "sqlite":
+        return  # sequences never hand an id out twice
+    rebuild_with_autoincrement(Appointment, AppointmentArchive)
+    rebuild_with_autoincrement(Treatment, TreatmentArchive)
+    create_indexes(Appointment.__table__, Treatment.__table__)
+    install_search_triggers()
+
+
+# (version, description, upgrade function) — append only, never renumber
+MIGRATIONS = [
+    (1, "appointment and treatment indexes", upgrade_1_appointment_indexes),
+    (2, "appointment date/time listing index", upgrade_2_appointment_listing_index),
+    (3, "seed dashboard counters", upgrade_3_seed_hospital_stats),
+    (4, "doctor availability as templates and exceptions", upgrade_4_availability_rows),
+    (5, "full-text search index and triggers", upgrade_5_search_index),
+    (6, "appointment reminder marker", upgrade_6_reminder_marker),
+    (7, "report file catalog", upgrade_7_report_catalog),
+    (8, "table version stamps for ETags", upgrade_8_table_versions),
+    (9, "appointment archive tier", upgrade_9_archive_search_triggers),
+    (10, "daily appointment rollups", upgrade_10_appointment_rollups),
+    (11, "patient profile user index", upgrade_11_patient_profile_index),
+    (12, "appointment and treatment ids are never reused", upgrade_12_autoincrement_ids),
+]
+
+
+def current_version():
+    return db.session.query(func.max(SchemaVersion.version)).scalar() or 0
+
+
+def upgrade():
+    """Apply all pending migrations in order. Returns the list of versions applied."""
+    db.create_all()
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version <= current_version():
+            continue
+        fn()
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+        applied.append(version)
+    return applied
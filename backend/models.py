@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
@@ -57,6 +59,56 @@ class DoctorProfile(db.Model):
             "availability": self.availability,
         }
 
+# ===========================
+# Doctor Availability (see availability.py)
+# Weekly templates give the usual hours; exceptions override a single date.
+# ===========================
+class AvailabilityTemplate(db.Model):
+    __tablename__ = 'availability_templates'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday ... 6 = Sunday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    slot_minutes = db.Column(db.Integer, nullable=False, default=30)
+
+    __table_args__ = (
+        db.Index('ix_availability_templates_doctor_weekday', 'doctor_id', 'weekday'),
+    )
+
+    def as_dict(self):
+        return {
+            "weekday": self.weekday,
+            "start": self.start_time.strftime("%H:%M"),
+            "end": self.end_time.strftime("%H:%M"),
+            "slot_minutes": self.slot_minutes,
+        }
+
+
+class AvailabilityException(db.Model):
+    __tablename__ = 'availability_exceptions'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    available = db.Column(db.Boolean, nullable=False, default=True)  # False = day off
+    start_time = db.Column(db.Time)
+    end_time = db.Column(db.Time)
+    slot_minutes = db.Column(db.Integer, default=30)
+
+    __table_args__ = (
+        db.Index('ix_availability_exceptions_doctor_date', 'doctor_id', 'date'),
+    )
+
+    def as_dict(self):
+        return {
+            "date": self.date.strftime("%Y-%m-%d"),
+            "available": self.available,
+            "start": self.start_time.strftime("%H:%M") if self.start_time else None,
+            "end": self.end_time.strftime("%H:%M") if self.end_time else None,
+            "slot_minutes": self.slot_minutes,
+        }
+
+
 # ===========================
 # Patient Profile
 # ===========================
@@ -69,6 +121,11 @@ class PatientProfile(db.Model):
     contact = db.Column(db.String(15))
     address = db.Column(db.String(200))
 
+    __table_args__ = (
+        # admin patient lists join profiles onto users a page at a time
+        db.Index('ix_patient_profiles_user_id', 'user_id'),
+    )
+
     user = db.relationship('User', foreign_keys=[user_id])
 
     def as_dict(self):
@@ -97,6 +154,28 @@ class Appointment(db.Model):
     time = db.Column(db.Time)
     status = db.Column(db.String(20), default="Booked")  # Booked/Completed/Cancelled
     remarks = db.Column(db.String(200))
+    # set once the day-of reminder went out; cleared on reschedule
+    reminder_sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # booking / reschedule conflict checks and per-doctor listings
+        db.Index('ix_appointments_doctor_date_time', 'doctor_id', 'date', 'time'),
+        # patient appointment lists and history
+        db.Index('ix_appointments_patient_date', 'patient_id', 'date'),
+        # daily reminder and dashboard "upcoming" counts
+        db.Index('ix_appointments_date_status', 'date', 'status'),
+        # newest-first admin listing (keyset on date, time, id)
+        db.Index('ix_appointments_date_time', 'date', 'time'),
+        # a doctor slot can only be booked once; cancelled/completed rows don't count
+        db.Index(
+            'uq_appointments_booked_slot', 'doctor_id', 'date', 'time',
+            unique=True,
+            sqlite_where=db.text("status = 'Booked'"),
+            postgresql_where=db.text("status = 'Booked'"),
+        ),
+        # never hand out an archived appointment's id again (see migrations.rebuild_with_autoincrement)
+        {'sqlite_autoincrement': True},
+    )
 
     patient = db.relationship('User', foreign_keys=[patient_id], backref="patient_appointments")
     doctor = db.relationship('User', foreign_keys=[doctor_id], backref="doctor_appointments")
@@ -126,4 +205,146 @@ class Treatment(db.Model):
     prescription = db.Column(db.Text)
     notes = db.Column(db.Text)
 
+    __table_args__ = (
+        db.Index('ix_treatments_appointment_id', 'appointment_id'),
+        {'sqlite_autoincrement': True},
+    )
+
     appointment = db.relationship('Appointment')
+
+
+# ===========================
+# Archive tier (filled by tasks.archive_old_appointments, see archive.py)
+# ===========================
+class AppointmentArchive(db.Model):
+    """Completed/cancelled appointments past the archive horizon; same columns and ids as appointments."""
+    __tablename__ = 'appointments_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # no foreign keys: deleting a user does not touch appointments either
+    patient_id = db.Column(db.Integer)
+    doctor_id = db.Column(db.Integer)
+    department_id = db.Column(db.Integer)
+    date = db.Column(db.Date)
+    time = db.Column(db.Time)
+    status = db.Column(db.String(20))
+    remarks = db.Column(db.String(200))
+    reminder_sent_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # patient history and treatment exports
+        db.Index('ix_appointments_archive_patient_date', 'patient_id', 'date'),
+        # doctor exports and "is this my patient" checks
+        db.Index('ix_appointments_archive_doctor_date_time', 'doctor_id', 'date', 'time'),
+    )
+
+
+class TreatmentArchive(db.Model):
+    __tablename__ = 'treatments_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    appointment_id = db.Column(db.Integer)
+    diagnosis = db.Column(db.Text)
+    prescription = db.Column(db.Text)
+    notes = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_treatments_archive_appointment_id', 'appointment_id'),
+    )
+
+
+# ===========================
+# Daily appointment rollups behind /admin/analytics (see rollups.py)
+# ===========================
+class AppointmentRollup(db.Model):
+    __tablename__ = 'appointment_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    # 0 when the appointment has no doctor/department, so the key has no NULLs
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # per-doctor and per-department trends
+        db.Index('ix_appointment_rollups_doctor_day', 'doctor_id', 'day'),
+        db.Index('ix_appointment_rollups_department_day', 'department_id', 'day'),
+        # clustered on the key, so range scans read the counts without a second lookup
+        {'sqlite_with_rowid': False},
+    )
+
+
+# ===========================
+# Email Outbox (written with the change it reports, sent by tasks.drain_email_outbox)
+# ===========================
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    dedupe_key = db.Column(db.String(120), unique=True, nullable=False)  # e.g. appointment:12:booked
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="Pending")  # Pending/Sending/Sent/Failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)  # local time, like the tasks
+    claimed_by = db.Column(db.String(32))
+    last_error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
+# ===========================
+# Report Files (catalog of generated exports and reports, see reports.py)
+# ===========================
+class ReportFile(db.Model):
+    __tablename__ = 'report_files'
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, nullable=False)  # user id of the patient/doctor; no FK, a report outlives a deleted owner until purged
+    report_type = db.Column(db.String(30), nullable=False)  # treatments / appointments / monthly
+    period = db.Column(db.String(7))  # YYYY-MM for monthly reports, NULL for full-history exports
+    filename = db.Column(db.String(120), nullable=False)  # download name
+    path = db.Column(db.String(200), unique=True, nullable=False)  # relative to REPORTS_DIR, e.g. 3f/a0/3fa0..._x.csv
+    size = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)  # sha256 hex
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_report_files_owner_type_period', 'owner_id', 'report_type', 'period'),
+        db.Index('ix_report_files_expires_at', 'expires_at'),
+    )
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "owner_id": self.owner_id,
+            "type": self.report_type,
+            "period": self.period,
+            "filename": self.filename,
+            "size": self.size,
+            "checksum": self.checksum,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "expires_at": self.expires_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+# ===========================
+# Hospital Stats (counters behind /admin/dashboard, see stats.py)
+# ===========================
+class HospitalStat(db.Model):
+    __tablename__ = 'hospital_stats'
+    name = db.Column(db.String(50), primary_key=True)  # e.g. users:doctor, appointments:Booked
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+# ===========================
+# Schema Version (applied migrations, see migrations.py)
+# ===========================
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=db.func.now())
@@ -0,0 +1,195 @@
+"""
+Catalog of generated report files.
+
+Exports and monthly reports used to sit in one flat reports/ directory that
+every listing request scanned with os.listdir. Now each file gets a
+report_files row (owner, type, period, size, sha256, created/expires), and
+listings and downloads go through that table only.
+
+Files live under REPORTS_DIR in two levels of shard directories taken from a
+random token (3f/a0/3fa0..._patient_8_treatments.csv), so no directory
+grows with the number of users. Regenerating a report expires the previous
+one for the same owner, type and period; purge_expired_reports() (the
+tasks.purge_expired_reports beat job) deletes expired files, then their rows.
+"""
+import os
+import re
+import hashlib
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, User, ReportFile
+
+TREATMENTS, APPOINTMENTS, MONTHLY = "treatments", "appointments", "monthly"
+
+# days a file stays downloadable; REPORT_RETENTION_DAYS sets it for on-demand exports
+EXPORT_RETENTION_DAYS = int(os.environ.get("REPORT_RETENTION_DAYS", 30))
+RETENTION_DAYS = {
+    TREATMENTS: EXPORT_RETENTION_DAYS,
+    APPOINTMENTS: EXPORT_RETENTION_DAYS,
+    MONTHLY: 365,
+}
+PURGE_BATCH = 500
+
+# names of files written before the catalog existed: group 1 is the owner id, then year and month
+LEGACY_NAMES = [
+    (re.compile(r"^patient_(\d+)_treatments\.csv$"), TREATMENTS),
+    (re.compile(r"^doctor_(\d+)_appointments\.csv$"), APPOINTMENTS),
+    (re.compile(r"^doctor_(\d+)_report_(\d{4})_(\d{2})\.html$"), MONTHLY),
+]
+
+
+def reports_dir():
+    return current_app.config["REPORTS_DIR"]
+
+
+def absolute_path(relative):
+    return os.path.join(reports_dir(), *relative.split("/"))
+
+
+def shard_path(filename):
+    """A fresh relative path for filename, e.g. 3f/a0/3fa0c2..._patient_8_treatments.csv."""
+    token = uuid.uuid4().hex
+    return f"{token[:2]}/{token[2:4]}/{token}_{filename}"
+
+
+def file_digest(path):
+    """(size in bytes, sha256 hex) of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def remove_file(relative):
+    """Delete a report file and its shard directories once they are empty."""
+    path = absolute_path(relative)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break  # not empty (or already gone)
+
+
+def register_report(owner_id, report_type, filename, relative, period=None, created_at=None):
+    """
+    Catalog a file already at REPORTS_DIR/relative and expire the owner's
+    previous report of the same type and period. The caller commits.
+    """
+    size, checksum = file_digest(absolute_path(relative))
+    created_at = created_at or datetime.now()
+    now = datetime.now()
+    ReportFile.query.filter(
+        ReportFile.owner_id == owner_id,
+        ReportFile.report_type == report_type,
+        ReportFile.period.is_not_distinct_from(period),
+        ReportFile.expires_at > now,
+    ).update({ReportFile.expires_at: now}, synchronize_session=False)
+    report = ReportFile(
+        owner_id=owner_id, report_type=report_type, period=period, filename=filename,
+        path=relative, size=size, checksum=checksum, created_at=created_at,
+        expires_at=created_at + timedelta(days=RETENTION_DAYS[report_type]),
+    )
+    db.session.add(report)
+    return report
+
+
+def write_report(owner_id, report_type, filename, write, period=None):
+    """
+    Create a report file with write(text_file) in a temp file next to its
+    shard path, rename it into place and catalog it. The caller commits.
+    """
+    relative = shard_path(filename)
+    path = absolute_path(relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".report-")
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return register_report(owner_id, report_type, filename, relative, period)
+
+
+def live_reports():
+    """Query for reports that have not expired, newest first."""
+    return ReportFile.query.filter(ReportFile.expires_at > datetime.now()).order_by(ReportFile.id.desc())
+
+
+def expire_reports(owner_id):
+    """Hand all of a user's reports to the next purge, e.g. when the user is deleted; the caller commits."""
+    ReportFile.query.filter(
+        ReportFile.owner_id == owner_id, ReportFile.expires_at > datetime.now(),
+    ).update({ReportFile.expires_at: datetime.now()}, synchronize_session=False)
+
+
+def purge_expired_reports(now=None):
+    """
+    Delete expired files, then their rows, PURGE_BATCH at a time. A crash
+    in between leaves rows whose file is gone, which the next run removes.
+    Returns the number of reports purged.
+    """
+    now = now or datetime.now()
+    purged = 0
+    while True:
+        rows = (
+            db.session.query(ReportFile.id, ReportFile.path)
+            .filter(ReportFile.expires_at <= now)
+            .order_by(ReportFile.id)
+            .limit(PURGE_BATCH)
+            .all()
+        )
+        if not rows:
+            return purged
+        for _, relative in rows:
+            remove_file(relative)
+        ReportFile.query.filter(ReportFile.id.in_([r.id for r in rows])).delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(rows)
+
+
+def import_legacy_reports():
+    """
+    Move the flat reports/*.csv|html files of known names into shard
+    directories and catalog them, dated by mtime (used by migrations.py).
+    Files of unknown users or names stay where they are. The caller commits.
+    """
+    directory = reports_dir()
+    if not os.path.isdir(directory):
+        return 0
+    user_ids = {user_id for (user_id,) in db.session.query(User.id)}
+    imported = 0
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        for pattern, report_type in LEGACY_NAMES:
+            match = pattern.match(name)
+            if match:
+                break
+        else:
+            continue
+        owner_id = int(match.group(1))
+        if owner_id not in user_ids:
+            continue
+        period = f"{match.group(2)}-{match.group(3)}" if report_type == MONTHLY else None
+        created_at = datetime.fromtimestamp(os.path.getmtime(path))
+
+        relative = shard_path(name)
+        os.makedirs(os.path.dirname(absolute_path(relative)), exist_ok=True)
+        os.replace(path, absolute_path(relative))
+        register_report(owner_id, report_type, name, relative, period, created_at)
+        imported += 1
+    return imported
@@ -0,0 +1,64 @@
+"""
+Blocked and unapproved accounts, enforced on every JWT-protected request.
+
+Blocking a user only stops their next login; tokens they already hold stay
+valid until they expire. Each process keeps the ids of blocked users and
+unapproved doctors in a frozenset that the token_in_blocklist_loader checks
+with no database access.
+
+Every change to User.blocked / User.approve bumps the REVOCATION_VERSION
+row of hospital_stats in the same transaction. A process compares that
+version at most every POLL_SECONDS, and reloads the set only when it moved.
+The process that made the change calls revoked_users.refresh(wait=True)
+after committing, so the change applies there at once.
+"""
+import threading
+import time
+
+from sqlalchemy import and_, or_
+
+from models import db, User, HospitalStat
+from stats import bump_stat
+
+REVOCATION_VERSION = "auth:revocation_version"
+# how stale another process's copy may get
+POLL_SECONDS = 2.0
+
+
+def bump_revocation_version():
+    """Call in the transaction that blocks/unblocks/approves/rejects a user; the caller commits."""
+    bump_stat(REVOCATION_VERSION)
+
+
+class RevocationSet:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.user_ids = frozenset()
+        self.checked_at = 0.0
+
+    def is_revoked(self, user_id):
+        if time.monotonic() - self.checked_at >= POLL_SECONDS:
+            self.refresh()
+        return user_id in self.user_ids
+
+    def refresh(self, wait=False):
+        """Reload if the version moved; without wait, skip when another thread is already refreshing."""
+        if not self.lock.acquire(blocking=wait):
+            return
+        try:
+            version = db.session.query(HospitalStat.value).filter_by(name=REVOCATION_VERSION).scalar() or 0
+            if version != self.version:
+                self.user_ids = frozenset(
+                    user_id for (user_id,) in db.session.query(User.id).filter(or_(
+                        User.blocked == True,
+                        and_(User.role == "doctor", User.approve == False),
+                    ))
+                )
+                self.version = version
+            self.checked_at = time.monotonic()
+        finally:
+            self.lock.release()
+
+
+revoked_users = RevocationSet()
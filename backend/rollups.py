@@ -0,0 +1,156 @@
+"""
+Daily appointment rollups behind /admin/analytics.
+
+appointment_rollups holds one count per (day, doctor, department, status).
+Every write that creates an appointment, changes its status or moves it to
+another day calls track_appointment() with -1 for the old state and +1 for
+the new one, in the same transaction, like the dashboard counters in
+stats.py. Trends and top-N lists then read a few rows per day instead of
+scanning appointments. Archiving (archive.py) moves rows without touching
+the rollups, which count both tiers.
+
+rebuild_rollups() recounts everything from both tiers: the backfill-rollups
+command, migration 10 and bulk imports use it.
+"""
+from datetime import timedelta
+
+from sqlalchemy import case, delete, func, insert, select, update
+
+from models import db, AppointmentRollup
+from archive import through_tiers
+
+# (response key, status counted; None for all of them)
+MEASURES = (
+    ("bookings", None),
+    ("booked", "Booked"),
+    ("completed", "Completed"),
+    ("cancelled", "Cancelled"),
+)
+MEASURE_NAMES = tuple(name for name, _ in MEASURES)
+DAY, MONTH = "day", "month"
+
+
+def rollup_key(appt):
+    return appt.date, appt.doctor_id or 0, appt.department_id or 0, appt.status or "Booked"
+
+
+def bump_rollup(day, doctor_id, department_id, status, delta=1):
+    """Add delta to one rollup row on the current session; the caller commits."""
+    if not delta or day is None:
+        return
+    R = AppointmentRollup
+    result = db.session.execute(
+        update(R)
+        .where(R.day == day, R.doctor_id == doctor_id, R.department_id == department_id, R.status == status)
+        .values(count=R.count + delta)
+    )
+    if result.rowcount == 0:
+        db.session.add(R(day=day, doctor_id=doctor_id, department_id=department_id, status=status, count=delta))
+        db.session.flush()
+
+
+def track_appointment(appt, delta=1):
+    """Count (delta=1) or uncount (delta=-1) an appointment as it stands right now."""
+    bump_rollup(*rollup_key(appt), delta)
+
+
+def rebuild_rollups():
+    """Recount the rollups from the hot and archived appointments; the caller commits."""
+    def tier(appointment, _):
+        return select(
+            appointment.date.label("day"),
+            func.coalesce(appointment.doctor_id, 0).label("doctor_id"),
+            func.coalesce(appointment.department_id, 0).label("department_id"),
+            func.coalesce(appointment.status, "Booked").label("status"),
+        ).where(appointment.date.is_not(None))
+
+    appointments = through_tiers(tier)
+    counts = (
+        select(appointments.c.day, appointments.c.doctor_id, appointments.c.department_id, appointments.c.status,
+               func.count())
+        .group_by(appointments.c.day, appointments.c.doctor_id, appointments.c.department_id, appointments.c.status)
+    )
+    db.session.execute(delete(AppointmentRollup))
+    db.session.execute(
+        insert(AppointmentRollup).from_select(["day", "doctor_id", "department_id", "status", "count"], counts)
+    )
+    return db.session.query(func.coalesce(func.sum(AppointmentRollup.count), 0)).scalar()
+
+
+def measure_columns():
+    R = AppointmentRollup
+    return [
+        func.sum(R.count if status is None else case((R.status == status, R.count), else_=0)).label(name)
+        for name, status in MEASURES
+    ]
+
+
+def rollup_filters(date_from, date_to, doctor_id=None, department_id=None):
+    R = AppointmentRollup
+    conditions = [R.day >= date_from, R.day <= date_to]
+    if doctor_id is not None:
+        conditions.append(R.doctor_id == doctor_id)
+    if department_id is not None:
+        conditions.append(R.department_id == department_id)
+    return conditions
+
+
+def bucket_of(day, bucket):
+    return day.strftime("%Y-%m") if bucket == MONTH else day.isoformat()
+
+
+def bucket_starts(date_from, date_to, bucket):
+    """Every day (or first of every month) from date_from to date_to, so empty periods show up as zeros."""
+    day = date_from.replace(day=1) if bucket == MONTH else date_from
+    while day <= date_to:
+        yield max(day, date_from)
+        if bucket == MONTH:
+            day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            day += timedelta(days=1)
+
+
+def rollup_series(date_from, date_to, bucket=DAY, doctor_id=None, department_id=None):
+    """[{"period", "bookings", "booked", "completed", "cancelled"}] per day or month, oldest first."""
+    R = AppointmentRollup
+    series = {
+        bucket_of(day, bucket): dict.fromkeys(MEASURE_NAMES, 0)
+        for day in bucket_starts(date_from, date_to, bucket)
+    }
+    rows = (
+        db.session.query(R.day, *measure_columns())
+        .filter(*rollup_filters(date_from, date_to, doctor_id, department_id))
+        .group_by(R.day)
+    )
+    for row in rows:
+        totals = series[bucket_of(row.day, bucket)]
+        for name in MEASURE_NAMES:
+            totals[name] += getattr(row, name)
+    return [{"period": period, **totals} for period, totals in series.items()]
+
+
+def rollup_leaders(date_from, date_to, rank="bookings", limit=5, doctor_id=None, department_id=None):
+    """
+    The limit doctors and departments with the highest rank measure in the
+    range, from a single scan: ([{"doctor_id", "bookings", ...}], [{"department_id", ...}]).
+    """
+    R = AppointmentRollup
+    measure_of = {status: name for name, status in MEASURES if status}
+    leaders = {"doctor_id": {}, "department_id": {}}
+    rows = (
+        db.session.query(R.doctor_id, R.department_id, R.status, func.sum(R.count))
+        .filter(*rollup_filters(date_from, date_to, doctor_id, department_id))
+        .group_by(R.doctor_id, R.department_id, R.status)
+    )
+    for doctor, department, status, n in rows:
+        for column, key in (("doctor_id", doctor), ("department_id", department)):
+            if not key:
+                continue
+            entry = leaders[column].setdefault(key, {column: key, **dict.fromkeys(MEASURE_NAMES, 0)})
+            entry["bookings"] += n
+            if status in measure_of:
+                entry[measure_of[status]] += n
+    return tuple(
+        sorted(entries.values(), key=lambda e: (-e[rank], e[column]))[:limit]
+        for column, entries in leaders.items()
+    )
@@ -0,0 +1,92 @@
+"""
+Counters behind /admin/dashboard.
+
+Every write that changes a count bumps the matching hospital_stats row in
+the same transaction, so the dashboard reads a handful of rows instead of
+counting whole tables. recompute_stats() rebuilds them from scratch; the
+reconcile task runs it nightly, which also rolls "upcoming" over to the new
+day and corrects any drift. Archived appointments (archive.py) still count;
+moving them between tiers changes no counter.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, update
+
+from models import db, User, Appointment, AppointmentArchive, HospitalStat
+
+UPCOMING = "appointments:upcoming"
+TOTAL_APPOINTMENTS = "appointments:total"
+# rows recompute_stats() owns
+COUNTED_PREFIXES = ("users:", "appointments:")
+
+
+def user_stat(role):
+    return f"users:{role}"
+
+
+def status_stat(status):
+    return f"appointments:{status}"
+
+
+def bump_stat(name, delta=1):
+    """Add delta to a counter on the current session; the caller commits."""
+    if not delta:
+        return
+    result = db.session.execute(
+        update(HospitalStat).where(HospitalStat.name == name).values(value=HospitalStat.value + delta)
+    )
+    if result.rowcount == 0:
+        db.session.add(HospitalStat(name=name, value=delta))
+        db.session.flush()
+
+
+def is_upcoming(day):
+    return day is not None and day >= datetime.now().date()
+
+
+def track_new_appointment(appt):
+    bump_stat(TOTAL_APPOINTMENTS)
+    bump_stat(status_stat(appt.status))
+    if is_upcoming(appt.date):
+        bump_stat(UPCOMING)
+
+
+def track_status_change(old_status, new_status):
+    if old_status != new_status:
+        bump_stat(status_stat(old_status), -1)
+        bump_stat(status_stat(new_status))
+
+
+def track_date_change(old_date, new_date):
+    bump_stat(UPCOMING, int(is_upcoming(new_date)) - int(is_upcoming(old_date)))
+
+
+def recompute_stats():
+    """Recount everything from the base tables and overwrite the counters; the caller commits."""
+    values = {user_stat(role): n for role, n in db.session.query(User.role, func.count(User.id)).group_by(User.role)}
+    values[TOTAL_APPOINTMENTS] = 0
+    # column counts, not Appointment.query: migration 3 runs this before later columns exist
+    for model in (Appointment, AppointmentArchive):
+        for status, n in db.session.query(model.status, func.count(model.id)).group_by(model.status):
+            values[status_stat(status)] = values.get(status_stat(status), 0) + n
+            values[TOTAL_APPOINTMENTS] += n
+    # archived appointments are all in the past
+    values[UPCOMING] = (
+        db.session.query(func.count(Appointment.id)).filter(Appointment.date >= datetime.now().date()).scalar()
+    )
+
+    existing = {s.name: s for s in HospitalStat.query.all()}
+    for name, stat in existing.items():
+        # other rows (e.g. revocation.REVOCATION_VERSION) are not counts of anything
+        if name not in values and name.startswith(COUNTED_PREFIXES):
+            stat.value = 0
+    for name, value in values.items():
+        if name in existing:
+            existing[name].value = value
+        else:
+            db.session.add(HospitalStat(name=name, value=value))
+    return values
+
+
+def read_stats():
+    return dict(db.session.query(HospitalStat.name, HospitalStat.value).all())
@@ -0,0 +1,131 @@
+"""
+Shared fixtures. Each test gets a fresh file-backed SQLite database built
+by initialize_database() (so the migrations run too), report files go to
+a temp directory, mail is suppressed and Celery tasks run inline.
+
+    cd backend
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+from datetime import time as Time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TMP_DIR = tempfile.mkdtemp(prefix="hms-tests-")
+DB_PATH = os.path.join(TMP_DIR, "hospital.db")
+# app.py reads these at import time
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+os.environ["MAIL_SUPPRESS_SEND"] = "1"
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.security import generate_password_hash
+
+import revocation
+from app import app as flask_app, celery, initialize_database
+from models import db, User, Department, DoctorProfile, AvailabilityTemplate
+
+celery.conf.task_always_eager = True
+flask_app.config["REPORTS_DIR"] = os.path.join(TMP_DIR, "reports")
+
+PASSWORD = "secret123"
+
+
+def remove_database():
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+
+@pytest.fixture
+def app():
+    remove_database()
+    initialize_database()
+    # the per-process revocation set would otherwise keep the last test's ids
+    revocation.revoked_users.__init__()
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """login(username) -> Authorization headers for that user."""
+    def login(username, password=PASSWORD):
+        response = client.post("/login", json={"username": username, "password": password})
+        assert response.status_code == 200, response.get_json()
+        return {"Authorization": "Bearer " + response.get_json()["access_token"]}
+    return login
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, role="patient", **fields):
+        user = User(
+            username=username, password=generate_password_hash(PASSWORD), role=role,
+            approve=True, blocked=False, **fields,
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def make_doctor(make_user):
+    """make_doctor(username, weekdays=range(7), start, end, slot_minutes) -> User with a profile and weekly hours."""
+    def make_doctor(username, weekdays=range(7), start=Time(11, 0), end=Time(17, 0), slot_minutes=30):
+        department = Department.query.filter_by(name="General Medicine").first()
+        if department is None:
+            department = Department(name="General Medicine")
+            db.session.add(department)
+            db.session.flush()
+        doctor = make_user(username, role="doctor")
+        db.session.add(DoctorProfile(user_id=doctor.id, specialization_id=department.id))
+        for weekday in weekdays:
+            db.session.add(AvailabilityTemplate(
+                doctor_id=doctor.id, weekday=weekday, start_time=start, end_time=end, slot_minutes=slot_minutes,
+            ))
+        db.session.commit()
+        return doctor
+    return make_doctor
+
+
+class StatementCounter:
+    """Counts SQL statements sent to the database while installed."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+@pytest.fixture
+def count_statements(monkeypatch):
+    """count_statements(fn) -> (fn(), number of SQL statements it ran)."""
+    # the revocation set re-checks its version every POLL_SECONDS; on a slow
+    # run that extra query would land in whichever request happens to be counted
+    monkeypatch.setattr(revocation, "POLL_SECONDS", float("inf"))
+
+    def count_statements(fn):
+        counter = StatementCounter()
+        event.listen(Engine, "before_cursor_execute", counter)
+        try:
+            result = fn()
+        finally:
+            event.remove(Engine, "before_cursor_execute", counter)
+        return result, counter.count
+    return count_statements
@@ -0,0 +1,84 @@
+import base64
+from datetime import date, time as Time, timedelta
+
+from models import db, Appointment, PatientProfile
+
+
+def test_admin_doctors_can_be_fetched_by_id(client, login, make_doctor, make_user):
+    doctors = [make_doctor(f"doc{i}@hms.test") for i in range(4)]
+    make_user("admin@hms.test", role="admin")
+    headers = login("admin@hms.test")
+
+    response = client.get(f"/admin/doctors?ids={doctors[3].id},{doctors[1].id}", headers=headers)
+    assert response.status_code == 200
+    assert [d["username"] for d in response.get_json()["items"]] == ["doc1@hms.test", "doc3@hms.test"]
+
+    assert client.get("/admin/doctors?ids=1,x", headers=headers).status_code == 400
+
+
+def test_admin_patients_come_with_their_profiles(client, login, make_user):
+    patients = [make_user(f"pat{i}@hms.test") for i in range(3)]
+    db.session.add(PatientProfile(user_id=patients[1].id, full_name="Anna Muller", age=41, contact="555-0101"))
+    db.session.commit()
+    make_user("admin@hms.test", role="admin")
+    headers = login("admin@hms.test")
+
+    items = client.get("/admin/patients", headers=headers).get_json()["items"]
+    assert [p["profile"] and p["profile"]["full_name"] for p in items] == [None, "Anna Muller", None]
+
+    response = client.get(f"/admin/patients?ids={patients[1].id}", headers=headers)
+    (item,) = response.get_json()["items"]
+    assert (item["username"], item["profile"]["contact"]) == ("pat1@hms.test", "555-0101")
+
+
+def add_appointments(doctors, patient):
+    """Three days x two times x every doctor, so (date, time) ties are broken by id; returns them."""
+    appts = [
+        Appointment(
+            doctor_id=doctor.id, patient_id=patient.id, date=date.today() + timedelta(days=day), time=Time(hour, 0),
+            status="Booked" if (day + hour) % 2 else "Cancelled",
+        )
+        for day in range(3) for hour in (11, 14) for doctor in doctors
+    ]
+    db.session.add_all(appts)
+    db.session.commit()
+    return appts
+
+
+def test_admin_appointments_pages_newest_first_without_gaps(client, login, make_doctor, make_user):
+    doctors = [make_doctor(f"doc{i}@hms.test") for i in range(3)]
+    appts = add_appointments(doctors, make_user("pat@hms.test"))
+    make_user("admin@hms.test", role="admin")
+    headers = login("admin@hms.test")
+
+    def walk(query, limit):
+        ids, cursor = [], None
+        while True:
+            path = f"/admin/appointments?limit={limit}&{query}" + (f"&cursor={cursor}" if cursor else "")
+            body = client.get(path, headers=headers).get_json()
+            ids.append([a["id"] for a in body["items"]])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return ids
+
+    newest_first = sorted(appts, key=lambda a: (a.date, a.time, a.id), reverse=True)
+    pages = walk("", 4)
+    assert sum(pages, []) == [a.id for a in newest_first]
+    assert [len(page) for page in pages] == [4, 4, 4, 4, 2]
+
+    # filters run in SQL, before the limit, so every page but the last is full
+    doctor = doctors[1]
+    pages = walk(f"status=Booked&doctor_id={doctor.id}", 2)
+    matching = [a.id for a in newest_first if a.doctor_id == doctor.id and a.status == "Booked"]
+    assert sum(pages, []) == matching
+    assert [len(page) for page in pages] == [2, 1]
+
+
+def test_admin_appointments_reject_a_malformed_cursor(client, login, make_user):
+    make_user("admin@hms.test", role="admin")
+    headers = login("admin@hms.test")
+
+    for cursor in ("not-a-cursor", base64.urlsafe_b64encode(b"2026-01-01|11:00").decode(),
+                   base64.urlsafe_b64encode(b"yesterday|11:00|1").decode()):
+        response = client.get(f"/admin/appointments?cursor={cursor}", headers=headers)
+        assert response.status_code == 400, cursor
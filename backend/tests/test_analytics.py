@@ -0,0 +1,32 @@
+from datetime import date, timedelta
+
+import datagen
+from app import MAX_ANALYTICS_DAYS
+from models import db, Appointment, AppointmentRollup
+
+
+def test_generated_data_is_counted_in_the_rollups(app):
+    counts = datagen.generate(doctors=2, patients=5, appointments=50)
+
+    assert db.session.query(db.func.sum(AppointmentRollup.count)).scalar() == counts["appointments"]
+    assert AppointmentRollup.query.filter(AppointmentRollup.count < 0).count() == 0
+    assert Appointment.query.count() == counts["appointments"]
+
+
+def test_day_buckets_are_clamped_to_the_largest_span(client, login, make_user):
+    make_user("admin@hms.test", role="admin")
+    headers = login("admin@hms.test")
+    date_to = date.today()
+
+    def analytics(bucket, days):
+        path = f"/admin/analytics?bucket={bucket}&from={date_to - timedelta(days=days - 1)}&to={date_to}"
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        return response.get_json()
+
+    body = analytics("day", 10 * 365)
+    assert len(body["series"]) == MAX_ANALYTICS_DAYS
+    assert body["from"] == str(date_to - timedelta(days=MAX_ANALYTICS_DAYS - 1))
+
+    assert len(analytics("day", 30)["series"]) == 30
+    assert analytics("month", 10 * 365)["from"] == str(date_to - timedelta(days=10 * 365 - 1))
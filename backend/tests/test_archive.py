@@ -0,0 +1,51 @@
+from datetime import date, time as Time, timedelta
+
+from archive import archive_old_appointments
+from models import db, Appointment, AppointmentArchive, EmailOutbox, Treatment
+
+
+def add_old_visit(doctor, patient):
+    appt = Appointment(
+        doctor_id=doctor.id, patient_id=patient.id, date=date.today() - timedelta(days=400),
+        time=Time(11, 0), status="Completed",
+    )
+    db.session.add(appt)
+    db.session.flush()
+    db.session.add(Treatment(appointment_id=appt.id, diagnosis="Flu"))
+    db.session.commit()
+    return appt.id
+
+
+def test_archived_ids_are_not_handed_out_again(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    archived_id = add_old_visit(doctor, patient)  # the highest id, then moved out of the hot table
+    assert archive_old_appointments() == 1
+
+    day = str(date.today() + timedelta(days=1))
+    response = client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": "11:00 AM"}, headers=login("pat@hms.test"))
+    assert response.status_code == 201
+    appt = Appointment.query.one()
+    assert appt.id != archived_id
+    assert EmailOutbox.query.filter_by(subject="Appointment Confirmation").count() == 1
+
+    response = client.post(f"/doctor/appointments/{appt.id}/complete", json={"diagnosis": "Cold"}, headers=login("doc@hms.test"))
+    assert response.status_code == 200, response.get_json()
+    assert db.session.get(AppointmentArchive, archived_id).status == "Completed"
+
+
+def test_doctor_lists_count_archived_appointments(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    regular, former = make_user("regular@hms.test"), make_user("former@hms.test")
+    add_old_visit(doctor, former)
+    add_old_visit(doctor, regular)
+    db.session.add(Appointment(doctor_id=doctor.id, patient_id=regular.id, date=date.today(), time=Time(11, 0), status="Booked"))
+    db.session.commit()
+    assert archive_old_appointments() == 2
+
+    patients = client.get("/doctor/patients", headers=login("doc@hms.test")).get_json()
+    assert sorted(p["username"] for p in patients) == ["former@hms.test", "regular@hms.test"]
+
+    make_user("admin@hms.test", role="admin")
+    doctors = client.get("/admin/doctors?with_counts=1", headers=login("admin@hms.test")).get_json()["items"]
+    assert [d["appointment_count"] for d in doctors] == [3]
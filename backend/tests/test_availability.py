@@ -0,0 +1,45 @@
+from datetime import date, time as Time, timedelta
+
+from models import db, Appointment
+
+
+def book_every_other_day(doctor, patient, first_day, days):
+    for i in range(0, days, 2):
+        db.session.add(Appointment(
+            doctor_id=doctor.id, patient_id=patient.id, date=first_day + timedelta(days=i),
+            time=Time(11, 0), status="Booked",
+        ))
+    db.session.commit()
+
+
+def test_availability_query_count_does_not_grow_with_the_window(client, login, make_doctor, make_user, count_statements):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    first_day = date.today() + timedelta(days=1)
+    book_every_other_day(doctor, patient, first_day, 180)
+    headers = login("pat@hms.test")
+
+    def fetch(days):
+        path = f"/doctor/{doctor.id}/availability?from={first_day}&to={first_day + timedelta(days=days - 1)}"
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        return response.get_json()["availability"]
+
+    fetch(1)  # warm per-process caches (e.g. the token revocation version)
+    counts = {}
+    for days in (1, 7, 30, 180):
+        availability, counts[days] = count_statements(lambda: fetch(days))
+        assert len(availability) == days
+    assert len(set(counts.values())) == 1, counts
+
+
+def test_booked_slots_are_not_offered(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    day = date.today() + timedelta(days=1)
+    book_every_other_day(doctor, patient, day, 1)
+
+    response = client.get(f"/doctor/{doctor.id}/availability?from={day}&to={day}", headers=login("pat@hms.test"))
+    slots = response.get_json()["availability"][0]["slots"]
+    assert "11:00 AM" not in slots
+    assert "11:30 AM" in slots
@@ -0,0 +1,130 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time as Time, timedelta
+
+from sqlalchemy import func
+
+from models import db, Appointment, AvailabilityTemplate
+
+THREADS = 200
+SLOTS = ("11:00 AM", "11:30 AM", "12:00 PM", "12:30 PM", "01:00 PM")
+
+
+def book_in_parallel(app, headers, bodies):
+    """POST every body to /appointments/book at once, one thread (and test client) each; returns the statuses."""
+    barrier = threading.Barrier(len(bodies))
+
+    def book(i):
+        client = app.test_client()
+        barrier.wait()
+        return client.post("/appointments/book", json=bodies[i], headers=headers[i % len(headers)]).status_code
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        return list(pool.map(book, range(len(bodies))))
+
+
+def duplicate_slots():
+    """(doctor_id, date, time, rows) for every slot held by more than one Booked appointment."""
+    return (
+        db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time, func.count())
+        .filter(Appointment.status == "Booked")
+        .group_by(Appointment.doctor_id, Appointment.date, Appointment.time)
+        .having(func.count() > 1)
+        .all()
+    )
+
+
+def test_parallel_bookings_of_one_slot_give_one_201_and_409s(app, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    for i in range(4):
+        make_user(f"pat{i}@hms.test")
+    headers = [login(f"pat{i}@hms.test") for i in range(4)]
+    body = {"doctor_id": doctor.id, "date": str(date.today() + timedelta(days=1)), "time": "11:00 AM"}
+
+    statuses = book_in_parallel(app, headers, [body] * THREADS)
+
+    assert Counter(statuses) == {201: 1, 409: THREADS - 1}
+    assert Appointment.query.filter_by(doctor_id=doctor.id, status="Booked").count() == 1
+
+
+def test_parallel_bookings_across_slots_give_one_201_per_slot(app, login, make_doctor, make_user):
+    doctors = [make_doctor(f"doc{i}@hms.test") for i in range(2)]
+    for i in range(4):
+        make_user(f"pat{i}@hms.test")
+    headers = [login(f"pat{i}@hms.test") for i in range(4)]
+    day = str(date.today() + timedelta(days=1))
+    slots = [(doctor.id, at) for doctor in doctors for at in SLOTS]
+    bodies = [
+        {"doctor_id": doctor_id, "date": day, "time": at}
+        for doctor_id, at in (slots[i % len(slots)] for i in range(THREADS))
+    ]
+
+    statuses = book_in_parallel(app, headers, bodies)
+
+    assert Counter(statuses) == {201: len(slots), 409: THREADS - len(slots)}
+    assert Appointment.query.filter_by(status="Booked").count() == len(slots)
+    assert duplicate_slots() == []
+
+
+def add_long_slots(doctor):
+    """45-minute slots from 11:15, overlapping the doctor's 30-minute ones from 11:00."""
+    for weekday in range(7):
+        db.session.add(AvailabilityTemplate(
+            doctor_id=doctor.id, weekday=weekday, start_time=Time(11, 15), end_time=Time(13, 30), slot_minutes=45,
+        ))
+    db.session.commit()
+
+
+def test_overlapping_slots_cannot_both_be_booked(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    add_long_slots(doctor)
+    make_user("pat@hms.test")
+    headers = login("pat@hms.test")
+    day = str(date.today() + timedelta(days=1))
+
+    def book(at):
+        return client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": at}, headers=headers)
+
+    assert book("11:00 AM").status_code == 201
+    slots = client.get(f"/doctor/{doctor.id}/availability?from={day}&to={day}", headers=headers).get_json()["availability"][0]["slots"]
+    assert "11:15 AM" not in slots  # 11:15-12:00 runs into the 11:00-11:30 booking
+    assert "11:30 AM" in slots
+    assert book("11:15 AM").status_code == 409
+    assert book("12:00 PM").status_code == 201  # a 45-minute slot clear of the 30-minute booking
+
+
+def test_only_offered_slots_can_be_booked_or_rescheduled_to(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    make_user("pat@hms.test")
+    headers = login("pat@hms.test")
+    day = str(date.today() + timedelta(days=1))
+
+    response = client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": "11:20 AM"}, headers=headers)
+    assert response.status_code == 400
+    response = client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": "05:00 PM"}, headers=headers)
+    assert response.status_code == 400
+
+    assert client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": "11:00 AM"}, headers=headers).status_code == 201
+    appointment_id = Appointment.query.one().id
+    response = client.post(f"/appointments/{appointment_id}/reschedule", json={"date": day, "time": "11:45 AM"}, headers=headers)
+    assert response.status_code == 400
+    response = client.post(f"/appointments/{appointment_id}/reschedule", json={"date": day, "time": "11:30 AM"}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_parallel_bookings_of_overlapping_slots_give_one_201(app, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    add_long_slots(doctor)
+    make_user("pat@hms.test")
+    headers = [login("pat@hms.test")]
+    day = str(date.today() + timedelta(days=1))
+    bodies = [
+        {"doctor_id": doctor.id, "date": day, "time": "11:00 AM" if i % 2 else "11:15 AM"}
+        for i in range(THREADS)
+    ]
+
+    statuses = book_in_parallel(app, headers, bodies)
+
+    assert Counter(statuses) == {201: 1, 409: THREADS - 1}
+    assert Appointment.query.filter_by(doctor_id=doctor.id, status="Booked").count() == 1
@@ -0,0 +1,36 @@
+import conditional
+from conditional import table_versions, version_stat
+from models import db, Department
+
+
+def department_stamp():
+    return table_versions(["departments"])[version_stat("departments")]
+
+
+def test_stamps_move_after_commit_and_not_inside_the_writers_transaction(app):
+    before = department_stamp()
+
+    db.session.add(Department(name="Cardiology"))
+    db.session.flush()
+    assert department_stamp() == before  # no stamp row written (or locked) by the writer
+    db.session.commit()
+    assert department_stamp() == before + 1
+
+    db.session.add(Department(name="Neurology"))
+    db.session.flush()
+    db.session.rollback()
+    db.session.add(Department(name="Oncology"))
+    db.session.commit()
+    assert department_stamp() == before + 2  # the rolled-back write is not counted, nor bumped twice
+
+
+def test_releasing_a_savepoint_leaves_the_stamps_to_the_outer_commit(app, monkeypatch):
+    bumps = []
+    monkeypatch.setattr(conditional, "bump_table_versions", lambda connection, tables: bumps.append(set(tables)))
+
+    for name in ("Cardiology", "Neurology"):
+        with db.session.begin_nested():
+            db.session.add(Department(name=name))
+    assert bumps == []  # bumping now would wait on the write lock this transaction holds
+    db.session.commit()
+    assert bumps == [{"departments"}]
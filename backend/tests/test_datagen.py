@@ -0,0 +1,12 @@
+import datagen
+from availability import check_slot
+from models import Appointment
+
+
+def test_generated_appointments_sit_in_offered_slots(app):
+    # 150 appointments a doctor is more than a week of 12-slot days, so the calendar crosses a Sunday
+    datagen.generate(doctors=2, patients=5, appointments=300)
+
+    appts = Appointment.query.all()
+    assert {a.date.weekday() for a in appts} <= set(datagen.WORKING_WEEKDAYS)
+    assert [a.id for a in appts if check_slot(a.doctor_id, a.date, a.time, ignore_appointment_id=a.id)] == []
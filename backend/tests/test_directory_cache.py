@@ -0,0 +1,21 @@
+from models import db, Department
+
+
+def test_department_doctors_see_writes_made_outside_the_web_process(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    make_user("pat@hms.test")
+    headers = login("pat@hms.test")
+    department = Department.query.filter_by(name="General Medicine").one()
+
+    def doctor_names():
+        response = client.get(f"/departments/{department.id}", headers=headers)
+        assert response.status_code == 200
+        return [d["name"] for d in response.get_json()["doctors"]]
+
+    assert doctor_names() == ["doc@hms.test"]
+    # what flask import, datagen or a Celery worker would do: commit, with no cache call
+    doctor.approve = False
+    db.session.commit()
+    assert doctor_names() == []
+    make_doctor("doc2@hms.test")
+    assert doctor_names() == ["doc2@hms.test"]
@@ -0,0 +1,42 @@
+from datetime import date, time as Time, timedelta
+
+from models import db, Appointment, Department, Treatment
+
+
+def add_appointments(doctor, patients, first_day, count):
+    """count past appointments spread over the patients, every other one completed with a treatment."""
+    department = Department.query.filter_by(name="General Medicine").one()
+    for i in range(count):
+        appt = Appointment(
+            doctor_id=doctor.id, patient_id=patients[i % len(patients)].id,
+            department_id=department.id,
+            date=first_day - timedelta(days=i), time=Time(11, 0),
+            status="Completed" if i % 2 else "Booked",
+        )
+        db.session.add(appt)
+        if i % 2:
+            db.session.flush()
+            db.session.add(Treatment(appointment_id=appt.id, diagnosis="Flu"))
+    db.session.commit()
+
+
+def test_doctor_appointments_query_count_does_not_grow_with_the_rows(client, login, make_doctor, make_user, count_statements):
+    doctor = make_doctor("doc@hms.test")
+    patients = [make_user(f"pat{i}@hms.test") for i in range(10)]
+    headers = login("doc@hms.test")
+
+    def fetch():
+        response = client.get("/doctor/appointments", headers=headers)
+        assert response.status_code == 200
+        return response.get_json()
+
+    fetch()  # warm per-process caches (e.g. the token revocation version)
+    counts = {}
+    first_day = date.today() + timedelta(days=1)
+    for total in (2, 20, 100):
+        existing = Appointment.query.count()
+        add_appointments(doctor, patients, first_day - timedelta(days=existing), total - existing)
+        rows, counts[total] = count_statements(fetch)
+        assert len(rows) == total
+        assert {row["patient_name"] for row in rows} <= {p.username for p in patients}
+    assert len(set(counts.values())) == 1, counts
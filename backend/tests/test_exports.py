@@ -0,0 +1,51 @@
+from datetime import date, time as Time, timedelta
+
+from app import export_professional_service_requests, export_treatments_csv
+from archive import archive_old_appointments
+from models import db, Appointment, Treatment
+
+
+def add_visits(doctor, patient):
+    """An old completed visit (archived below) and a recent one, both treated, plus an upcoming booking."""
+    for days_ago, status in ((400, "Completed"), (3, "Completed"), (-2, "Booked")):
+        appt = Appointment(
+            doctor_id=doctor.id, patient_id=patient.id, date=date.today() - timedelta(days=days_ago),
+            time=Time(11, 0), status=status,
+        )
+        db.session.add(appt)
+        db.session.flush()
+        if status == "Completed":
+            db.session.add(Treatment(appointment_id=appt.id, diagnosis=f"Visit {days_ago} days ago"))
+    db.session.commit()
+    assert archive_old_appointments() == 1
+
+
+def read(path):
+    with open(path, newline="") as f:
+        return f.read()
+
+
+def test_streamed_doctor_export_matches_the_report_file(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    add_visits(doctor, make_user("pat@hms.test"))
+    make_user("admin@hms.test", role="admin")
+
+    response = client.get(f"/admin/export/{doctor.id}?stream=1", headers=login("admin@hms.test"))
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    streamed = response.get_data(as_text=True)
+
+    assert streamed == read(export_professional_service_requests(doctor.id))
+    assert len(streamed.splitlines()) == 1 + 3  # header, archived, hot and upcoming
+
+
+def test_streamed_treatment_export_matches_the_report_file(client, login, make_doctor, make_user):
+    patient = make_user("pat@hms.test")
+    add_visits(make_doctor("doc@hms.test"), patient)
+
+    response = client.get("/patient/export_treatments?stream=1", headers=login("pat@hms.test"))
+    assert response.status_code == 200
+    streamed = response.get_data(as_text=True)
+
+    assert streamed == read(export_treatments_csv(patient.id))
+    assert "Visit 400 days ago" in streamed and "Visit 3 days ago" in streamed
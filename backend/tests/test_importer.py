@@ -0,0 +1,110 @@
+import json
+from datetime import date, timedelta
+
+from models import db, Appointment, AppointmentRollup, Department, Treatment, User
+from stats import COUNTED_PREFIXES, read_stats, recompute_stats
+
+PAST = date.today() - timedelta(days=10)
+FUTURE = date.today() + timedelta(days=10)
+
+
+def write_files(tmp_path):
+    """Legacy exports with a few bad rows; returns the import command's file options."""
+    files = {
+        "departments.csv": "id,name,description\n70,Cardiology,Heart\n",
+        "doctors.jsonl": json.dumps({"id": "D1", "username": "doc@hms.test", "password": "secret123", "department_id": "70"}) + "\n",
+        "patients.csv": (
+            "id,username,password,full_name,age\n"
+            "P10,anna@hms.test,secret123,Anna Muller,41\n"
+            "P11,ben@hms.test,secret123,Ben Okafor,35\n"
+            "P12,carl@hms.test,secret123,Carl,not a number\n"
+        ),
+        "appointments.csv": (
+            "id,patient_id,doctor_id,date,time,status,remarks\n"
+            f"A100,P10,D1,{PAST},11:00,completed,legacy A100\n"
+            f"A101,P11,D1,{FUTURE},11:00 AM,Booked,legacy A101\n"
+            f"A102,P10,D1,{FUTURE},11:00,Booked,legacy A102\n"
+            f"A103,P99,D1,{FUTURE},12:00,Booked,legacy A103\n"
+            f"A104,P11,D1,{PAST},14:30,Cancelled,legacy A104\n"
+        ),
+        "treatments.jsonl": (
+            json.dumps({"id": "T1", "appointment_id": "A100", "diagnosis": "Migraine"}) + "\n"
+            + json.dumps({"id": "T2", "appointment_id": "A999", "diagnosis": "Flu"}) + "\n"
+        ),
+    }
+    options = []
+    for name, content in files.items():
+        (tmp_path / name).write_text(content)
+        options += ["--" + name.split(".")[0], str(tmp_path / name)]
+    return options
+
+
+def run_import(app, tmp_path, *extra):
+    report_path = tmp_path / "report.json"
+    result = app.test_cli_runner().invoke(args=[
+        "import", *write_files(tmp_path), "--batch-size", "2", "--workers", "1",
+        "--id-map", str(tmp_path / "ids.jsonl"), "--report", str(report_path), *extra,
+    ])
+    assert result.exit_code == 0, result.output
+    return json.loads(report_path.read_text())
+
+
+def test_import_maps_legacy_ids_and_reports_bad_rows(app, tmp_path):
+    report = run_import(app, tmp_path)
+
+    counts = report["counts"]
+    assert counts["patients"]["inserted"] == 2 and counts["patients"]["invalid"] == 1
+    assert counts["appointments"]["inserted"] == 3 and counts["appointments"]["invalid"] == 2
+    assert counts["treatments"]["inserted"] == 1 and counts["treatments"]["invalid"] == 1
+    errors = {(e["file"], e["line"]): e["message"] for e in report["errors"]}
+    assert errors[("patients.csv", 4)] == "age must be a whole number"
+    assert errors[("appointments.csv", 4)].startswith("rejected by the database")  # A101 holds the slot
+    assert errors[("appointments.csv", 5)] == "patient_id P99 is not among the imported patients"
+    assert errors[("treatments.jsonl", 2)] == "appointment_id A999 is not among the imported appointments"
+
+    users = {u.username: u for u in User.query}
+    appts = {a.remarks: a for a in Appointment.query}
+    assert sorted(appts) == ["legacy A100", "legacy A101", "legacy A104"]
+    a100 = appts["legacy A100"]
+    assert (a100.patient_id, a100.doctor_id) == (users["anna@hms.test"].id, users["doc@hms.test"].id)
+    assert a100.department_id == Department.query.filter_by(name="Cardiology").one().id
+    assert appts["legacy A101"].patient_id == users["ben@hms.test"].id
+    (treatment,) = Treatment.query.all()
+    assert treatment.appointment_id == a100.id
+
+    ids = {}
+    for line in (tmp_path / "ids.jsonl").read_text().splitlines():
+        entry = json.loads(line)
+        ids.setdefault(entry["kind"], {}).update(entry["ids"])
+    assert ids["appointments"] == {"A100": a100.id, "A101": appts["legacy A101"].id, "A104": appts["legacy A104"].id}
+
+
+def test_import_leaves_counters_and_rollups_matching_the_data(app, tmp_path):
+    run_import(app, tmp_path)
+
+    counters = {name: value for name, value in read_stats().items() if name.startswith(COUNTED_PREFIXES)}
+    assert counters == recompute_stats()
+    db.session.rollback()
+    assert (counters["appointments:total"], counters["users:patient"], counters["users:doctor"]) == (3, 2, 1)
+
+    rollups = {}
+    for r in AppointmentRollup.query:
+        rollups[r.status] = rollups.get(r.status, 0) + r.count
+    assert rollups == {"Completed": 1, "Booked": 1, "Cancelled": 1}
+
+
+def test_dry_run_leaves_the_database_unchanged(app, tmp_path):
+    def snapshot():
+        return (
+            [(u.id, u.username) for u in User.query.order_by(User.id)],
+            Department.query.count(), Appointment.query.count(), Treatment.query.count(),
+            AppointmentRollup.query.count(), read_stats(),
+        )
+
+    before = snapshot()
+    report = run_import(app, tmp_path, "--dry-run")
+
+    assert report["dry_run"] is True
+    assert report["counts"]["appointments"]["inserted"] == 3  # validated and inserted, then rolled back
+    assert snapshot() == before
+    assert not (tmp_path / "ids.jsonl").exists()
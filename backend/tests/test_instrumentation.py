@@ -0,0 +1,16 @@
+from instrumentation import MetricsRegistry
+
+
+def test_render_emits_one_block_per_metric_family():
+    registry = MetricsRegistry()
+    registry.record(("GET", "/a", 200), 3, 0.002, 0.001, 0.004)
+    registry.record(("POST", "/b", 201), 5, 0.010, 0.002, 0.030)
+
+    families = []
+    for line in registry.render().splitlines():
+        if line.startswith("# TYPE "):
+            families.append(line.split()[2])
+            continue
+        name = line.split("{")[0]
+        assert name.startswith(families[-1]), f"{name} sample under the {families[-1]} block"
+    assert len(families) == len(set(families)) == 5
@@ -0,0 +1,19 @@
+import app as app_module
+from migrations import MIGRATIONS, current_version
+
+
+def test_upgrade_db_reports_the_schema_version(app):
+    result = app.test_cli_runner().invoke(args=["upgrade-db"])
+    assert result.exit_code == 0, result.output
+    assert f"Schema version: {MIGRATIONS[-1][0]}" in result.output
+    assert current_version() == MIGRATIONS[-1][0]
+
+
+def test_upgrade_db_fails_with_a_nonzero_exit_status(app, monkeypatch):
+    def broken_upgrade():
+        raise RuntimeError("Cancel the duplicate bookings first")
+
+    monkeypatch.setattr(app_module, "upgrade_schema", broken_upgrade)
+    result = app.test_cli_runner().invoke(args=["upgrade-db"])
+    assert result.exit_code != 0
+    assert "Upgrade failed: Cancel the duplicate bookings first" in result.output
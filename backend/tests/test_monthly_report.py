@@ -0,0 +1,40 @@
+from datetime import date, time as Time, timedelta
+
+import app as app_module
+from archive import archive_old_appointments
+from models import db, Appointment, AppointmentArchive, Treatment
+
+
+class QueuedGroup:
+    """Stands in for celery.group: keeps the signatures instead of sending them."""
+    jobs = []
+
+    def __init__(self, jobs):
+        QueuedGroup.jobs = list(jobs)
+
+    def apply_async(self):
+        pass
+
+
+def test_monthly_report_includes_archived_appointments(app, make_doctor, make_user, monkeypatch):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    first = (date.today().replace(day=1) - timedelta(days=400)).replace(day=1)
+    for day, status in ((first, "Completed"), (first + timedelta(days=1), "Cancelled"), (first + timedelta(days=2), "Booked")):
+        appt = Appointment(doctor_id=doctor.id, patient_id=patient.id, date=day, time=Time(11, 0), status=status)
+        db.session.add(appt)
+        db.session.flush()
+        if status == "Completed":
+            db.session.add(Treatment(appointment_id=appt.id, diagnosis="Flu", prescription="Rest"))
+    db.session.commit()
+    assert archive_old_appointments() == 2
+    assert AppointmentArchive.query.count() == 2
+
+    monkeypatch.setattr(app_module, "group", QueuedGroup)
+    app_module.monthly_doctor_activity(first.year, first.month)
+
+    (job,) = QueuedGroup.jobs
+    doctor_id, _, rows, summary = job.args
+    assert doctor_id == doctor.id
+    assert (summary["total"], summary["completed"], summary["cancelled"]) == (3, 1, 1)
+    assert [(r["status"], r["diagnosis"]) for r in rows] == [("Completed", "Flu"), ("Cancelled", ""), ("Booked", "")]
@@ -0,0 +1,29 @@
+from datetime import date, timedelta
+
+from models import Appointment, EmailOutbox
+
+
+def test_every_cancellation_of_a_rebooked_appointment_is_emailed(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    make_user("pat@hms.test")
+    headers = login("pat@hms.test")
+    day = str(date.today() + timedelta(days=1))
+
+    response = client.post("/appointments/book", json={"doctor_id": doctor.id, "date": day, "time": "11:00 AM"}, headers=headers)
+    assert response.status_code == 201, response.get_json()
+    appointment_id = Appointment.query.filter_by(doctor_id=doctor.id).one().id
+
+    def post(action, **slot):
+        response = client.post(f"/{action}", json=slot, headers=headers)
+        assert response.status_code == 200, response.get_json()
+
+    post(f"patient/appointments/{appointment_id}/cancel")
+    post(f"appointments/{appointment_id}/reschedule", date=day, time="11:30 AM")
+    post(f"appointments/{appointment_id}/reschedule", date=day, time="11:00 AM")
+    post(f"patient/appointments/{appointment_id}/cancel")
+
+    subjects = [row.subject for row in EmailOutbox.query.order_by(EmailOutbox.id)]
+    assert subjects == [
+        "Appointment Confirmation", "Appointment Cancelled",
+        "Appointment Rescheduled", "Appointment Rescheduled", "Appointment Cancelled",
+    ]
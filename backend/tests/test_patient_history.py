@@ -0,0 +1,90 @@
+from datetime import date, time as Time, timedelta
+
+from archive import archive_old_appointments
+from models import db, Appointment, Treatment
+
+
+def add_visits(doctor, patient, count, first_day):
+    """count treated visits going back a week at a time from first_day, two per day; newest first."""
+    visits = []
+    for i in range(count):
+        appt = Appointment(
+            doctor_id=doctor.id, patient_id=patient.id, date=first_day - timedelta(weeks=i // 2),
+            time=Time(11 + i % 2, 0), status="Completed",
+        )
+        db.session.add(appt)
+        db.session.flush()
+        treatment = Treatment(appointment_id=appt.id, diagnosis=f"Visit {i}")
+        db.session.add(treatment)
+        db.session.flush()
+        visits.append((appt.date, appt.time, treatment.id))
+    db.session.commit()
+    return sorted(visits, reverse=True)
+
+
+def walk(client, path, headers, key):
+    """Follow next_cursor from the first page to the last; returns the pages' rows."""
+    pages, cursor = [], None
+    while True:
+        response = client.get(path + (f"&cursor={cursor}" if cursor else ""), headers=headers)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        pages.append(body[key])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_history_pages_newest_first_over_both_tiers(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    # 60 weeks back, so the oldest visits move to the archive tier
+    visits = add_visits(doctor, patient, 120, date.today() - timedelta(days=1))
+    assert archive_old_appointments() > 0
+    headers = login("pat@hms.test")
+
+    pages = walk(client, f"/patient/{patient.id}/history?limit=7", headers, "history")
+    rows = sum(pages, [])
+    assert [(r["date"], r["time"]) for r in rows] == [(str(d), str(t)) for d, t, _ in visits]
+    assert [len(page) for page in pages[:-1]] == [7] * (len(pages) - 1)
+
+    pages = walk(client, "/patient/treatments?limit=7", headers, "items")
+    assert [r["treatment_id"] for r in sum(pages, [])] == [i for _, _, i in visits]
+
+    date_from, date_to = visits[50][0], visits[11][0]
+    pages = walk(client, f"/patient/treatments?limit=4&from={date_from}&to={date_to}", headers, "items")
+    assert [r["treatment_id"] for r in sum(pages, [])] == [i for d, _, i in visits if date_from <= d <= date_to]
+
+
+def test_only_the_treating_doctor_sees_a_patients_history(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    make_doctor("other@hms.test")
+    patient = make_user("pat@hms.test")
+    make_user("someone@hms.test")
+    make_user("admin@hms.test", role="admin")
+    add_visits(doctor, patient, 1, date.today() - timedelta(days=1))
+    path = f"/patient/{patient.id}/history"
+
+    assert client.get(path, headers=login("doc@hms.test")).status_code == 200
+    assert client.get(path, headers=login("other@hms.test")).status_code == 403
+    assert client.get(path, headers=login("someone@hms.test")).status_code == 403
+    assert client.get(path, headers=login("admin@hms.test")).status_code == 200
+
+
+def test_history_query_count_does_not_grow_with_the_page(client, login, make_doctor, make_user, count_statements):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    add_visits(doctor, patient, 150, date.today() - timedelta(days=1))
+    headers = login("doc@hms.test")
+
+    def fetch(limit):
+        response = client.get(f"/patient/{patient.id}/history?limit={limit}", headers=headers)
+        assert response.status_code == 200
+        return response.get_json()["history"]
+
+    fetch(1)  # warm per-process caches (e.g. the token revocation version)
+    counts = {}
+    for limit in (2, 20, 100):
+        history, counts[limit] = count_statements(lambda: fetch(limit))
+        assert len(history) == limit
+    assert len(set(counts.values())) == 1, counts
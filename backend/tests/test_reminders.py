@@ -0,0 +1,63 @@
+from datetime import date, time as Time
+
+import flask_mail
+
+from app import daily_reminder, mail, send_reminder_chunk, summarize_reminders
+from models import db, Appointment
+
+
+def book_today(doctor, patients):
+    appts = [
+        Appointment(doctor_id=doctor.id, patient_id=p.id, date=date.today(), time=Time(11 + i, 0), status="Booked")
+        for i, p in enumerate(patients)
+    ]
+    db.session.add_all(appts)
+    db.session.commit()
+    return [a.id for a in appts]
+
+
+def test_a_second_run_sends_nothing(app, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    ids = book_today(doctor, [make_user(f"pat{i}@hms.test") for i in range(3)])
+
+    with mail.record_messages() as outbox:
+        first = send_reminder_chunk(ids)
+        second = send_reminder_chunk(ids)
+
+    assert first == {"sent": 3, "failed": 0, "skipped": 0}
+    assert second == {"sent": 0, "failed": 0, "skipped": 3}
+    assert sorted(m.recipients[0] for m in outbox) == ["pat0@hms.test", "pat1@hms.test", "pat2@hms.test"]
+    assert summarize_reminders([first, second], str(date.today())) == {
+        "date": str(date.today()), "sent": 3, "failed": 0, "skipped": 3,
+    }
+
+
+def test_a_failed_send_is_retried_on_the_next_run(app, make_doctor, make_user, monkeypatch):
+    doctor = make_doctor("doc@hms.test")
+    ids = book_today(doctor, [make_user(f"pat{i}@hms.test") for i in range(3)])
+    send = flask_mail.Connection.send
+
+    def flaky_send(self, message, *args, **kwargs):
+        if message.recipients == ["pat1@hms.test"]:
+            raise OSError("mailbox unavailable")
+        return send(self, message, *args, **kwargs)
+
+    monkeypatch.setattr(flask_mail.Connection, "send", flaky_send)
+    assert send_reminder_chunk(ids) == {"sent": 2, "failed": 1, "skipped": 0}
+    marked = {a.id: a.reminder_sent_at is not None for a in Appointment.query}
+    assert marked == {ids[0]: True, ids[1]: False, ids[2]: True}
+
+    monkeypatch.setattr(flask_mail.Connection, "send", send)
+    assert send_reminder_chunk(ids) == {"sent": 1, "failed": 0, "skipped": 2}
+
+
+def test_daily_reminder_reports_its_summary_task(app, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    book_today(doctor, [make_user("pat@hms.test")])
+
+    result = daily_reminder()
+    assert (result["appointments"], result["chunks"]) == (1, 1)
+    assert result["summary_task_id"]
+    assert Appointment.query.one().reminder_sent_at is not None
+
+    assert daily_reminder() == {"date": str(date.today()), "appointments": 0, "chunks": 0, "summary_task_id": None}
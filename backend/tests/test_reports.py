@@ -0,0 +1,58 @@
+import os
+from datetime import datetime, timedelta
+
+from app import export_professional_service_requests, export_treatments_csv
+from models import db, ReportFile
+from reports import absolute_path, expire_reports, purge_expired_reports
+
+
+def report_ids(client, headers):
+    response = client.get("/patient/reports/list", headers=headers)
+    assert response.status_code == 200
+    return [r["id"] for r in response.get_json()["downloads"]]
+
+
+def test_users_list_and_download_only_their_own_reports(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    anna, ben = make_user("anna@hms.test"), make_user("ben@hms.test")
+    make_user("admin@hms.test", role="admin")
+    export_treatments_csv(anna.id)
+    export_treatments_csv(ben.id)
+    export_professional_service_requests(doctor.id)
+    ids = {r.owner_id: r.id for r in ReportFile.query}
+    headers = {name: login(f"{name}@hms.test") for name in ("anna", "ben", "doc", "admin")}
+
+    assert report_ids(client, headers["anna"]) == [ids[anna.id]]
+    assert report_ids(client, headers["ben"]) == [ids[ben.id]]
+    assert report_ids(client, headers["doc"]) == [ids[doctor.id]]
+
+    def download(who, owner):
+        return client.get(f"/patient/reports/download/{ids[owner.id]}", headers=headers[who]).status_code
+
+    assert download("anna", anna) == 200
+    assert download("anna", ben) == 404
+    assert download("doc", anna) == 404
+    assert download("ben", doctor) == 404
+    assert download("admin", ben) == 200
+
+
+def test_purge_deletes_expired_files_and_their_rows(app, make_user):
+    anna, ben = make_user("anna@hms.test"), make_user("ben@hms.test")
+    export_treatments_csv(anna.id)
+    export_treatments_csv(ben.id)
+    expire_reports(anna.id)
+    db.session.commit()
+    expired, kept = (ReportFile.query.filter_by(owner_id=owner.id).one() for owner in (anna, ben))
+    expired_path, kept_path = absolute_path(expired.path), absolute_path(kept.path)
+    assert os.path.isfile(expired_path) and os.path.isfile(kept_path)
+
+    assert purge_expired_reports() == 1
+    assert not os.path.exists(expired_path)
+    assert not os.path.exists(os.path.dirname(expired_path))  # the emptied shard directory goes too
+    assert [r.owner_id for r in ReportFile.query] == [ben.id]
+    assert os.path.isfile(kept_path)
+
+    # past the retention period the rest goes as well
+    assert purge_expired_reports(now=datetime.now() + timedelta(days=366)) == 1
+    assert ReportFile.query.count() == 0
+    assert not os.path.exists(kept_path)
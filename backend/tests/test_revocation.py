@@ -0,0 +1,43 @@
+from flask_jwt_extended import create_access_token
+
+from models import db
+
+
+def block(client, headers, user, action):
+    response = client.post(f"/admin/block_user/{user.id}", json={"action": action}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_blocking_rejects_tokens_already_issued(client, login, make_user):
+    patient = make_user("pat@hms.test")
+    make_user("admin@hms.test", role="admin")
+    token = login("pat@hms.test")
+    admin = login("admin@hms.test")
+    assert client.get("/patient/appointments", headers=token).status_code == 200
+
+    block(client, admin, patient, "block")
+    response = client.get("/patient/appointments", headers=token)
+    assert response.status_code == 401
+    assert response.get_json()["message"] == "Your account is blocked or not approved."
+
+    block(client, admin, patient, "unblock")
+    assert client.get("/patient/appointments", headers=token).status_code == 200
+
+
+def test_approving_a_doctor_lets_their_token_through(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    doctor.approve = False
+    db.session.commit()
+    make_user("admin@hms.test", role="admin")
+    admin = login("admin@hms.test")
+    # a pending doctor cannot log in, so mint the token they would get once approved
+    token = {"Authorization": "Bearer " + create_access_token(
+        identity=doctor.username, additional_claims={"user_id": doctor.id, "role": "doctor"},
+    )}
+    assert client.get("/doctor/appointments", headers=token).status_code == 401
+
+    block(client, admin, doctor, "approve")
+    assert client.get("/doctor/appointments", headers=token).status_code == 200
+
+    block(client, admin, doctor, "reject")
+    assert client.get("/doctor/appointments", headers=token).status_code == 401
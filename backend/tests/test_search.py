@@ -0,0 +1,60 @@
+from datetime import date, time as Time, timedelta
+
+import fulltext
+from models import db, Appointment, PatientProfile, Treatment
+
+
+def add_patient(make_user, username, full_name):
+    patient = make_user(username)
+    db.session.add(PatientProfile(user_id=patient.id, full_name=full_name))
+    db.session.commit()
+    return patient
+
+
+def add_treatment(doctor, patient, diagnosis):
+    appt = Appointment(
+        doctor_id=doctor.id, patient_id=patient.id, date=date.today() - timedelta(days=1),
+        time=Time(11, 0), status="Completed",
+    )
+    db.session.add(appt)
+    db.session.flush()
+    treatment = Treatment(appointment_id=appt.id, diagnosis=diagnosis)
+    db.session.add(treatment)
+    db.session.commit()
+    return treatment.id
+
+
+def test_search_results_are_scoped_to_the_callers_role(client, login, make_doctor, make_user):
+    doctor, other = make_doctor("doc@hms.test"), make_doctor("other@hms.test")
+    mine = add_patient(make_user, "pat@hms.test", "Anna Muller")
+    theirs = add_patient(make_user, "someone@hms.test", "Anna Smith")
+    my_migraine = add_treatment(doctor, mine, "Migraine")
+    their_migraine = add_treatment(other, theirs, "Migraine")
+    make_user("admin@hms.test", role="admin")
+
+    def search(username, q):
+        response = client.get(f"/search?q={q}", headers=login(username))
+        assert response.status_code == 200
+        return {(item["type"], item["id"]) for item in response.get_json()["items"]}
+
+    assert search("doc@hms.test", "migraine") == {("treatment", my_migraine)}
+    assert search("doc@hms.test", "anna") == {("patient", mine.id)}
+    assert search("pat@hms.test", "migraine") == {("treatment", my_migraine)}
+    assert search("pat@hms.test", "anna") == {("patient", mine.id)}
+    assert search("admin@hms.test", "migraine") == {("treatment", my_migraine), ("treatment", their_migraine)}
+    assert search("admin@hms.test", "anna") == {("patient", mine.id), ("patient", theirs.id)}
+    # the doctor directory is open to everyone
+    assert search("pat@hms.test", "other") == {("doctor", other.id)}
+
+
+def test_ranking_counts_only_the_hits_the_caller_may_see(app, make_doctor, make_user, monkeypatch):
+    doctor, other = make_doctor("doc@hms.test"), make_doctor("other@hms.test")
+    patient = make_user("pat@hms.test")
+    add_treatment(doctor, patient, "Migraine")
+    for i in range(3):
+        add_treatment(other, make_user(f"pat{i}@hms.test"), "Migraine")
+    monkeypatch.setattr(fulltext, "RANKED_MATCH_LIMIT", 2)
+
+    (mine,) = fulltext.search_documents("migraine", "doctor", doctor.id)
+    assert mine["score"] < 0  # bm25, not the unranked 0.0
+    assert {r["score"] for r in fulltext.search_documents("migraine", "admin", None)} == {0.0}
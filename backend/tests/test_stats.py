@@ -0,0 +1,47 @@
+from datetime import date, time as Time, timedelta
+
+from app import reconcile_hospital_stats
+from archive import archive_old_appointments
+from models import db, Appointment
+from stats import COUNTED_PREFIXES, read_stats, recompute_stats
+
+
+def counters():
+    return {name: value for name, value in read_stats().items() if name.startswith(COUNTED_PREFIXES)}
+
+
+def test_counters_match_a_recount_after_mixed_writes(client, login, make_doctor, make_user):
+    doctor = make_doctor("doc@hms.test")
+    patient = make_user("pat@hms.test")
+    db.session.add(Appointment(
+        doctor_id=doctor.id, patient_id=patient.id, date=date.today() - timedelta(days=400),
+        time=Time(11, 0), status="Completed",
+    ))
+    # the fixtures insert rows directly, so start from a recount
+    recompute_stats()
+    db.session.commit()
+
+    response = client.post("/register", json={"username": "new@hms.test", "password": "secret123", "role": "patient"})
+    assert response.status_code == 201
+    headers = login("pat@hms.test")
+    day = date.today() + timedelta(days=1)
+    for at in ("11:00 AM", "11:30 AM", "12:00 PM", "12:30 PM"):
+        response = client.post("/appointments/book", json={"doctor_id": doctor.id, "date": str(day), "time": at}, headers=headers)
+        assert response.status_code == 201
+    booked = [a.id for a in Appointment.query.filter_by(status="Booked").order_by(Appointment.time)]
+
+    assert client.post(f"/patient/appointments/{booked[0]}/cancel", headers=headers).status_code == 200
+    response = client.post(f"/doctor/appointments/{booked[1]}/complete", json={"diagnosis": "Cold"}, headers=login("doc@hms.test"))
+    assert response.status_code == 200
+    response = client.post(f"/appointments/{booked[2]}/reschedule", json={"date": str(day + timedelta(days=1)), "time": "11:00 AM"}, headers=headers)
+    assert response.status_code == 200
+    assert archive_old_appointments() == 1
+
+    maintained = counters()
+    assert maintained == recompute_stats()
+    db.session.rollback()
+    assert maintained["appointments:total"] == 5
+    assert maintained["appointments:Booked"] == 2
+
+    reconcile_hospital_stats()
+    assert counters() == maintained